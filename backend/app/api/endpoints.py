@@ -1,7 +1,9 @@
-from fastapi import APIRouter, UploadFile, File, Query, Header
+from fastapi import APIRouter, UploadFile, File, Query, Header, Request
 from fastapi.responses import StreamingResponse
 import json
 import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, Any, Awaitable, Callable, Dict
 from app.services.gitlab_service import GitLabService
 from app.services.git_service import GitHubService
 # 已移除冗余的异步生成器
@@ -11,14 +13,32 @@ from app.models.schemas import (
     GitSaveRequest, GitSaveResponse, HealthResponse, GitLabCloneRequest,
     GitLabCloneResponse, GitHubCloneRequest, GitHubCloneResponse
 )
-from app.services.test_generator import generate_tests
+from app.services.test_generator import (
+    generate_tests, generate_tests_concurrently, generate_test_events, parse_code_async, resolve_concurrency,
+    prepare_source, resolve_source
+)
+from app.services.parse_cache import get_parse_cache
+from app.services.executors import (
+    run_blocking, get_executors_status, ExecutorSaturatedError, EXECUTOR_AI, EXECUTOR_GIT_API,
+    EXECUTOR_GIT_SUBPROCESS, EXECUTOR_PARSE
+)
 from app.services.git_service import list_directories, save_to_git
 from app.services.parser_factory import ParserFactory
+from app.services.ai_metrics import get_ai_metrics
+from app.services.simple_queue import (
+    execute_with_queue, stream_with_queue, stream_with_cluster_queue, run_with_cluster_queue, register_job_handler,
+    check_queue_load
+)
+from app.services.task_scheduler import QueueFullError, TaskCancelledError, estimate_task_cost, get_scheduler
+from app.services.deadline import Deadline, DeadlineExceededError
 from app.config import settings, AI_MODELS, ai_config_manager, get_ai_models
 from app.utils.logger import logger
 
 router = APIRouter()
 
+# 逐行推送的NDJSON事件流：关闭反向代理（nginx）的响应缓冲，增量内容才能即时到达客户端
+STREAM_HEADERS = {"X-Accel-Buffering": "no"}
+
 def build_gitlab_api_base(repo: str, server_url: str = "") -> tuple[str, str]:
     """
     统一的GitLab API基础URL构建函数
@@ -102,8 +122,11 @@ async def health_check():
     )
 
 @router.post("/generate-test", response_model=GenerateTestResponse)
-async def generate_test(request: GenerateTestRequest):
+async def generate_test(request: GenerateTestRequest, user_id: str = Header(default="anonymous")):
     """生成测试代码"""
+    deadline = Deadline.for_request(request.deadline_seconds)
+    # 只提交了解析句柄时取回登记的代码
+    request.code = await resolve_source(request.code, request.language, request.parse_handle)
     # 检查语言是否支持
     if request.language not in ParserFactory.get_supported_languages():
         logger.warning(f"Unsupported language: {request.language}")
@@ -115,6 +138,9 @@ async def generate_test(request: GenerateTestRequest):
         logger.warning(f"Unsupported model: {request.model}")
         raise ValueError(f"Unsupported model: {request.model}")
 
+    # 预计排队时间超过SLO时直接返回503，不让请求在队列中等到客户端超时
+    await check_queue_load(deadline)
+
     # 生成测试
     logger.info(f"Generating tests for language: {request.language}, model: {request.model}")
     # 如果提供了 Git 信息，使用文件路径
@@ -123,14 +149,49 @@ async def generate_test(request: GenerateTestRequest):
         file_path = request.git_path
         logger.info(f"Using file path from Git: {file_path}")
 
-    tests = generate_tests(request.code, request.language, request.model, file_path)
+    try:
+        if settings.QUEUE_MODE == "distributed":
+            # 分布式模式：由集群中任意实例在集群名额内执行
+            payload = {"request": request.model_dump(), "file_path": file_path, "deadline_at": deadline.timestamp()}
+            result = await run_with_cluster_queue("generate_test", payload, user_id=user_id, lane=request.lane,
+                                                  cost=estimate_task_cost(request.code))
+            if "error" in result:
+                raise ValueError(result["error"])
+            tests = result["tests"]
+        else:
+            tests = await execute_with_queue(
+                lambda: generate_tests(request.code, request.language, request.model, file_path,
+                                       request.max_concurrency, use_cache=not request.bypass_cache,
+                                       pack_mode=request.pack_mode, deadline=deadline),
+                user_id=user_id, lane=request.lane, cost=estimate_task_cost(request.code)
+            )
+    except (QueueFullError, TaskCancelledError, DeadlineExceededError) as e:
+        raise ValueError(str(e))
     logger.info(f"Generated {len(tests)} tests")
 
     return GenerateTestResponse(tests=tests)
 
+async def _distributed_generate_test(job) -> AsyncIterator[str]:
+    """分布式队列中非流式生成测试任务的处理函数，产出一行包含全部测试结果的JSON"""
+    payload = job.payload
+    request = GenerateTestRequest(**payload["request"])
+    deadline = Deadline.from_timestamp(payload["deadline_at"])
+    try:
+        tests = await generate_tests(request.code, request.language, request.model, payload.get("file_path"),
+                                     request.max_concurrency, use_cache=not request.bypass_cache,
+                                     pack_mode=request.pack_mode, deadline=deadline)
+    except DeadlineExceededError as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+        return
+    yield json.dumps({"tests": [test.model_dump() for test in tests]}) + "\n"
+
+register_job_handler("generate_test", _distributed_generate_test)
+
 @router.post("/generate-test-direct")
-async def generate_test_direct(request: GenerateTestRequest):
+async def generate_test_direct(request: GenerateTestRequest, user_id: str = Header(default="anonymous")):
     """直接生成测试代码（非流式）"""
+    deadline = Deadline.for_request(request.deadline_seconds)
+    await check_queue_load(deadline)
     try:
         # 检查语言是否支持
         if request.language not in ParserFactory.get_supported_languages():
@@ -143,7 +204,8 @@ async def generate_test_direct(request: GenerateTestRequest):
             logger.warning(f"Unsupported model: {request.model}")
             return {"error": f"Unsupported model: {request.model}"}
 
-        # 检查代码是否为空
+        # 检查代码是否为空（只提交了解析句柄时取回登记的代码）
+        request.code = await resolve_source(request.code, request.language, request.parse_handle)
         if not request.code or not request.code.strip():
             logger.warning("Empty code provided")
             return {"error": "Empty code provided"}
@@ -152,117 +214,353 @@ async def generate_test_direct(request: GenerateTestRequest):
         logger.info(f"Code length: {len(request.code)} characters")
         logger.info(f"Code preview: {request.code[:100]}...")
 
+        if settings.QUEUE_MODE == "distributed":
+            # 分布式模式：解析和生成都由集群中任意实例在集群名额内执行
+            payload = {"request": request.model_dump(), "deadline_at": deadline.timestamp()}
+            try:
+                return await run_with_cluster_queue("generate_test_direct", payload, user_id=user_id,
+                                                    lane=request.lane, cost=estimate_task_cost(request.code))
+            except (QueueFullError, TaskCancelledError) as e:
+                return {"success": False, "message": str(e), "tests": []}
+
+        return await _direct_generation(
+            request, deadline,
+            lambda generate: execute_with_queue(generate, user_id=user_id, lane=request.lane,
+                                                cost=estimate_task_cost(request.code))
+        )
+    except ExecutorSaturatedError:
+        raise
+    except Exception as e:
+        logger.error(f"生成测试时出错: {str(e)}", exc_info=True)
+        return {
+            "success": False,
+            "message": f"生成测试时出错: {str(e)}",
+            "tests": []
+        }
+
+async def _direct_generation(request: GenerateTestRequest, deadline: Deadline,
+                             run_queued: Callable[[Callable[[], Awaitable[Any]]], Awaitable[Any]]) -> Dict[str, Any]:
+    """
+    解析代码并并发生成测试，返回非流式接口的响应，本地调度和分布式队列的执行实例共用
+
+    Args:
+        request: 生成测试请求（代码已取回）
+        deadline: 请求截止时间
+        run_queued: 在队列名额内执行生成的函数（执行实例已持有集群名额时直接执行）
+
+    Returns:
+        响应字典
+    """
+    # 解析代码
+    try:
+        snippets = await deadline.run(parse_code_async(request.code, request.language), "parse")
+    except ExecutorSaturatedError:
+        raise
+    except DeadlineExceededError:
+        logger.warning("Deadline exceeded while parsing")
+        return {"success": False, "status": "deadline_exceeded", "message": "超过截止时间，代码解析未完成", "tests": []}
+    except Exception as e:
+        logger.error(f"解析 {request.language} 代码失败: {str(e)}")
+        snippets = []
+
+    logger.info(f"解析到 {len(snippets)} 个代码片段")
+
+    # 如果没有找到任何代码片段，直接返回警告
+    if not snippets:
+        logger.warning("No code snippets found")
+        return {
+            "success": False,
+            "message": "没有找到可以生成测试的函数或方法",
+            "tests": []
+        }
+
+    # 记录找到的代码片段
+    for i, snippet in enumerate(snippets):
+        logger.info(f"代码片段 {i+1}: {snippet.name} ({snippet.type})")
+        logger.info(f"代码片段预览: {snippet.code[:100]}...")
+
+    # 对于Java，使用增强的分析器生成针对性测试
+    enhanced_prompt = None
+    if request.language == "java":
+        try:
+            from app.services.java_analyzer import create_enhanced_java_test_prompt
+            enhanced_prompt = await run_blocking(EXECUTOR_PARSE, create_enhanced_java_test_prompt, request.code)
+        except Exception as e:
+            logger.error(f"Java增强提示生成失败: {str(e)}")
+
+    # 并发生成测试
+    concurrency = resolve_concurrency(request.model, request.max_concurrency)
+    logger.info(f"并发生成 {len(snippets)} 个测试，并发数: {concurrency}")
+
+    tests = []
+
+    async def collect_tests():
+        async for result in generate_tests_concurrently(snippets, request.model, concurrency, enhanced_prompt,
+                                                     use_cache=not request.bypass_cache,
+                                                     pack_mode=request.pack_mode, deadline=deadline):
+            if result.file_name is None and deadline.expired:
+                logger.warning(f"为 {result.name} 生成测试超过截止时间")
+            elif result.test_code:
+                logger.info(f"成功生成测试: {result.name}")
+                tests.append({
+                    "index": result.index,
+                    "name": result.name,
+                    "type": result.type,
+                    "test_code": result.test_code,
+                    "original_snippet": {
+                        "name": result.original_snippet.name,
+                        "type": result.original_snippet.type,
+                        "code": result.original_snippet.code,
+                        "language": request.language,
+                        "class_name": result.original_snippet.class_name
+                    }
+                })
+            else:
+                logger.warning(f"为 {result.name} 生成测试失败")
+
+    try:
+        await run_queued(collect_tests)
+    except (QueueFullError, TaskCancelledError) as e:
+        return {"success": False, "message": str(e), "tests": tests}
+
+    tests.sort(key=lambda test: test["index"])
+
+    # 截止时间已到：返回已生成的部分结果
+    if deadline.expired and len(tests) < len(snippets):
+        return {
+            "success": False,
+            "status": "deadline_exceeded",
+            "message": f"超过截止时间，已生成 {len(tests)}/{len(snippets)} 个测试用例",
+            "tests": tests
+        }
+
+    # 返回结果
+    return {
+        "success": True,
+        "message": f"成功生成 {len(tests)} 个测试用例",
+        "tests": tests
+    }
+
+async def _distributed_generate_test_direct(job) -> AsyncIterator[str]:
+    """分布式队列中非流式直接生成任务的处理函数，执行实例已持有集群名额，产出一行响应JSON"""
+    payload = job.payload
+    request = GenerateTestRequest(**payload["request"])
+    deadline = Deadline.from_timestamp(payload["deadline_at"])
+    response = await _direct_generation(request, deadline, lambda generate: generate())
+    yield json.dumps(response) + "\n"
+
+register_job_handler("generate_test_direct", _distributed_generate_test_direct)
+
+def _deadline_exceeded_line(deadline: Deadline, count: int, total: int) -> str:
+    """超过截止时间的状态行，之前已输出的结果即为部分结果"""
+    return json.dumps({
+        "status": "deadline_exceeded",
+        "message": f"超过截止时间（{deadline.budget:g} 秒），已生成 {count}/{total} 个测试用例",
+        "completed": count,
+        "total": total,
+        "deadline_seconds": deadline.budget,
+        "progress": 100
+    }) + "\n"
+
+async def _test_stream_lines(request: GenerateTestRequest, user_id: str, file_path, task,
+                             deadline: Deadline) -> AsyncIterator[str]:
+    """
+    流式生成测试的NDJSON行，本地调度和分布式队列的执行实例共用
+
+    截止时间到达时取消剩余片段的生成，输出 deadline_exceeded 状态后结束。
+
+    Args:
+        request: 生成测试请求
+        user_id: 用户ID
+        file_path: 代码文件路径（可选）
+        task: 调度任务，提供 task_id 并接收进度（update_progress）
+        deadline: 请求截止时间（从请求到达时开始计算，包括排队时间）
+
+    Yields:
+        NDJSON行
+    """
+    count = 0
+    total = 0
+    generating = False
+    try:
+        # 发送初始消息
+        yield json.dumps({
+            "status": "started",
+            "message": "开始生成测试用例",
+            "progress": 5,
+            "user_id": user_id,
+            "task_id": task.task_id
+        }) + "\n"
+
         # 解析代码
         try:
-            parser = ParserFactory.get_parser(request.language)
-            snippets = [s.dict() for s in parser.parse_code(request.code)]
+            snippets = await deadline.run(parse_code_async(request.code, request.language, file_path), "parse")
+        except ExecutorSaturatedError:
+            raise
+        except DeadlineExceededError:
+            logger.warning(f"Deadline exceeded while parsing for task {task.task_id}")
+            yield _deadline_exceeded_line(deadline, 0, 0)
+            return
         except Exception as e:
             logger.error(f"解析 {request.language} 代码失败: {str(e)}")
             snippets = []
 
         logger.info(f"解析到 {len(snippets)} 个代码片段")
 
+        if deadline.expired:
+            logger.warning(f"Deadline exceeded before generation for task {task.task_id}")
+            yield _deadline_exceeded_line(deadline, 0, len(snippets))
+            return
+
+        # 发送解析完成消息
+        yield json.dumps({
+            "status": "parsing_completed",
+            "message": f"代码解析完成，找到 {len(snippets)} 个代码片段",
+            "total_snippets": len(snippets),
+            "progress": 10
+        }) + "\n"
+
         # 如果没有找到任何代码片段，直接返回警告
         if not snippets:
             logger.warning("No code snippets found")
-            return {
-                "success": False,
+            yield json.dumps({
+                "status": "warning",
                 "message": "没有找到可以生成测试的函数或方法",
-                "tests": []
-            }
+                "progress": 100
+            }) + "\n"
+            return
+
+        total = len(snippets)
+        generating = True
+        concurrency = resolve_concurrency(request.model, request.max_concurrency)
+        task.update_progress(completed=0, total=total, current=snippets[0].name)
+
+        yield json.dumps({
+            "status": "generating",
+            "message": f"正在为 {total} 个代码片段生成测试（并发数 {concurrency}）",
+            "current_snippet": snippets[0].name,
+            "progress": 10,
+            "completed": 0,
+            "total": total,
+            "concurrency": concurrency
+        }) + "\n"
+
+        # 并发生成，按完成顺序返回结果并附带原始序号；开启增量时转发模型输出
+        delta_seq = 0
+        deadline_exceeded = False
+        async with aclosing(generate_test_events(snippets, request.model, concurrency,
+                                                 use_cache=not request.bypass_cache,
+                                                 stream_deltas=request.stream_deltas,
+                                                 pack_mode=request.pack_mode,
+                                                 deadline=deadline)) as events:
+            while True:
+                # 各阶段已按剩余预算执行，这里兜底：截止时间一到就不再等待尚未完成的片段
+                try:
+                    event = await deadline.run(events.__anext__(), "generation")
+                except StopAsyncIteration:
+                    break
+                except DeadlineExceededError:
+                    deadline_exceeded = True
+                    break
+
+                if event[0] == "delta":
+                    _, index, delta, attempt = event
+                    delta_seq += 1
+                    yield json.dumps({
+                        "status": "test_code_delta",
+                        "index": index,
+                        "name": snippets[index].name,
+                        "delta": delta,
+                        "attempt": attempt,
+                        "seq": delta_seq
+                    }) + "\n"
+                    continue
+
+                result = event[1]
+                if result.file_name is None and deadline.expired:
+                    # 因截止时间失败的片段不计入完成数
+                    deadline_exceeded = True
+                    continue
+                count += 1
+                task.update_progress(completed=count, current=result.name)
+                logger.info(f"成功生成测试 {count}: {result.name} (index {result.index})")
+
+                # 计算完成进度
+                completion_progress = 10 + (count / total) * 80
+
+                # 将结果转换为JSON字符串
+                yield json.dumps({
+                    "index": result.index,
+                    "name": result.name,
+                    "type": result.type,
+                    "test_code": result.test_code,
+                    "success": result.file_name is not None,
+                    "message": f"成功生成测试: {result.name}",
+                    "progress": int(completion_progress),
+                    "completed": count,
+                    "total": total
+                }) + "\n"
+
+        generating = False
+        # 发送完成消息
+        if deadline_exceeded:
+            logger.warning(f"Deadline exceeded for task {task.task_id}: {count}/{total} snippets generated")
+            yield _deadline_exceeded_line(deadline, count, total)
+        elif count == 0:
+            yield json.dumps({
+                "status": "warning",
+                "message": "没有找到可以生成测试的函数或方法",
+                "progress": 100
+            }) + "\n"
+        else:
+            yield json.dumps({
+                "status": "completed",
+                "message": f"成功生成 {count} 个测试用例",
+                "test_count": count,
+                "success": True,
+                "progress": 100
+            }) + "\n"
+
+    except (GeneratorExit, asyncio.CancelledError):
+        # 客户端断开（不包括通过取消接口取消）时记录放弃的生成和跳过的片段数
+        if generating and not getattr(task, "cancel_requested", False):
+            metrics = get_ai_metrics()
+            metrics.increment(request.model, "abandoned")
+            metrics.increment(request.model, "abandoned_snippets", total - count)
+        raise
+    except Exception as e:
+        logger.error(f"Error in stream generator: {str(e)}", exc_info=True)
+        yield json.dumps({
+            "error": str(e),
+            "status": "error"
+        }) + "\n"
 
-        # 记录找到的代码片段
-        for i, snippet in enumerate(snippets):
-            logger.info(f"代码片段 {i+1}: {snippet['name']} ({snippet['type']})")
-            logger.info(f"代码片段预览: {snippet['code'][:100]}...")
+async def _distributed_test_stream(job) -> AsyncIterator[str]:
+    """分布式队列中流式生成测试任务的处理函数"""
+    payload = job.payload
+    request = GenerateTestRequest(**payload["request"])
+    # 截止时刻按墙上时间跨实例传递，排队时间同样计入预算
+    deadline = Deadline.from_timestamp(payload["deadline_at"])
+    async for line in _test_stream_lines(request, payload["user_id"], payload.get("file_path"), job, deadline):
+        yield line
 
-        # 生成测试
-        tests = []
-        for snippet in snippets:
-            try:
-                logger.info(f"为 {snippet['name']} 生成测试")
-
-                # 生成测试代码
-                if request.language == "java":
-                    # 对于Java，使用增强的分析器生成针对性测试
-                    try:
-                        from app.services.ai_service import generate_test_with_ai
-                        from app.models.schemas import CodeSnippet
-                        from app.services.java_analyzer import create_enhanced_java_test_prompt
-
-                        # 使用Java分析器创建增强的提示
-                        enhanced_prompt = create_enhanced_java_test_prompt(request.code)
-
-                        # 创建代码片段
-                        code_snippet = CodeSnippet(
-                            name=snippet["name"],
-                            type=snippet["type"],
-                            code=snippet["code"],  # 使用原始代码
-                            language=request.language,
-                            class_name=snippet.get("class_name")
-                        )
-
-                        # 使用增强的提示生成测试
-                        test_code = generate_test_with_ai(code_snippet, enhanced_prompt, request.model)
-                    except Exception as e:
-                        logger.error(f"Java测试生成失败: {str(e)}")
-                        test_code = f"// 生成测试失败: {str(e)}"
-                else:
-                    # 对于其他语言，使用基础生成器
-                    try:
-                        from app.services.ai_service import generate_test_with_ai
-                        from app.models.schemas import CodeSnippet
-
-                        # 转换为 CodeSnippet 对象
-                        code_snippet = CodeSnippet(
-                            name=snippet["name"],
-                            type=snippet["type"],
-                            code=snippet["code"],
-                            language=request.language,
-                            class_name=snippet.get("class_name")
-                        )
-
-                        test_code = generate_test_with_ai(code_snippet, None, request.model)
-                    except Exception as e:
-                        logger.error(f"生成 {request.language} 测试失败: {str(e)}")
-                        test_code = f"// 生成测试失败: {str(e)}"
-
-                if test_code:
-                    logger.info(f"成功生成测试: {snippet['name']}")
-                    tests.append({
-                        "name": snippet["name"],
-                        "type": snippet["type"],
-                        "test_code": test_code,
-                        "original_snippet": {
-                            "name": snippet["name"],
-                            "type": snippet["type"],
-                            "code": snippet["code"],
-                            "language": request.language,
-                            "class_name": snippet.get("class_name")
-                        }
-                    })
-                else:
-                    logger.warning(f"为 {snippet['name']} 生成测试失败")
-            except Exception as e:
-                logger.error(f"为 {snippet['name']} 生成测试时出错: {str(e)}", exc_info=True)
+register_job_handler("generate_test_stream", _distributed_test_stream)
 
-        # 返回结果
-        return {
-            "success": True,
-            "message": f"成功生成 {len(tests)} 个测试用例",
-            "tests": tests
-        }
-    except Exception as e:
-        logger.error(f"生成测试时出错: {str(e)}", exc_info=True)
-        return {
-            "success": False,
-            "message": f"生成测试时出错: {str(e)}",
-            "tests": []
-        }
+
+async def _distributed_durable_job(job) -> AsyncIterator[str]:
+    """分布式队列中异步任务（/jobs）的处理函数：接管任务并从检查点继续生成"""
+    from app.services.job_manager import get_job_manager
+    async for line in get_job_manager().run_cluster_job(job):
+        yield line
+
+register_job_handler("durable_job", _distributed_durable_job)
 
 @router.post("/generate-test-stream")
-async def generate_test_stream(request: GenerateTestRequest, user_id: str = Header(default="anonymous")):
+async def generate_test_stream(request: GenerateTestRequest, http_request: Request,
+                               user_id: str = Header(default="anonymous")):
     """流式生成测试代码（使用队列系统）"""
+    deadline = Deadline.for_request(request.deadline_seconds)
+    await check_queue_load(deadline)
     try:
         # 检查语言是否支持
         supported_languages = ["python", "java", "go", "cpp", "csharp"]
@@ -282,7 +580,8 @@ async def generate_test_stream(request: GenerateTestRequest, user_id: str = Head
                 media_type="application/x-ndjson"
             )
 
-        # 检查代码是否为空
+        # 检查代码是否为空（只提交了解析句柄时取回登记的代码）
+        request.code = await resolve_source(request.code, request.language, request.parse_handle)
         if not request.code or not request.code.strip():
             logger.warning("Empty code provided")
             return StreamingResponse(
@@ -293,159 +592,31 @@ async def generate_test_stream(request: GenerateTestRequest, user_id: str = Head
         logger.info(f"Streaming tests for language: {request.language}, model: {request.model}, user: {user_id}")
         logger.info(f"Code length: {len(request.code)} characters")
 
-        # 使用简化的队列系统进行并发控制
-        from services.simple_queue import execute_with_queue
-
         # 获取文件路径
         file_path = None
         if request.git_repo and request.git_path:
             file_path = request.git_path
             logger.info(f"Using file path from Git: {file_path}")
 
-        # 定义流式生成任务
-        async def stream_task():
-            async def stream_generator():
-                try:
-                    # 发送初始消息
-                    yield json.dumps({
-                        "status": "started",
-                        "message": "开始生成测试用例",
-                        "progress": 5,
-                        "user_id": user_id
-                    }) + "\n"
-
-                    # 解析代码
-                    try:
-                        from services.parser_factory import ParserFactory
-                        parser = ParserFactory.get_parser(request.language)
-                        snippets = [s.dict() for s in parser.parse_code(request.code, file_path)]
-                    except Exception as e:
-                        logger.error(f"解析 {request.language} 代码失败: {str(e)}")
-                        snippets = []
-
-                    logger.info(f"解析到 {len(snippets)} 个代码片段")
-
-                    # 发送解析完成消息
-                    yield json.dumps({
-                        "status": "parsing_completed",
-                        "message": f"代码解析完成，找到 {len(snippets)} 个代码片段",
-                        "total_snippets": len(snippets),
-                        "progress": 10
-                    }) + "\n"
-
-                    # 如果没有找到任何代码片段，直接返回警告
-                    if not snippets:
-                        logger.warning("No code snippets found")
-                        yield json.dumps({
-                            "status": "warning",
-                            "message": "没有找到可以生成测试的函数或方法",
-                            "progress": 100
-                        }) + "\n"
-                        return
-
-                    # 计数器
-                    count = 0
-
-                    # 为每个代码片段生成测试
-                    for i, snippet in enumerate(snippets):
-                        try:
-                            logger.info(f"为 {snippet['name']} 生成测试 ({i+1}/{len(snippets)})")
-
-                            # 发送当前进度
-                            current_progress = 10 + (i / len(snippets)) * 80
-                            yield json.dumps({
-                                "status": "generating",
-                                "message": f"正在为 {snippet['name']} 生成测试 ({i+1}/{len(snippets)})",
-                                "current_snippet": snippet['name'],
-                                "progress": int(current_progress),
-                                "completed": i,
-                                "total": len(snippets)
-                            }) + "\n"
-
-                            # 生成测试代码
-                            try:
-                                from services.ai_service import generate_test_with_ai
-                                from models.schemas import CodeSnippet
-
-                                # 转换为 CodeSnippet 对象
-                                code_snippet = CodeSnippet(
-                                    name=snippet["name"],
-                                    type=snippet["type"],
-                                    code=snippet["code"],
-                                    language=request.language,
-                                    class_name=snippet.get("class_name")
-                                )
-
-                                test_code = generate_test_with_ai(code_snippet, None, request.model)
-                            except Exception as e:
-                                logger.error(f"生成 {request.language} 测试失败: {str(e)}")
-                                test_code = f"// 生成测试失败: {str(e)}"
-
-                            if test_code:
-                                count += 1
-                                logger.info(f"成功生成测试 {count}: {snippet['name']}")
-
-                                # 计算完成进度
-                                completion_progress = 10 + ((i + 1) / len(snippets)) * 80
-
-                                # 将结果转换为JSON字符串
-                                yield json.dumps({
-                                    "name": snippet["name"],
-                                    "type": snippet["type"],
-                                    "test_code": test_code,
-                                    "success": True,
-                                    "message": f"成功生成测试: {snippet['name']}",
-                                    "progress": int(completion_progress),
-                                    "completed": count,
-                                    "total": len(snippets)
-                                }) + "\n"
-                            else:
-                                logger.warning(f"为 {snippet['name']} 生成测试失败")
-
-                            # 添加短暂延迟
-                            await asyncio.sleep(0.1)
-
-                        except Exception as snippet_error:
-                            logger.error(f"为 {snippet['name']} 生成测试时出错: {str(snippet_error)}", exc_info=True)
-                            yield json.dumps({
-                                "status": "error",
-                                "message": f"为 {snippet['name']} 生成测试时出错: {str(snippet_error)}"
-                            }) + "\n"
-
-                    # 发送完成消息
-                    if count == 0:
-                        yield json.dumps({
-                            "status": "warning",
-                            "message": "没有找到可以生成测试的函数或方法",
-                            "progress": 100
-                        }) + "\n"
-                    else:
-                        yield json.dumps({
-                            "status": "completed",
-                            "message": f"成功生成 {count} 个测试用例",
-                            "test_count": count,
-                            "success": True,
-                            "progress": 100
-                        }) + "\n"
-
-                except Exception as e:
-                    logger.error(f"Error in stream generator: {str(e)}", exc_info=True)
-                    yield json.dumps({
-                        "error": str(e),
-                        "status": "error"
-                    }) + "\n"
-
-            return stream_generator()
-
-        # 使用队列执行任务
-        async def execute_stream():
-            stream_generator = await execute_with_queue(stream_task, user_id=user_id)
-            async for chunk in stream_generator:
-                yield chunk
+        # 分布式模式：任务进入集群共享队列，由任意实例执行，本实例转发执行实例发布的事件
+        if settings.QUEUE_MODE == "distributed":
+            payload = {"request": request.model_dump(), "user_id": user_id, "file_path": file_path,
+                       "deadline_at": deadline.timestamp()}
+            return StreamingResponse(
+                stream_with_cluster_queue("generate_test_stream", payload, user_id=user_id, lane=request.lane,
+                                          cost=estimate_task_cost(request.code),
+                                          is_disconnected=http_request.is_disconnected),
+                media_type="application/x-ndjson",
+                headers=STREAM_HEADERS
+            )
 
+        # 整个流式生成期间占用队列名额，直到生成结束、被取消或客户端断开（断开时取消剩余片段的生成）
         return StreamingResponse(
-            execute_stream(),
-            media_type="application/x-ndjson"
+            stream_with_queue(lambda task: _test_stream_lines(request, user_id, file_path, task, deadline),
+                              user_id=user_id, lane=request.lane, cost=estimate_task_cost(request.code),
+                              is_disconnected=http_request.is_disconnected),
+            media_type="application/x-ndjson",
+            headers=STREAM_HEADERS
         )
     except Exception as e:
         logger.error(f"Error setting up streaming: {str(e)}", exc_info=True)
@@ -489,7 +660,8 @@ async def upload_file(file: UploadFile = File(...)):
     return UploadFileResponse(
         filename=filename,
         content=content_str,
-        language=language
+        language=language,
+        parse_handle=await prepare_source(content_str, language)
     )
 
 @router.get("/git/repositories", response_model=GitRepositoriesResponse)
@@ -506,12 +678,14 @@ async def get_repositories(
         raise ValueError(f"{platform} token is required")
 
     try:
-        git_service = get_git_service(platform, token, server_url)
-        repos = git_service.list_repositories()
+        git_service = await run_blocking(EXECUTOR_GIT_API, get_git_service, platform, token, server_url)
+        repos = await run_blocking(EXECUTOR_GIT_API, git_service.list_repositories)
 
         logger.info(f"Found {len(repos)} repositories")
         return GitRepositoriesResponse(repositories=repos)
 
+    except ExecutorSaturatedError:
+        raise
     except ValueError as ve:
         # 重新抛出已知的ValueError（如无效token）
         logger.error(f"Validation error: {ve}")
@@ -580,13 +754,14 @@ async def get_directories(
                     params["path"] = path
 
                 logger.info(f"Attempting to access GitLab API: {gitlab_api_url}")
-                response = requests.get(gitlab_api_url, params=params, timeout=10)
+                response = await run_blocking(EXECUTOR_GIT_API, requests.get, gitlab_api_url, params=params, timeout=10)
 
                 # 如果main分支失败，尝试master分支
                 if response.status_code == 404:
                     logger.info("main branch not found, trying master branch")
                     params["ref"] = "master"
-                    response = requests.get(gitlab_api_url, params=params, timeout=10)
+                    response = await run_blocking(EXECUTOR_GIT_API, requests.get, gitlab_api_url, params=params,
+                                                  timeout=10)
 
                 if response.status_code == 200:
                     items = response.json()
@@ -612,16 +787,18 @@ async def get_directories(
                 else:
                     logger.error(f"GitLab API response: {response.status_code}, {response.text[:200]}")
                     raise ValueError(f"Failed to access public repository: HTTP {response.status_code}")
+            except ExecutorSaturatedError:
+                raise
             except Exception as e:
                 logger.error(f"Error accessing public GitLab repository: {e}")
                 raise ValueError(f"Failed to access public repository: {str(e)}")
         else:
             # 有token，使用GitLab API
-            gitlab_service = get_git_service("gitlab", token, server_url)
-            dirs = gitlab_service.list_directories(repo, path)
+            gitlab_service = await run_blocking(EXECUTOR_GIT_API, get_git_service, "gitlab", token, server_url)
+            dirs = await run_blocking(EXECUTOR_GIT_API, gitlab_service.list_directories, repo, path)
     else:
         # GitHub
-        dirs = list_directories(repo, token, path)
+        dirs = await run_blocking(EXECUTOR_GIT_API, list_directories, repo, token, path)
 
     logger.info(f"Found {len(dirs)} directories/files")
 
@@ -663,15 +840,19 @@ async def save_tests_to_git(request: GitSaveRequest):
     if platform == "gitlab":
         # 获取服务器地址，如果没有提供则使用默认值
         server_url = request.server_url or ''
-        gitlab_service = get_git_service("gitlab", request.token, server_url)
-        urls = gitlab_service.save_tests(
+        gitlab_service = await run_blocking(EXECUTOR_GIT_API, get_git_service, "gitlab", request.token, server_url)
+        urls = await run_blocking(
+            EXECUTOR_GIT_API,
+            gitlab_service.save_tests,
             tests=request.tests,
             language=request.language,
             repo_full_name=request.repo,
             base_path=request.path
         )
     else:
-        urls = save_to_git(
+        urls = await run_blocking(
+            EXECUTOR_GIT_API,
+            save_to_git,
             tests=request.tests,
             language=request.language, 
             repo_full_name=request.repo,
@@ -701,21 +882,47 @@ async def get_languages():
 async def get_queue_status():
     """获取任务队列状态"""
     try:
-        from services.simple_queue import get_queue_status
+        from app.services.simple_queue import get_queue_status
+        from app.services.rate_limiter import get_rate_limiter_registry
         status = get_queue_status()
+        cluster = None
+        if settings.QUEUE_MODE == "distributed":
+            from app.services.distributed_queue import get_distributed_queue
+            cluster = await get_distributed_queue().get_status()
+            # 分布式模式下所有生成任务都在集群中执行，本实例的活跃任务包括分布式任务
+            status["tasks"] = status["tasks"] + cluster["tasks"]
+            status["pending_tasks"] += cluster["cluster_pending"]
+            status["estimated_wait"] = cluster["estimated_wait"]
+        # 预计等待时间供nginx和前端在提交前判断，超过SLO的新请求会被拒绝
+        slo = settings.QUEUE_WAIT_SLO_SECONDS
+        estimated_wait = status["estimated_wait"]
         return {
-            "pending_tasks": 0,  # 简化队列没有等待队列
+            "pending_tasks": status["pending_tasks"],
             "running_tasks": status["running_tasks"],
             "ai_tasks_running": status["running_tasks"],  # 简化处理
             "max_concurrent": status["max_concurrent"],
             "max_ai_tasks": status["max_concurrent"],
             "active_streams": status["running_tasks"],
             "stats": {
-                "total_completed": 0,
-                "total_failed": 0,
-                "avg_duration": 0
+                **status["stats"],
+                "total_completed": status["stats"]["completed_tasks"],
+                "total_failed": status["stats"]["failed_tasks"],
+                "avg_duration": status["stats"]["avg_execution_time"]
             },
-            "stream_details": status["tasks"]
+            "latency": status["latency"],
+            "stream_details": status["tasks"],
+            "pending": status["pending"],
+            "recent": status["recent"],
+            "lanes": status["lanes"],
+            "running_cost": status["running_cost"],
+            "max_running_cost": status["max_running_cost"],
+            "estimated_wait": estimated_wait,
+            "service_time": status["service_time"],
+            "wait_slo": slo,
+            "overloaded": slo > 0 and estimated_wait > slo,
+            "cluster": cluster,
+            "provider_limits": get_rate_limiter_registry().get_status(),
+            "executors": get_executors_status()
         }
     except Exception as e:
         logger.error(f"Error getting queue status: {e}")
@@ -725,9 +932,12 @@ async def get_queue_status():
 async def get_task_status(task_id: str, user_id: str = Header(default="anonymous")):
     """获取特定任务状态"""
     try:
-        from services.simple_queue import get_simple_queue
-        queue = get_simple_queue()
-        status = queue.get_task_status(task_id)
+        scheduler = get_scheduler()
+        status = scheduler.get_task_status(task_id)
+        if not status and settings.QUEUE_MODE == "distributed":
+            # 不在本实例调度器中的任务可能在集群中排队或由其他实例执行
+            from app.services.distributed_queue import get_distributed_queue
+            status = await get_distributed_queue().get_job_status(task_id)
 
         if not status:
             return {"error": "Task not found"}
@@ -736,6 +946,7 @@ async def get_task_status(task_id: str, user_id: str = Header(default="anonymous
         if status.get("user_id") != user_id:
             return {"error": "Access denied"}
 
+        status["latency"] = scheduler.get_latency()
         return status
     except Exception as e:
         logger.error(f"Error getting task status: {e}")
@@ -745,13 +956,119 @@ async def get_task_status(task_id: str, user_id: str = Header(default="anonymous
 async def cancel_task(task_id: str, user_id: str = Header(default="anonymous")):
     """取消任务"""
     try:
-        # 简化队列不支持取消，直接返回成功
         logger.info(f"Task cancellation requested by user {user_id} for task {task_id}")
-        return {"message": "Task cancellation not supported in simplified queue"}
+        try:
+            cancelled = get_scheduler().cancel(task_id, user_id=user_id)
+        except PermissionError:
+            return {"error": "Access denied"}
+
+        if not cancelled and settings.QUEUE_MODE == "distributed":
+            # 不在本实例调度器中的任务可能在集群中排队或由其他实例执行
+            from app.services.distributed_queue import get_distributed_queue
+            try:
+                if await get_distributed_queue().cancel(task_id, user_id=user_id):
+                    return {"message": "Task cancellation requested", "task_id": task_id}
+            except PermissionError:
+                return {"error": "Access denied"}
+
+        if not cancelled:
+            return {"error": "Task not found"}
+        return {"message": "Task cancelled", "task_id": task_id}
     except Exception as e:
         logger.error(f"Error cancelling task: {e}")
         return {"error": str(e)}
 
+@router.post("/jobs")
+async def create_job(request: GenerateTestRequest, user_id: str = Header(default="anonymous")):
+    """创建异步生成任务，立即返回任务ID"""
+    try:
+        if request.language not in ParserFactory.get_supported_languages():
+            return {"error": f"Unsupported language: {request.language}"}
+        if request.model not in get_ai_models():
+            return {"error": f"Unsupported model: {request.model}"}
+        request.code = await resolve_source(request.code, request.language, request.parse_handle)
+        if not request.code or not request.code.strip():
+            return {"error": "Empty code provided"}
+
+        from app.services.job_manager import get_job_manager
+        job_id = await get_job_manager().submit(request, user_id)
+        return {"job_id": job_id, "status": "pending"}
+    except Exception as e:
+        logger.error(f"Error creating job: {e}")
+        return {"error": str(e)}
+
+async def _get_owned_job(job_id: str, user_id: str):
+    """读取任务并校验归属，返回 (任务, 错误响应)"""
+    from app.services.job_manager import get_job_manager
+    job = await get_job_manager().get_job(job_id)
+    if job is None:
+        return None, {"error": "Job not found"}
+    if job["user_id"] != user_id:
+        return None, {"error": "Access denied"}
+    return job, None
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, user_id: str = Header(default="anonymous")):
+    """获取异步任务状态和进度"""
+    try:
+        job, error = await _get_owned_job(job_id, user_id)
+        return error or job
+    except Exception as e:
+        logger.error(f"Error getting job: {e}")
+        return {"error": str(e)}
+
+@router.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str, user_id: str = Header(default="anonymous")):
+    """异步任务事件流（NDJSON），连接断开后可重新订阅，已完成的片段会重新输出"""
+    try:
+        job, error = await _get_owned_job(job_id, user_id)
+        if error:
+            return StreamingResponse([json.dumps(error) + "\n"], media_type="application/x-ndjson")
+
+        from app.services.job_manager import get_job_manager
+        return StreamingResponse(get_job_manager().events(job_id), media_type="application/x-ndjson",
+                                 headers=STREAM_HEADERS)
+    except Exception as e:
+        logger.error(f"Error streaming job events: {e}")
+        return StreamingResponse([json.dumps({"error": str(e)}) + "\n"], media_type="application/x-ndjson")
+
+@router.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str, user_id: str = Header(default="anonymous")):
+    """获取异步任务已完成片段的测试结果"""
+    try:
+        job, error = await _get_owned_job(job_id, user_id)
+        if error:
+            return error
+
+        from app.services.job_manager import get_job_manager
+        tests = await get_job_manager().get_results(job_id)
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "completed": job["completed"],
+            "total": job["total"],
+            "tests": tests
+        }
+    except Exception as e:
+        logger.error(f"Error getting job results: {e}")
+        return {"error": str(e)}
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, user_id: str = Header(default="anonymous")):
+    """取消异步任务，已完成片段的结果保留"""
+    try:
+        job, error = await _get_owned_job(job_id, user_id)
+        if error:
+            return error
+
+        from app.services.job_manager import get_job_manager
+        if not await get_job_manager().cancel(job_id):
+            return {"error": f"Job already {job['status']}"}
+        return {"message": "Job cancelled", "job_id": job_id}
+    except Exception as e:
+        logger.error(f"Error cancelling job: {e}")
+        return {"error": str(e)}
+
 @router.post("/git/gitlab/clone")
 async def clone_gitlab_repo(request: GitLabCloneRequest):
     """克隆GitLab仓库"""
@@ -775,7 +1092,9 @@ async def clone_gitlab_repo(request: GitLabCloneRequest):
             clone_path = os.path.join(temp_dir, "repo")
 
             # 执行git clone命令
-            result = subprocess.run(
+            result = await run_blocking(
+                EXECUTOR_GIT_SUBPROCESS,
+                subprocess.run,
                 ["git", "clone", request.repo_url, clone_path],
                 capture_output=True,
                 text=True,
@@ -828,14 +1147,16 @@ async def clone_gitlab_repo(request: GitLabCloneRequest):
         except subprocess.TimeoutExpired:
             logger.error("Git clone timeout")
             raise ValueError("Repository clone timeout")
+        except ExecutorSaturatedError:
+            raise
         except Exception as e:
             logger.error(f"Error cloning public repository: {e}")
             raise ValueError(f"Failed to clone public repository: {str(e)}")
     else:
         # 有令牌，使用GitLab API
         server_url = request.server_url or ''
-        git_service = get_git_service("gitlab", request.token, server_url)
-        result = git_service.clone_repository(request.repo_url, request.path)
+        git_service = await run_blocking(EXECUTOR_GIT_API, get_git_service, "gitlab", request.token, server_url)
+        result = await run_blocking(EXECUTOR_GIT_SUBPROCESS, git_service.clone_repository, request.repo_url, request.path)
         return GitLabCloneResponse(
             success=result.success,
             clone_path=result.clone_path,
@@ -855,8 +1176,8 @@ async def get_gitlab_project(
         logger.warning("GitLab token is empty")
         raise ValueError("GitLab token is required")
 
-    git_service = get_git_service("gitlab", token, server_url)
-    return git_service.get_project(project_id)
+    git_service = await run_blocking(EXECUTOR_GIT_API, get_git_service, "gitlab", token, server_url)
+    return await run_blocking(EXECUTOR_GIT_API, git_service.get_project, project_id)
 
 @router.get("/git/file-content")
 async def get_file_content(
@@ -900,13 +1221,13 @@ async def get_file_content(
             # 先尝试main分支
             params = {"ref": "main"}
             logger.info(f"Attempting to access GitLab file API: {gitlab_api_url}")
-            response = requests.get(gitlab_api_url, params=params, timeout=10)
+            response = await run_blocking(EXECUTOR_GIT_API, requests.get, gitlab_api_url, params=params, timeout=10)
 
             # 如果main分支失败，尝试master分支
             if response.status_code == 404:
                 logger.info("main branch not found, trying master branch")
                 params["ref"] = "master"
-                response = requests.get(gitlab_api_url, params=params, timeout=10)
+                response = await run_blocking(EXECUTOR_GIT_API, requests.get, gitlab_api_url, params=params, timeout=10)
 
             if response.status_code == 200:
                 content = response.text
@@ -931,7 +1252,8 @@ async def get_file_content(
                     "content": content,
                     "language": language,
                     "name": path.split('/')[-1],
-                    "path": path
+                    "path": path,
+                    "parse_handle": await prepare_source(content, language)
                 }
 
                 logger.info(f"File content retrieved from public GitLab repository: {path}")
@@ -941,11 +1263,11 @@ async def get_file_content(
                 raise ValueError(f"Failed to access public repository file: HTTP {response.status_code}")
         else:
             # 使用token访问私有仓库或GitHub
-            git_service = get_git_service(platform, token, server_url)
+            git_service = await run_blocking(EXECUTOR_GIT_API, get_git_service, platform, token, server_url)
 
             if platform == "github":
                 # GitHub服务返回元组 (content, language)
-                content, detected_language = git_service.get_file_content(repo, path)
+                content, detected_language = await run_blocking(EXECUTOR_GIT_API, git_service.get_file_content, repo, path)
 
                 # 获取文件扩展名
                 file_ext = path.split('.')[-1].lower() if '.' in path else ''
@@ -968,7 +1290,8 @@ async def get_file_content(
                     "content": content,
                     "language": language,
                     "name": path.split('/')[-1],
-                    "path": path
+                    "path": path,
+                    "parse_handle": await prepare_source(content, language)
                 }
 
                 logger.info(f"File content retrieved successfully from GitHub: {path}")
@@ -976,7 +1299,7 @@ async def get_file_content(
                 return result
             else:
                 # GitLab服务处理
-                file_content_str = git_service.get_file_content(repo, path)
+                file_content_str = await run_blocking(EXECUTOR_GIT_API, git_service.get_file_content, repo, path)
 
                 # 获取文件扩展名
                 file_ext = path.split('.')[-1].lower() if '.' in path else ''
@@ -998,13 +1321,16 @@ async def get_file_content(
                     "content": file_content_str,
                     "language": language,
                     "name": path.split('/')[-1],
-                    "path": path
+                    "path": path,
+                    "parse_handle": await prepare_source(file_content_str, language)
                 }
 
                 logger.info(f"File content retrieved successfully from GitLab: {path}")
 
                 return result
 
+    except ExecutorSaturatedError:
+        raise
     except Exception as e:
         logger.error(f"Error getting file content: {e}")
         raise ValueError(f"Failed to get file content: {str(e)}")
@@ -1023,14 +1349,16 @@ async def clone_github_repo(request: GitHubCloneRequest):
         raise ValueError("Repository URL is required")
 
     try:
-        git_service = GitHubService(request.token)
-        result = git_service.clone_repository(request.repo_url, request.path)
+        git_service = await run_blocking(EXECUTOR_GIT_API, GitHubService, request.token)
+        result = await run_blocking(EXECUTOR_GIT_SUBPROCESS, git_service.clone_repository, request.repo_url, request.path)
 
         return GitHubCloneResponse(
             success=result["success"],
             clone_path=result["clone_path"],
             repo_info=result["repo_info"]
         )
+    except ExecutorSaturatedError:
+        raise
     except Exception as e:
         logger.error(f"Error cloning GitHub repository: {e}")
         raise ValueError(f"Failed to clone repository: {str(e)}")
@@ -1050,8 +1378,8 @@ async def clone_repo_universal(platform: str, repo_url: str, token: str, path: s
 
     try:
         if platform.lower() == "github":
-            git_service = get_git_service("github", token, server_url)
-            result = git_service.clone_repository(repo_url, path if path else None)
+            git_service = await run_blocking(EXECUTOR_GIT_API, get_git_service, "github", token, server_url)
+            result = await run_blocking(EXECUTOR_GIT_SUBPROCESS, git_service.clone_repository, repo_url, path if path else None)
             return {
                 "success": result["success"],
                 "clone_path": result["clone_path"],
@@ -1059,8 +1387,8 @@ async def clone_repo_universal(platform: str, repo_url: str, token: str, path: s
                 "platform": "github"
             }
         elif platform.lower() == "gitlab":
-            git_service = get_git_service("gitlab", token, server_url)
-            result = git_service.clone_repository(repo_url, path if path else None)
+            git_service = await run_blocking(EXECUTOR_GIT_API, get_git_service, "gitlab", token, server_url)
+            result = await run_blocking(EXECUTOR_GIT_SUBPROCESS, git_service.clone_repository, repo_url, path if path else None)
             return {
                 "success": result.success,
                 "clone_path": result.clone_path,
@@ -1069,6 +1397,8 @@ async def clone_repo_universal(platform: str, repo_url: str, token: str, path: s
         else:
             raise ValueError(f"Unsupported platform: {platform}")
 
+    except ExecutorSaturatedError:
+        raise
     except Exception as e:
         logger.error(f"Error cloning {platform} repository: {e}")
         raise ValueError(f"Failed to clone repository: {str(e)}")
@@ -1135,7 +1465,8 @@ async def add_ai_model(request: dict):
         # 添加自定义标识
         model_config["is_system"] = False
 
-        success = ai_config_manager.add_custom_model(model_name, model_config)
+        # 配置变更会同步失效响应缓存（包括磁盘层），在线程池中执行
+        success = await run_blocking(EXECUTOR_AI, ai_config_manager.add_custom_model, model_name, model_config)
         if success:
             # 更新全局AI_MODELS变量
             global AI_MODELS
@@ -1143,6 +1474,8 @@ async def add_ai_model(request: dict):
             return {"success": True, "message": f"模型 {model_name} 添加成功"}
         else:
             return {"success": False, "error": "添加模型失败"}
+    except ExecutorSaturatedError:
+        raise
     except Exception as e:
         logger.error(f"Error adding AI model: {e}")
         return {"success": False, "error": str(e)}
@@ -1161,7 +1494,8 @@ async def update_ai_model(request: dict):
         if not model_name or not model_config:
             return {"success": False, "error": "模型名称和配置不能为空"}
 
-        success = ai_config_manager.update_model(model_name, model_config)
+        # 配置变更会同步失效响应缓存（包括磁盘层），在线程池中执行
+        success = await run_blocking(EXECUTOR_AI, ai_config_manager.update_model, model_name, model_config)
         if success:
             # 更新全局AI_MODELS变量
             global AI_MODELS
@@ -1169,6 +1503,8 @@ async def update_ai_model(request: dict):
             return {"success": True, "message": f"模型 {model_name} 更新成功"}
         else:
             return {"success": False, "error": "更新模型失败"}
+    except ExecutorSaturatedError:
+        raise
     except Exception as e:
         logger.error(f"Error updating AI model: {e}")
         return {"success": False, "error": str(e)}
@@ -1185,7 +1521,8 @@ async def delete_ai_model(request: dict):
         if not model_name:
             return {"success": False, "error": "模型名称不能为空"}
 
-        success = ai_config_manager.delete_custom_model(model_name)
+        # 配置变更会同步失效响应缓存（包括磁盘层），在线程池中执行
+        success = await run_blocking(EXECUTOR_AI, ai_config_manager.delete_custom_model, model_name)
         if success:
             # 更新全局AI_MODELS变量
             global AI_MODELS
@@ -1193,6 +1530,8 @@ async def delete_ai_model(request: dict):
             return {"success": True, "message": f"模型 {model_name} 删除成功"}
         else:
             return {"success": False, "error": "删除模型失败或模型不存在"}
+    except ExecutorSaturatedError:
+        raise
     except Exception as e:
         logger.error(f"Error deleting AI model: {e}")
         return {"success": False, "error": str(e)}
@@ -1217,3 +1556,67 @@ async def set_default_ai_model(request: dict):
     except Exception as e:
         logger.error(f"Error setting default AI model: {e}")
         return {"success": False, "error": str(e)}
+
+# AI响应缓存管理API接口
+@router.get("/ai-cache/stats")
+async def get_ai_cache_stats():
+    """获取AI响应缓存统计信息"""
+    try:
+        from app.services.response_cache import get_response_cache
+        cache = get_response_cache()
+        if cache is None:
+            return {"success": True, "enabled": False}
+        return {"success": True, "enabled": True, "stats": await run_blocking(EXECUTOR_AI, cache.get_stats)}
+    except Exception as e:
+        logger.error(f"Error getting AI cache stats: {e}")
+        return {"success": False, "error": str(e)}
+
+@router.post("/ai-cache/clear")
+async def clear_ai_cache(request: dict):
+    """清空AI响应缓存"""
+    try:
+        password = request.get("password", "")
+        if not ai_config_manager.verify_password(password):
+            return {"success": False, "error": "密码错误，无权限执行此操作"}
+
+        from app.services.response_cache import get_response_cache
+        cache = get_response_cache()
+        if cache is not None:
+            await run_blocking(EXECUTOR_AI, cache.clear)
+        return {"success": True, "message": "AI响应缓存已清空"}
+    except Exception as e:
+        logger.error(f"Error clearing AI cache: {e}")
+        return {"success": False, "error": str(e)}
+
+@router.get("/ai-metrics")
+async def get_ai_metrics_snapshot(recent: int = 20):
+    """获取AI调用指标（提前终止节省量等）"""
+    try:
+        from app.services.ai_metrics import get_ai_metrics
+        from app.services.hedging import get_hedger
+        from app.services.single_flight import get_single_flight
+        return {
+            "success": True,
+            "metrics": get_ai_metrics().snapshot(recent),
+            "hedging": get_hedger().get_status(),
+            "single_flight": get_single_flight().get_status()
+        }
+    except Exception as e:
+        logger.error(f"Error getting AI metrics: {e}")
+        return {"success": False, "error": str(e)}
+
+@router.get("/executors/status")
+async def get_executors_status_api():
+    """获取分子系统线程池的使用情况（执行数、排队数、饱和度、拒绝次数和等待/执行耗时分位数）"""
+    return {"success": True, "executors": get_executors_status()}
+
+@router.get("/loop/status")
+async def get_loop_status():
+    """获取事件循环延迟分位数、卡顿记录（含阻塞时的调用栈）和检测到的阻塞调用"""
+    from app.services.loop_monitor import get_loop_monitor
+    return {"success": True, "loop": get_loop_monitor().get_status()}
+
+@router.get("/parse-cache/stats")
+async def get_parse_cache_stats():
+    """获取解析结果缓存统计（条目数、占用字节数、命中/未命中和淘汰次数）"""
+    return {"success": True, "parse_cache": get_parse_cache().get_stats()}
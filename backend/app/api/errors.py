@@ -37,6 +37,47 @@ async def value_error_handler(request: Request, exc: ValueError):
         content={"detail": str(exc)},
     )
 
+async def queue_overloaded_handler(request: Request, exc: Exception):
+    """
+    队列过载异常处理器，返回503和根据预计等待时间计算的Retry-After
+
+    Args:
+        request: 请求对象
+        exc: 异常对象（QueueOverloadedError）
+
+    Returns:
+        JSON响应
+    """
+    logger.warning(f"Shedding request to {request.url.path}: {str(exc)}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "detail": "服务繁忙，请稍后重试",
+            "estimated_wait": round(exc.estimated_wait, 1),
+            "retry_after": exc.retry_after
+        },
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+async def executor_saturated_handler(request: Request, exc: Exception):
+    """
+    线程池已满异常处理器，返回503
+
+    Args:
+        request: 请求对象
+        exc: 异常对象（ExecutorSaturatedError）
+
+    Returns:
+        JSON响应
+    """
+    from app.config import settings
+    logger.warning(f"Rejecting request to {request.url.path}: {str(exc)}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "服务繁忙，请稍后重试", "executor": exc.name},
+        headers={"Retry-After": str(settings.EXECUTOR_RETRY_AFTER)},
+    )
+
 async def general_exception_handler(request: Request, exc: Exception):
     """
     通用异常处理器
@@ -1,7 +1,7 @@
 import os
 import hashlib
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable
 from pathlib import Path
 
 # 尝试从 pydantic_settings 导入 BaseSettings（Pydantic v2）
@@ -74,6 +74,130 @@ class Settings(BaseSettings):
     # 向后兼容的环境变量支持
     GITLAB_API_URL: str = os.environ.get("GITLAB_API_URL", GITLAB_DEFAULT_API_URL)
 
+    # AI提供商HTTP连接池配置
+    AI_HTTP2_ENABLED: bool = True
+    AI_HTTP_MAX_CONNECTIONS: int = 20  # 每个提供商的最大连接数
+    AI_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    AI_HTTP_KEEPALIVE_EXPIRY: float = 120.0  # 空闲连接保持时间（秒）
+    AI_HTTP_CONNECT_TIMEOUT: float = 10.0
+    AI_HTTP_DEFAULT_TIMEOUT: float = 60.0
+    AI_HTTP_WARMUP_ENABLED: bool = True
+    AI_HTTP_WARMUP_TIMEOUT: float = 5.0
+
+    # 单个请求内片段并发生成配置（模型可通过 fanout_concurrency 覆盖）
+    AI_FANOUT_DEFAULT_CONCURRENCY: int = 4
+    AI_FANOUT_MAX_CONCURRENCY: int = 16
+
+    # AI响应缓存配置
+    AI_CACHE_ENABLED: bool = True
+    AI_CACHE_TTL_SECONDS: int = 7 * 24 * 3600  # 7天
+    AI_CACHE_MEMORY_MAX_BYTES: int = 1024 * 1024 * 64  # 64MB
+    AI_CACHE_DISK_ENABLED: bool = True
+    AI_CACHE_DB_PATH: str = os.path.join(os.path.dirname(__file__), "../cache/ai_response_cache.db")
+    AI_CACHE_DISK_MAX_ENTRIES: int = 50000
+
+    # 提前终止配置：第一个代码块闭合后关闭上游请求（模型可通过 early_stop 覆盖）
+    AI_EARLY_STOP_ENABLED: bool = True
+    AI_EARLY_STOP_BASELINE_SAMPLE_RATE: float = 0.05  # 完整跑完用于估算节省量的调用比例
+
+    # 提示打包配置（请求通过 pack_mode 开启）
+    AI_PACK_TOKEN_BUDGET: int = 3000  # 每个打包提示中被测代码的token预算
+
+    # 提供商限流配置（按提供商+API密钥，模型可通过 rpm/tpm/max_concurrency 覆盖）
+    AI_RATE_LIMIT_ENABLED: bool = True
+    AI_RATE_LIMIT_DEFAULT_RPM: int = 60  # 每分钟请求数，0表示不限
+    AI_RATE_LIMIT_DEFAULT_TPM: int = 0  # 每分钟token数，0表示不限
+    AI_RATE_LIMIT_OVERLOAD_RETRIES: int = 2  # 过载时重新排队的次数
+    AI_RATE_LIMIT_BACKOFF_BASE: float = 1.0  # 过载重试的指数退避基数（秒），实际等待带随机抖动
+    AI_RATE_LIMIT_BACKOFF_MAX: float = 30.0  # 过载重试的最长等待（秒），提供商要求的 Retry-After 更长时不再重试
+    AI_CONCURRENCY_INITIAL: int = 4
+    AI_CONCURRENCY_MIN: int = 1
+    AI_CONCURRENCY_MAX: int = 16
+    AI_CONCURRENCY_INCREASE: float = 1.0  # 加性增长步长（每个并发窗口）
+    AI_CONCURRENCY_DECREASE_FACTOR: float = 0.5  # 乘性下降系数
+    AI_CONCURRENCY_DECREASE_INTERVAL: float = 2.0  # 两次下降的最小间隔（秒）
+
+    # 对冲请求配置（模型通过 hedge 字段开启，见 app/services/hedging.py）
+    AI_HEDGE_ENABLED: bool = True
+    AI_HEDGE_DEFAULT_PERCENTILE: float = 95.0
+    AI_HEDGE_DEFAULT_BUDGET: float = 0.1  # 对冲调用占主调用的最大比例
+    AI_HEDGE_MIN_SAMPLES: int = 20
+
+    # 流式接口事件缓冲（条），客户端读取慢时生成端在缓冲满后暂停
+    STREAM_EVENT_BUFFER_SIZE: int = 64
+    # 流式接口检查客户端是否断开的间隔（秒），断开后取消生成并释放队列名额
+    STREAM_DISCONNECT_POLL_INTERVAL: float = 1.0
+
+    # 分子系统的有界线程池（见 app/services/executors.py）：workers 为线程数，queue 为等待队列长度，
+    # 两者都占满时新调用被拒绝（接口返回503）
+    EXECUTOR_POOLS: Dict[str, Dict[str, int]] = {
+        "ai": {"workers": 4, "queue": 64},  # 响应缓存磁盘读写等
+        "git_api": {"workers": 8, "queue": 32},  # PyGithub / python-gitlab / GitLab公共API
+        "git_subprocess": {"workers": 2, "queue": 8},  # git clone 子进程
+        "parse": {"workers": 2, "queue": 64}  # 代码解析
+    }
+    EXECUTOR_RETRY_AFTER: int = 5  # 线程池已满时返回的 Retry-After（秒）
+
+    # 解析结果缓存占用内存上限（字节），按 (语言, 解析器版本, 内容哈希) 缓存，见 app/services/parse_cache.py
+    PARSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    # 配置了 REDIS_URL 时解析句柄对应的源代码登记在Redis中，供其他实例取回
+    PARSE_HANDLE_KEY_PREFIX: str = "aitest:parse"
+    PARSE_HANDLE_TTL: int = 24 * 3600  # 源代码在Redis中的保留时间（秒）
+
+    # 单个C++文件的解析时间上限（秒），超出后返回已提取的函数
+    CPP_PARSE_TIME_BUDGET: float = 5.0
+    # javalang解析结果按内容哈希缓存的文件数，JavaParser 和 JavaCodeAnalyzer 共用（见 app/services/parsers/java_source.py）
+    JAVA_PARSE_CACHE_SIZE: int = 32
+    # 超过该长度（字符）的Java文件不使用javalang（纯Python，较慢），直接使用词法提取
+    JAVA_PARSE_MAX_CHARS: int = 200000
+
+    # 事件循环延迟监控（见 app/services/loop_monitor.py）
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_MONITOR_INTERVAL: float = 0.1  # 心跳间隔（秒）
+    LOOP_STALL_THRESHOLD: float = 0.5  # 延迟超过该值（秒）时抓取事件循环线程的调用栈
+    LOOP_STALL_HISTORY: int = 20  # 保留的卡顿记录数
+    # 阻塞调用检测：off 关闭，warn 记录并告警，raise 抛出异常（测试时使用，让处理函数失败）
+    LOOP_BLOCKING_CHECK: str = os.getenv('LOOP_BLOCKING_CHECK', 'off')
+
+    # 请求截止时间（秒），覆盖排队、解析、提示构建、提供商调用和校验修复，见 app/services/deadline.py；
+    # 需要明显大于 QUEUE_WAIT_SLO_SECONDS，排队到SLO上限的请求仍有时间生成
+    REQUEST_DEADLINE_SECONDS: float = 300.0
+    REQUEST_DEADLINE_MAX_SECONDS: float = 600.0  # 请求通过 deadline_seconds 指定的预算上限
+
+    # 任务调度配置（按 user-id 加权公平排队，见 app/services/task_scheduler.py）
+    QUEUE_MAX_CONCURRENT_TASKS: int = int(os.getenv('MAX_CONCURRENT_TASKS', '3'))
+    QUEUE_MAX_RUNNING_COST: int = 60000  # 同时运行任务的预估token总量上限
+    QUEUE_MAX_RUNNING_PER_USER: int = 2
+    QUEUE_MAX_PENDING_PER_USER: int = 10
+    QUEUE_LANE_WEIGHTS: Dict[str, float] = {"interactive": 4.0, "batch": 1.0}
+    QUEUE_BASE_TASK_COST: int = 2000  # 每个任务的固定token开销（提示模板、输出）
+    QUEUE_INITIAL_RUN_SECONDS: float = 30.0  # 没有历史数据时估算等待用的任务耗时
+    QUEUE_STATUS_UPDATE_INTERVAL: float = 2.0  # 排队状态推送间隔（秒）
+    QUEUE_HISTORY_SIZE: int = 500  # 保留的已结束任务记录数
+    QUEUE_HISTORY_TTL: float = 600.0  # 已结束任务记录的保留时间（秒）
+    QUEUE_STATUS_RECENT_TASKS: int = 20  # /queue/status 返回的最近结束任务数
+    QUEUE_ESTIMATOR_WINDOW: int = 50  # 估算等待时间使用的最近任务数
+    # 预计等待时间超过该值（秒）时新请求返回503和Retry-After，0为不限制
+    QUEUE_WAIT_SLO_SECONDS: float = float(os.getenv('QUEUE_WAIT_SLO_SECONDS', '120'))
+
+    # 分布式队列配置（QUEUE_MODE=distributed 时启用，见 app/services/distributed_queue.py）
+    INSTANCE_ID: str = os.getenv('INSTANCE_ID', 'default')
+    QUEUE_MODE: str = "local"  # local：实例内调度；distributed：通过Redis在实例间共享任务
+    REDIS_URL: str = ""  # 为空时分布式队列使用进程内后端
+    QUEUE_CLUSTER_MAX_CONCURRENT: int = int(os.getenv('CLUSTER_MAX_CONCURRENT_TASKS', os.getenv('MAX_CONCURRENT_TASKS', '3')))
+    QUEUE_KEY_PREFIX: str = "aitest:queue"
+    QUEUE_LEASE_TTL: float = 60.0  # 集群名额租约的过期时间（秒），实例崩溃后名额在此时间后释放
+    QUEUE_WORKER_POLL_INTERVAL: float = 0.5  # 集群名额已满时工作协程的重试间隔（秒）
+    QUEUE_JOB_CANCEL_TTL: float = 3600.0  # 取消标记的保留时间（秒）
+
+    # 异步任务配置（/api/jobs，见 app/services/job_manager.py）
+    JOB_DATABASE_URL: str = os.getenv('DATABASE_URL', '')  # postgresql:// 地址使用Postgres，为空时使用SQLite
+    JOB_DB_PATH: str = os.path.join(os.path.dirname(__file__), "../cache/jobs.db")
+    JOB_LEASE_SECONDS: float = 60.0  # 任务租约时间（秒），实例失联超过该时间后任务由其他实例接管
+    JOB_RESUME_INTERVAL: float = 15.0  # 检查可接管任务的间隔（秒）
+    JOB_RESUME_BATCH: int = 10  # 每次最多接管的任务数
+    JOB_EVENT_POLL_INTERVAL: float = 2.0  # 事件流轮询任务状态的间隔（秒）
+
     class Config:
         env_file = ".env"
 
@@ -86,6 +210,7 @@ class AIConfigManager:
     def __init__(self):
         self.config_file = Path(__file__).parent / "ai_config.json"
         self.admin_password_hash = "5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a11ef721d1542d8"  # "password"的SHA256
+        self._change_listeners: List[Callable[[str], None]] = []
         self._load_config()
 
     def _load_config(self):
@@ -128,6 +253,18 @@ class AIConfigManager:
         except Exception as e:
             print(f"Error saving AI config: {e}")
 
+    def add_change_listener(self, listener: Callable[[str], None]):
+        """注册模型配置变更监听器，模型被修改或删除时以模型名称回调"""
+        self._change_listeners.append(listener)
+
+    def _notify_model_changed(self, model_name: str):
+        """通知模型配置变更"""
+        for listener in self._change_listeners:
+            try:
+                listener(model_name)
+            except Exception as e:
+                print(f"Error notifying model change listener: {e}")
+
     def verify_password(self, password: str) -> bool:
         """验证管理员密码"""
         password_hash = hashlib.sha256(password.encode()).hexdigest()
@@ -151,8 +288,11 @@ class AIConfigManager:
     def add_custom_model(self, model_name: str, model_config: Dict[str, Any]) -> bool:
         """添加自定义模型"""
         try:
+            replaced = model_name in self.custom_models
             self.custom_models[model_name] = model_config
             self._save_config()
+            if replaced:
+                self._notify_model_changed(model_name)
             return True
         except Exception as e:
             print(f"Error adding custom model: {e}")
@@ -166,6 +306,7 @@ class AIConfigManager:
             else:
                 self.custom_models[model_name] = model_config
             self._save_config()
+            self._notify_model_changed(model_name)
             return True
         except Exception as e:
             print(f"Error updating model: {e}")
@@ -177,6 +318,7 @@ class AIConfigManager:
             if model_name in self.custom_models:
                 del self.custom_models[model_name]
                 self._save_config()
+                self._notify_model_changed(model_name)
                 return True
             return False
         except Exception as e:
@@ -17,13 +17,23 @@ from fastapi.staticfiles import StaticFiles
 try:
     # backend目录运行
     from app.api.endpoints import router
-    from app.api.errors import validation_exception_handler, value_error_handler, general_exception_handler
+    from app.api.errors import (
+        validation_exception_handler, value_error_handler, general_exception_handler, queue_overloaded_handler,
+        executor_saturated_handler
+    )
+    from app.services.task_scheduler import QueueOverloadedError
+    from app.services.executors import ExecutorSaturatedError
     from app.config import settings
     from app.utils.logger import logger
 except ModuleNotFoundError:
     # app目录运行
     from api.endpoints import router
-    from api.errors import validation_exception_handler, value_error_handler, general_exception_handler
+    from api.errors import (
+        validation_exception_handler, value_error_handler, general_exception_handler, queue_overloaded_handler,
+        executor_saturated_handler
+    )
+    from services.task_scheduler import QueueOverloadedError
+    from services.executors import ExecutorSaturatedError
     from config import settings
     from utils.logger import logger
 
@@ -34,14 +44,42 @@ async def lifespan(app_instance: FastAPI):
     logger.info(f"Starting {settings.APP_NAME} v{settings.APP_VERSION}")
     logger.info(f"App instance: {app_instance.title}")
 
+    # 启动事件循环延迟监控和阻塞调用检测
+    try:
+        from app.services.loop_monitor import get_loop_monitor, install_blocking_detector
+        if settings.LOOP_MONITOR_ENABLED:
+            get_loop_monitor().start()
+        install_blocking_detector()
+    except Exception as e:
+        logger.error(f"Failed to start event loop monitor: {e}")
+
     # 初始化任务队列
     try:
         from app.services.simple_queue import get_simple_queue
         get_simple_queue()  # 初始化全局队列实例
+        if settings.QUEUE_MODE == "distributed":
+            from app.services.distributed_queue import get_distributed_queue
+            await get_distributed_queue().start()
         logger.info("Task queue initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize task queue: {e}")
 
+    # 启动异步任务接管（恢复重启前未完成的任务）
+    try:
+        from app.services.job_manager import get_job_manager
+        await get_job_manager().start()
+    except Exception as e:
+        logger.error(f"Failed to start job manager: {e}")
+
+    # 预热AI提供商连接池
+    if settings.AI_HTTP_WARMUP_ENABLED:
+        try:
+            from app.services.ai_factory import AIServiceFactory
+            await AIServiceFactory.warmup_connections()
+            logger.info("AI provider connection pool warmed up")
+        except Exception as e:
+            logger.error(f"Failed to warm up AI provider connection pool: {e}")
+
     yield
 
     # 关闭事件
@@ -49,11 +87,44 @@ async def lifespan(app_instance: FastAPI):
 
     # 清理任务队列
     try:
-        # simple_queue 不需要特殊的关闭操作
+        # simple_queue 不需要特殊的关闭操作，分布式队列需要停止工作协程
+        if settings.QUEUE_MODE == "distributed":
+            from app.services.distributed_queue import get_distributed_queue
+            await get_distributed_queue().stop()
         logger.info("Task queue shutdown successfully")
     except Exception as e:
         logger.error(f"Error shutting down task queue: {e}")
 
+    # 停止本实例执行中的异步任务，任务保留检查点，租约过期后由其他实例接管
+    try:
+        from app.services.job_manager import get_job_manager
+        await get_job_manager().stop()
+    except Exception as e:
+        logger.error(f"Error stopping job manager: {e}")
+
+    # 关闭AI提供商连接池
+    try:
+        from app.services.ai_factory import AIServiceFactory
+        await AIServiceFactory.close_connections()
+        logger.info("AI provider connection pool closed")
+    except Exception as e:
+        logger.error(f"Error closing AI provider connection pool: {e}")
+
+    # 停止事件循环监控
+    try:
+        from app.services.loop_monitor import get_loop_monitor, uninstall_blocking_detector
+        await get_loop_monitor().stop()
+        uninstall_blocking_detector()
+    except Exception as e:
+        logger.error(f"Error stopping event loop monitor: {e}")
+
+    # 关闭分子系统线程池
+    try:
+        from app.services.executors import shutdown_executors
+        shutdown_executors()
+    except Exception as e:
+        logger.error(f"Error shutting down executors: {e}")
+
 # 创建FastAPI应用
 app = FastAPI(
     title=settings.APP_NAME,
@@ -74,6 +145,8 @@ app.add_middleware(
 # 添加异常处理器
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
 app.add_exception_handler(ValueError, value_error_handler)
+app.add_exception_handler(QueueOverloadedError, queue_overloaded_handler)
+app.add_exception_handler(ExecutorSaturatedError, executor_saturated_handler)
 app.add_exception_handler(Exception, general_exception_handler)
 
 # 添加路由
@@ -12,11 +12,18 @@ class CodeSnippet(BaseModel):
 
 class GenerateTestRequest(BaseModel):
     """生成测试请求模型"""
-    code: str
+    code: str = ""  # 提交了 parse_handle 时可以为空
     language: str
     model: str
     git_repo: Optional[str] = None
     git_path: Optional[str] = None
+    max_concurrency: Optional[int] = None  # 单个请求内片段并发生成数
+    bypass_cache: bool = False  # 跳过响应缓存读取，强制重新生成
+    stream_deltas: bool = True  # 流式接口是否转发模型输出的 test_code_delta 增量
+    pack_mode: Optional[str] = None  # 提示打包模式："class" 按类打包，"file" 整个文件打包
+    lane: str = "interactive"  # 调度通道："interactive" 交互请求，"batch" 批量请求
+    deadline_seconds: Optional[float] = None  # 端到端截止时间（秒），缺省为 REQUEST_DEADLINE_SECONDS
+    parse_handle: Optional[str] = None  # 上传文件或获取Git文件内容时返回的解析句柄，代码为空时按句柄取回代码
 
 class TestResult(BaseModel):
     """测试结果模型"""
@@ -25,6 +32,7 @@ class TestResult(BaseModel):
     test_code: str
     original_snippet: CodeSnippet
     file_name: Optional[str] = None
+    index: Optional[int] = None  # 片段在解析结果中的原始序号
 
 class GenerateTestResponse(BaseModel):
     """生成测试响应模型"""
@@ -36,6 +44,7 @@ class UploadFileResponse(BaseModel):
     filename: str
     content: str
     language: Optional[str] = None
+    parse_handle: Optional[str] = None  # 解析句柄，生成接口可以用它代替代码
 
 class GitRepository(BaseModel):
     """Git仓库模型"""
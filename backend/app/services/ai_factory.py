@@ -1,10 +1,42 @@
-from typing import Dict, Any, Callable
-import requests
+from typing import Dict, Any, Callable, Optional, AsyncIterator, Awaitable
+from email.utils import parsedate_to_datetime
+import inspect
+import json
+import random
+import time
+import httpx
+from contextlib import aclosing
 from functools import wraps
 from abc import ABC, abstractmethod
-from app.config import get_ai_models
+from app.config import settings, get_ai_models
+from app.services.ai_metrics import get_ai_metrics, estimate_tokens
+from app.services.hedging import HedgePolicy, get_hedger
+from app.services.http_client_pool import get_http_client_pool
 from app.utils.logger import logger
 
+class AIAPIError(Exception):
+    """AI提供商API调用错误"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        # 提供商通过 Retry-After 要求的等待秒数（可选）
+        self.retry_after = retry_after
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """解析响应的 Retry-After 头（秒数或HTTP日期），没有或无法解析时返回None"""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
 # 错误处理装饰器
 def api_error_handler(provider_name: str):
     """
@@ -14,6 +46,29 @@ def api_error_handler(provider_name: str):
         provider_name: 提供商名称
     """
     def decorator(func: Callable):
+        if inspect.isasyncgenfunction(func):
+            @wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                try:
+                    # 显式关闭内层生成器，调用方提前退出时立即释放上游连接
+                    async with aclosing(func(*args, **kwargs)) as agen:
+                        async for item in agen:
+                            yield item
+                except Exception as e:
+                    logger.error(f"Error calling {provider_name} API: {e}")
+                    raise
+            return async_gen_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    logger.error(f"Error calling {provider_name} API: {e}")
+                    raise
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             try:
@@ -24,20 +79,69 @@ def api_error_handler(provider_name: str):
         return wrapper
     return decorator
 
+class CodeFenceDetector:
+    """
+    增量检测第一个代码块是否已经闭合
+
+    判定规则与 extract_code_blocks 一致：以```开头的行为围栏行，
+    第二个围栏行出现时第一个代码块即闭合。闭合围栏只需看到行首的```即可判定，
+    不必等待换行。
+    """
+
+    def __init__(self):
+        self._line = ""
+        self._line_counted = False
+        self.fences = 0
+
+    @property
+    def closed(self) -> bool:
+        """第一个代码块是否已闭合"""
+        return self.fences >= 2
+
+    def feed(self, text: str) -> bool:
+        """
+        输入一段文本增量
+
+        Args:
+            text: 文本增量
+
+        Returns:
+            第一个代码块是否已闭合
+        """
+        if self.closed:
+            return True
+
+        self._line += text
+        lines = self._line.split("\n")
+        self._line = lines.pop()
+        for line in lines:
+            if not self._line_counted and line.startswith("```"):
+                self.fences += 1
+            self._line_counted = False
+            if self.closed:
+                return True
+
+        if not self._line_counted and self._line.startswith("```"):
+            self._line_counted = True
+            self.fences += 1
+        return self.closed
+
 class BaseAIService(ABC):
     """AI服务基类"""
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], model_name: Optional[str] = None):
         """
         初始化AI服务
 
         Args:
             config: 配置信息
+            model_name: 模型名称（用于指标统计）
         """
         self.config = config
+        self.model_name = model_name or config.get("model", "unknown")
 
     @abstractmethod
-    def generate(self, prompt: str) -> str:
+    async def generate(self, prompt: str) -> str:
         """
         生成文本
 
@@ -49,6 +153,93 @@ class BaseAIService(ABC):
         """
         pass
 
+    async def generate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        流式生成文本，逐段产出模型输出的原始文本增量
+
+        不支持流式接口的服务退回到一次性生成。
+
+        Args:
+            prompt: 提示文本
+
+        Yields:
+            文本增量
+        """
+        yield await self.generate(prompt)
+
+    @property
+    def early_stop_enabled(self) -> bool:
+        """是否在第一个代码块闭合后立即终止生成，模型可通过 early_stop 覆盖全局配置"""
+        return bool(self.config.get("early_stop", settings.AI_EARLY_STOP_ENABLED))
+
+    async def generate_code(self, prompt: str, on_delta: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        """
+        流式生成并提取第一个代码块
+
+        第一个代码块闭合后立即关闭上游流式请求，不再等待模型输出后续解释。
+        按 AI_EARLY_STOP_BASELINE_SAMPLE_RATE 抽样让少量调用完整跑完，
+        用于估算每次提前终止节省的token数和耗时。
+
+        Args:
+            prompt: 提示文本
+            on_delta: 文本增量回调（可选）
+
+        Returns:
+            提取出的代码块，没有代码块时返回完整文本
+        """
+        early_stop = self.early_stop_enabled and random.random() >= settings.AI_EARLY_STOP_BASELINE_SAMPLE_RATE
+        detector = CodeFenceDetector()
+        chunks = []
+        output_chars = 0
+        closed_at = None
+        closed_at_chars = 0
+        stopped_early = False
+        started = time.monotonic()
+
+        async with aclosing(self.generate_stream(prompt)) as stream:
+            async for delta in stream:
+                chunks.append(delta)
+                output_chars += len(delta)
+                if on_delta is not None:
+                    await on_delta(delta)
+                if closed_at is None and detector.feed(delta):
+                    closed_at = time.monotonic()
+                    closed_at_chars = output_chars
+                    if early_stop:
+                        stopped_early = True
+                        break
+        finished = time.monotonic()
+
+        self._record_generation(stopped_early, finished - started, output_chars,
+                                closed_at, closed_at_chars, finished)
+        return self.extract_code_blocks("".join(chunks).strip())
+
+    def _record_generation(self, stopped_early: bool, elapsed: float, output_chars: int,
+                           closed_at: Optional[float], closed_at_chars: int, finished: float) -> None:
+        """记录一次生成的提前终止效果"""
+        metrics = get_ai_metrics()
+        saved_tokens = 0.0
+        saved_seconds = 0.0
+
+        if stopped_early:
+            saved_tokens, saved_seconds = metrics.estimate_trailing(self.model_name)
+            metrics.increment(self.model_name, "early_stopped")
+            metrics.increment(self.model_name, "early_stop_saved_tokens", saved_tokens)
+            metrics.increment(self.model_name, "early_stop_saved_seconds", saved_seconds)
+        elif closed_at is not None:
+            # 完整跑完的调用作为基线，记录代码块之后的尾部输出
+            metrics.record_trailing_baseline(self.model_name, output_chars - closed_at_chars, finished - closed_at)
+
+        metrics.increment(self.model_name, "generations")
+        metrics.record_call(
+            self.model_name,
+            elapsed_seconds=round(elapsed, 3),
+            output_tokens=estimate_tokens(output_chars),
+            stopped_early=stopped_early,
+            saved_tokens=round(saved_tokens, 1),
+            saved_seconds=round(saved_seconds, 3)
+        )
+
     def extract_code_blocks(self, text: str) -> str:
         """
         从文本中提取代码块
@@ -81,9 +272,37 @@ class BaseAIService(ABC):
 
         return text
 
-    def _make_api_request(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], skip_key_validation: bool = False) -> Dict[str, Any]:
+    def _check_api_key(self) -> None:
         """
-        发送API请求
+        检查API密钥是否有效
+
+        Raises:
+            AIAPIError: 如果缺少密钥或使用了默认密钥
+        """
+        api_key = self.config.get("api_key", "")
+        provider = self.config.get("provider", "")
+
+        # 根据不同的提供商检查API密钥
+        if not api_key:
+            raise AIAPIError(
+                f"Missing API key for {provider}. Please set a valid API key in the .env file or environment variables. "
+                "See the .env.example file for the required format."
+            )
+
+        # 检查是否使用了默认密钥
+        if (provider == "openai" and api_key.startswith(("sk-demo"))) or \
+           (provider == "anthropic" and api_key.startswith(("sk-ant-api-demo"))) or \
+           (provider == "grok" and api_key.startswith(("gsk-demo"))) or \
+           (provider == "deepseek" and (api_key == "your-deepseek-api-key" or api_key == "your-actual-deepseek-api-key" or api_key == "demo-deepseek-key-for-development-only")) or \
+           (provider == "google" and api_key.startswith(("demo-"))):
+            raise AIAPIError(
+                f"Invalid {provider} API key. Please set a valid API key in the .env file or environment variables. "
+                "See the .env.example file for the required format."
+            )
+
+    async def _make_api_request(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], skip_key_validation: bool = False) -> Dict[str, Any]:
+        """
+        通过共享连接池发送异步API请求
 
         Args:
             url: API地址
@@ -95,56 +314,129 @@ class BaseAIService(ABC):
             API响应
 
         Raises:
-            Exception: 如果API调用失败
+            AIAPIError: 如果API调用失败
         """
         # 检查API密钥是否有效
         if not skip_key_validation:
-            api_key = self.config.get("api_key", "")
-            provider = self.config.get("provider", "")
-
-            # 根据不同的提供商检查API密钥
-            if not api_key:
-                raise Exception(
-                    f"Missing API key for {provider}. Please set a valid API key in the .env file or environment variables. "
-                    "See the .env.example file for the required format."
-                )
-
-            # 检查是否使用了默认密钥
-            if (provider == "openai" and api_key.startswith(("sk-demo"))) or \
-               (provider == "anthropic" and api_key.startswith(("sk-ant-api-demo"))) or \
-               (provider == "grok" and api_key.startswith(("gsk-demo"))) or \
-               (provider == "deepseek" and (api_key == "your-deepseek-api-key" or api_key == "your-actual-deepseek-api-key" or api_key == "demo-deepseek-key-for-development-only")) or \
-               (provider == "google" and api_key.startswith(("demo-"))):
-                raise Exception(
-                    f"Invalid {provider} API key. Please set a valid API key in the .env file or environment variables. "
-                    "See the .env.example file for the required format."
-                )
+            self._check_api_key()
 
+        client = await get_http_client_pool().get_client(url)
         try:
-            response = requests.post(
+            response = await client.post(
                 url,
                 headers=headers,
                 json=payload,
                 timeout=self.config["timeout"]
             )
+        except httpx.TimeoutException as e:
+            raise AIAPIError(f"API request timeout: {str(e)}")
+        except httpx.HTTPError as e:
+            raise AIAPIError(f"API request error: {str(e)}")
+
+        if response.status_code == 401:
+            raise AIAPIError(
+                f"Authentication failed: {response.text}. "
+                "Please check your API key and make sure it is valid.",
+                status_code=401
+            )
+        elif response.status_code != 200:
+            raise AIAPIError(
+                f"API call failed with status code {response.status_code}: {response.text}",
+                status_code=response.status_code,
+                retry_after=_retry_after(response)
+            )
 
-            if response.status_code == 401:
-                raise Exception(
-                    f"Authentication failed: {response.text}. "
-                    "Please check your API key and make sure it is valid."
-                )
-            elif response.status_code != 200:
-                raise Exception(f"API call failed with status code {response.status_code}: {response.text}")
+        return response.json()
+
+    async def _stream_api_request(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], skip_key_validation: bool = False) -> AsyncIterator[str]:
+        """
+        通过共享连接池发送流式API请求，逐条产出服务器发送事件（SSE）的data内容
+
+        Args:
+            url: API地址
+            headers: 请求头
+            payload: 请求体
+            skip_key_validation: 是否跳过API密钥验证
+
+        Yields:
+            每个SSE事件的data字段（已去除"data:"前缀）
+
+        Raises:
+            AIAPIError: 如果API调用失败
+        """
+        if not skip_key_validation:
+            self._check_api_key()
+
+        client = await get_http_client_pool().get_client(url)
+        try:
+            async with client.stream("POST", url, headers=headers, json=payload, timeout=self.config["timeout"]) as response:
+                if response.status_code != 200:
+                    body = (await response.aread()).decode("utf-8", errors="replace")
+                    if response.status_code == 401:
+                        raise AIAPIError(
+                            f"Authentication failed: {body}. "
+                            "Please check your API key and make sure it is valid.",
+                            status_code=401
+                        )
+                    raise AIAPIError(
+                        f"API call failed with status code {response.status_code}: {body}",
+                        status_code=response.status_code,
+                        retry_after=_retry_after(response)
+                    )
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    if data:
+                        yield data
+        except httpx.TimeoutException as e:
+            raise AIAPIError(f"API request timeout: {str(e)}")
+        except httpx.HTTPError as e:
+            raise AIAPIError(f"API request error: {str(e)}")
+
+    async def _stream_openai_compatible(self, prompt: str, skip_key_validation: bool = False) -> AsyncIterator[str]:
+        """
+        OpenAI兼容接口（OpenAI/Grok/DeepSeek）的流式生成
+
+        Args:
+            prompt: 提示文本
+            skip_key_validation: 是否跳过API密钥验证
 
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"API request error: {str(e)}")
+        Yields:
+            文本增量
+        """
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.config['api_key']}"
+        }
+
+        payload = {
+            "model": self.config["model"],
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.config["temperature"],
+            "max_tokens": self.config["max_tokens"],
+            "stream": True
+        }
+
+        url = f"{self.config['api_base']}/chat/completions"
+        async with aclosing(self._stream_api_request(url, headers, payload, skip_key_validation)) as events:
+            async for data in events:
+                event = json.loads(data)
+                choices = event.get("choices") or []
+                if not choices:
+                    continue
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta
 
 class OpenAIService(BaseAIService):
     """OpenAI服务"""
 
     @api_error_handler("OpenAI")
-    def generate(self, prompt: str) -> str:
+    async def generate(self, prompt: str) -> str:
         """
         使用OpenAI生成文本
 
@@ -167,16 +459,31 @@ class OpenAIService(BaseAIService):
         }
 
         url = f"{self.config['api_base']}/chat/completions"
-        response_data = self._make_api_request(url, headers, payload)
+        response_data = await self._make_api_request(url, headers, payload)
         test_code = response_data["choices"][0]["message"]["content"].strip()
 
         return self.extract_code_blocks(test_code)
 
+    @api_error_handler("OpenAI")
+    async def generate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        使用OpenAI流式生成文本
+
+        Args:
+            prompt: 提示文本
+
+        Yields:
+            文本增量
+        """
+        async with aclosing(self._stream_openai_compatible(prompt)) as deltas:
+            async for delta in deltas:
+                yield delta
+
 class GoogleService(BaseAIService):
     """Google Gemini服务"""
 
     @api_error_handler("Google")
-    def generate(self, prompt: str) -> str:
+    async def generate(self, prompt: str) -> str:
         """
         使用Google Gemini生成文本
 
@@ -201,16 +508,50 @@ class GoogleService(BaseAIService):
         }
 
         url = f"{self.config['api_base']}/models/{self.config['model']}:generateContent?key={self.config['api_key']}"
-        response_data = self._make_api_request(url, headers, payload)
+        response_data = await self._make_api_request(url, headers, payload)
         test_code = response_data["candidates"][0]["content"]["parts"][0]["text"].strip()
 
         return self.extract_code_blocks(test_code)
 
+    @api_error_handler("Google")
+    async def generate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        使用Google Gemini流式生成文本（streamGenerateContent）
+
+        Args:
+            prompt: 提示文本
+
+        Yields:
+            文本增量
+        """
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        payload = {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {
+                "temperature": self.config["temperature"],
+                "maxOutputTokens": self.config["max_tokens"],
+                "topP": 0.95,
+                "topK": 40
+            }
+        }
+
+        url = f"{self.config['api_base']}/models/{self.config['model']}:streamGenerateContent?alt=sse&key={self.config['api_key']}"
+        async with aclosing(self._stream_api_request(url, headers, payload)) as events:
+            async for data in events:
+                event = json.loads(data)
+                for candidate in event.get("candidates") or []:
+                    for part in (candidate.get("content") or {}).get("parts") or []:
+                        if part.get("text"):
+                            yield part["text"]
+
 class AnthropicService(BaseAIService):
     """Anthropic Claude服务"""
 
     @api_error_handler("Anthropic")
-    def generate(self, prompt: str) -> str:
+    async def generate(self, prompt: str) -> str:
         """
         使用Anthropic Claude生成文本
 
@@ -236,7 +577,7 @@ class AnthropicService(BaseAIService):
             }
 
             url = f"{self.config['api_base']}/messages"
-            response_data = self._make_api_request(url, headers, payload)
+            response_data = await self._make_api_request(url, headers, payload)
             test_code = response_data["content"][0]["text"].strip()
         else:
             # 旧版Claude API
@@ -248,16 +589,60 @@ class AnthropicService(BaseAIService):
             }
 
             url = f"{self.config['api_base']}/complete"
-            response_data = self._make_api_request(url, headers, payload)
+            response_data = await self._make_api_request(url, headers, payload)
             test_code = response_data["completion"].strip()
 
         return self.extract_code_blocks(test_code)
 
+    @api_error_handler("Anthropic")
+    async def generate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        使用Anthropic Claude流式生成文本（Messages API streaming）
+
+        Args:
+            prompt: 提示文本
+
+        Yields:
+            文本增量
+        """
+        # 旧版Claude API不走流式接口
+        if "claude-3" not in self.config["model"]:
+            yield await self.generate(prompt)
+            return
+
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": self.config["api_key"],
+            "anthropic-version": "2023-06-01"
+        }
+
+        payload = {
+            "model": self.config["model"],
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.config["temperature"],
+            "max_tokens": self.config["max_tokens"],
+            "stream": True
+        }
+
+        url = f"{self.config['api_base']}/messages"
+        async with aclosing(self._stream_api_request(url, headers, payload)) as events:
+            async for data in events:
+                event = json.loads(data)
+                event_type = event.get("type")
+                if event_type == "content_block_delta":
+                    text = (event.get("delta") or {}).get("text")
+                    if text:
+                        yield text
+                elif event_type == "error":
+                    raise AIAPIError(f"Anthropic stream error: {event.get('error')}")
+                elif event_type == "message_stop":
+                    break
+
 class GrokService(BaseAIService):
     """xAI Grok服务"""
 
     @api_error_handler("Grok")
-    def generate(self, prompt: str) -> str:
+    async def generate(self, prompt: str) -> str:
         """
         使用xAI Grok生成文本
 
@@ -280,16 +665,31 @@ class GrokService(BaseAIService):
         }
 
         url = f"{self.config['api_base']}/chat/completions"
-        response_data = self._make_api_request(url, headers, payload)
+        response_data = await self._make_api_request(url, headers, payload)
         test_code = response_data["choices"][0]["message"]["content"].strip()
 
         return self.extract_code_blocks(test_code)
 
+    @api_error_handler("Grok")
+    async def generate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        使用xAI Grok流式生成文本
+
+        Args:
+            prompt: 提示文本
+
+        Yields:
+            文本增量
+        """
+        async with aclosing(self._stream_openai_compatible(prompt)) as deltas:
+            async for delta in deltas:
+                yield delta
+
 class DeepSeekService(BaseAIService):
     """DeepSeek服务"""
 
     @api_error_handler("DeepSeek")
-    def generate(self, prompt: str) -> str:
+    async def generate(self, prompt: str) -> str:
         """
         使用DeepSeek生成文本
 
@@ -329,31 +729,53 @@ class DeepSeekService(BaseAIService):
         url = f"{self.config['api_base']}/chat/completions"
         try:
             # 跳过 API 密钥验证
-            response_data = self._make_api_request(url, headers, payload, skip_key_validation=True)
+            response_data = await self._make_api_request(url, headers, payload, skip_key_validation=True)
             test_code = response_data["choices"][0]["message"]["content"].strip()
             return self.extract_code_blocks(test_code)
         except Exception as e:
             # 添加更详细的错误信息
             error_msg = str(e)
+            status_code = getattr(e, "status_code", None)
             print(f"DeepSeek API error: {error_msg}")
 
             if "401" in error_msg:
-                raise Exception(
+                raise AIAPIError(
                     f"DeepSeek API authentication failed: {error_msg}. "
-                    "Please check your API key in the .env file."
+                    "Please check your API key in the .env file.",
+                    status_code=status_code
                 )
             elif "404" in error_msg:
-                raise Exception(
+                raise AIAPIError(
                     f"DeepSeek API endpoint not found: {error_msg}. "
-                    "Please check the API base URL in the config."
+                    "Please check the API base URL in the config.",
+                    status_code=status_code
                 )
             elif "429" in error_msg:
-                raise Exception(
+                raise AIAPIError(
                     f"DeepSeek API rate limit exceeded: {error_msg}. "
-                    "Please try again later or reduce the frequency of requests."
+                    "Please try again later or reduce the frequency of requests.",
+                    status_code=status_code,
+                    retry_after=getattr(e, "retry_after", None)
                 )
             else:
-                raise Exception(f"DeepSeek API error: {error_msg}")
+                raise AIAPIError(f"DeepSeek API error: {error_msg}", status_code=status_code,
+                                 retry_after=getattr(e, "retry_after", None))
+
+    @api_error_handler("DeepSeek")
+    async def generate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        使用DeepSeek流式生成文本
+
+        Args:
+            prompt: 提示文本
+
+        Yields:
+            文本增量
+        """
+        # 与generate保持一致，跳过 API 密钥验证
+        async with aclosing(self._stream_openai_compatible(prompt, skip_key_validation=True)) as deltas:
+            async for delta in deltas:
+                yield delta
 
 class AIServiceFactory:
     """AI服务工厂"""
@@ -381,14 +803,55 @@ class AIServiceFactory:
         provider = model_config["provider"]
 
         if provider == "openai":
-            return OpenAIService(model_config)
+            return OpenAIService(model_config, model_name)
         elif provider == "google":
-            return GoogleService(model_config)
+            return GoogleService(model_config, model_name)
         elif provider == "anthropic":
-            return AnthropicService(model_config)
+            return AnthropicService(model_config, model_name)
         elif provider == "grok":
-            return GrokService(model_config)
+            return GrokService(model_config, model_name)
         elif provider == "deepseek":
-            return DeepSeekService(model_config)
+            return DeepSeekService(model_config, model_name)
         else:
             raise ValueError(f"Unsupported AI provider: {provider}")
+
+    @staticmethod
+    async def generate_hedged(model_name: str, call: Callable[[BaseAIService, bool], Awaitable[str]],
+                              accept: Callable[[str], bool]) -> str:
+        """
+        按模型的对冲策略执行调用
+
+        模型配置了 hedge 时，主调用超过学习到的延迟分位数仍未返回，
+        就向备用模型（缺省为同一模型）发出对冲调用，先返回且通过校验的结果胜出，其余调用被取消。
+
+        Args:
+            model_name: 模型名称
+            call: 调用函数，参数为 (AI服务, 是否主调用)
+            accept: 结果是否通过校验
+
+        Returns:
+            胜出的结果
+
+        Raises:
+            ValueError: 如果模型不存在或提供商不支持
+        """
+        primary_service = AIServiceFactory.get_service(model_name)
+        policy = HedgePolicy.from_model_config(model_name, primary_service.config)
+
+        def backup_factory(backup_model: str):
+            return lambda: call(AIServiceFactory.get_service(backup_model), False)
+
+        return await get_hedger().run(
+            model_name, lambda: call(primary_service, True), backup_factory, accept, policy
+        )
+
+    @staticmethod
+    async def warmup_connections() -> None:
+        """预热所有已配置模型的提供商连接池"""
+        api_bases = [config.get("api_base") for config in get_ai_models().values()]
+        await get_http_client_pool().warmup(api_bases)
+
+    @staticmethod
+    async def close_connections() -> None:
+        """关闭提供商连接池"""
+        await get_http_client_pool().close()
@@ -0,0 +1,143 @@
+"""
+AI调用指标
+按模型汇总的计数器，以及最近调用记录
+"""
+
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, Any, Optional, Tuple
+
+# 估算token数时使用的平均字符数
+CHARS_PER_TOKEN = 4
+
+# 尾部输出基线的指数滑动平均系数
+_EMA_ALPHA = 0.2
+
+
+def estimate_tokens(char_count: int) -> int:
+    """
+    根据字符数粗略估算token数
+
+    Args:
+        char_count: 字符数
+
+    Returns:
+        估算的token数
+    """
+    return (char_count + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class AIMetrics:
+    """AI调用指标注册表"""
+
+    def __init__(self, history_size: int = 200):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._recent_calls = deque(maxlen=history_size)
+        # 模型 -> (尾部token均值, 尾部耗时均值, 样本数)
+        self._trailing_baseline: Dict[str, Tuple[float, float, int]] = {}
+
+    def increment(self, model: str, name: str, value: float = 1) -> None:
+        """
+        累加模型计数器
+
+        Args:
+            model: 模型名称
+            name: 计数器名称
+            value: 增量
+        """
+        with self._lock:
+            self._counters[model][name] += value
+
+    def record_trailing_baseline(self, model: str, trailing_chars: int, trailing_seconds: float) -> None:
+        """
+        记录一次完整生成中代码块结束后的尾部输出，用于估算提前终止节省的量
+
+        Args:
+            model: 模型名称
+            trailing_chars: 代码块结束后模型继续输出的字符数
+            trailing_seconds: 代码块结束到响应结束的耗时
+        """
+        trailing_tokens = estimate_tokens(trailing_chars)
+        with self._lock:
+            baseline = self._trailing_baseline.get(model)
+            if baseline is None:
+                self._trailing_baseline[model] = (trailing_tokens, trailing_seconds, 1)
+            else:
+                tokens, seconds, samples = baseline
+                self._trailing_baseline[model] = (
+                    tokens + _EMA_ALPHA * (trailing_tokens - tokens),
+                    seconds + _EMA_ALPHA * (trailing_seconds - seconds),
+                    samples + 1
+                )
+
+    def estimate_trailing(self, model: str) -> Tuple[float, float]:
+        """
+        获取模型的尾部输出估计
+
+        Args:
+            model: 模型名称
+
+        Returns:
+            (估计token数, 估计耗时秒数)，没有基线时为(0, 0)
+        """
+        with self._lock:
+            baseline = self._trailing_baseline.get(model)
+        if baseline is None:
+            return 0.0, 0.0
+        return baseline[0], baseline[1]
+
+    def record_call(self, model: str, **fields: Any) -> None:
+        """
+        记录一次调用的明细
+
+        Args:
+            model: 模型名称
+            **fields: 调用明细字段
+        """
+        record = {"model": model, "timestamp": time.time()}
+        record.update(fields)
+        with self._lock:
+            self._recent_calls.append(record)
+
+    def get_counter(self, model: str, name: str) -> float:
+        """获取单个计数器的值"""
+        with self._lock:
+            return self._counters.get(model, {}).get(name, 0)
+
+    def snapshot(self, recent: Optional[int] = 20) -> Dict[str, Any]:
+        """
+        获取指标快照
+
+        Args:
+            recent: 返回的最近调用记录条数
+
+        Returns:
+            指标快照
+        """
+        with self._lock:
+            models = {model: dict(counters) for model, counters in self._counters.items()}
+            for counters in models.values():
+                if counters.get("validated_generations"):
+                    counters["reprompt_rate"] = round(
+                        counters.get("reprompts", 0) / counters["validated_generations"], 3
+                    )
+            for model, (tokens, seconds, samples) in self._trailing_baseline.items():
+                models.setdefault(model, {})["trailing_baseline"] = {
+                    "tokens": round(tokens, 1),
+                    "seconds": round(seconds, 3),
+                    "samples": samples
+                }
+            calls = list(self._recent_calls)[-recent:] if recent else []
+        return {"models": models, "recent_calls": calls}
+
+# 全局指标实例
+_ai_metrics: Optional[AIMetrics] = None
+
+def get_ai_metrics() -> AIMetrics:
+    """获取全局AI指标实例"""
+    global _ai_metrics
+    if _ai_metrics is None:
+        _ai_metrics = AIMetrics()
+    return _ai_metrics
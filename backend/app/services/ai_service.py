@@ -1,54 +1,324 @@
+import asyncio
+from typing import Dict, List, Optional, Callable, Awaitable
 from app.models.schemas import CodeSnippet
-from app.config import PROMPT_TEMPLATES
-from app.services.ai_factory import AIServiceFactory
+from app.config import settings, PROMPT_TEMPLATES
+from app.services.ai_factory import AIServiceFactory, BaseAIService, AIAPIError
+from app.services.response_cache import get_response_cache
+from app.services.prompt_packing import build_packed_prompt
+from app.services.rate_limiter import get_rate_limiter_registry, classify_error, overload_backoff, OUTCOME_OVERLOAD
+from app.services.ai_metrics import get_ai_metrics, estimate_tokens
+from app.services.single_flight import get_single_flight, single_flight_key
+from app.services.test_validation import get_validator, build_repair_prompt
+from app.services.deadline import Deadline, DeadlineExceededError
 from app.utils.logger import logger
 import re
 
-def validate_test_code(test_code: str, snippet: CodeSnippet, module_path: str) -> bool:
-    if not test_code:
-        logger.warning("Generated test code is empty")
-        return False
-
-    if snippet.language == "python":
-        module_path = "broadcast"
-
-        import_patterns = []
-        if snippet.class_name:
-            import_patterns.append(re.compile(rf"from\s+{re.escape(module_path)}\s+import\s+{re.escape(snippet.class_name)}"))
-        else:
-            import_patterns.append(re.compile(rf"from\s+{re.escape(module_path)}\s+import\s+{re.escape(snippet.name)}"))
-
-        import_found = False
-        for pattern in import_patterns:
-            if pattern.search(test_code):
-                import_found = True
-                break
-
-        if not import_found:
-            logger.warning(f"Missing import statement for {snippet.name}")
-            return False
-
-        if "import pytest" not in test_code:
-            logger.warning("Missing pytest import")
-            return False
-
-        test_func_pattern = re.compile(rf"def\s+test_\w*{re.escape(snippet.name)}")
-        if not test_func_pattern.search(test_code):
-            logger.warning(f"Missing test function for {snippet.name}")
-            return False
+# 文本增量回调：(增量文本, 第几次尝试)
+DeltaCallback = Callable[[str, int], Awaitable[None]]
+
+# 单飞键 -> 仍在等待共享生成的调用方的增量回调
+_delta_listeners: Dict[str, List[DeltaCallback]] = {}
+
+async def _call_provider(ai_service: BaseAIService, prompt: str, on_delta: Optional[DeltaCallback], attempt: int) -> str:
+    """
+    调用一次模型；启用提前终止或提供增量回调时走流式接口
+
+    Args:
+        ai_service: AI服务
+        prompt: 提示文本
+        on_delta: 文本增量回调（可选）
+        attempt: 当前尝试序号（从1开始）
+
+    Returns:
+        提取出的测试代码
+    """
+    if on_delta is None:
+        if not ai_service.early_stop_enabled:
+            return await ai_service.generate(prompt)
+        return await ai_service.generate_code(prompt)
+
+    async def _forward(delta: str):
+        await on_delta(delta, attempt)
+
+    return await ai_service.generate_code(prompt, _forward)
+
+async def _generate_once(ai_service: BaseAIService, prompt: str, on_delta: Optional[DeltaCallback], attempt: int) -> str:
+    """
+    在提供商限流下调用一次模型；提供商过载（429/5xx/超时）时退避等待后重新排队重试
+
+    Args:
+        ai_service: AI服务
+        prompt: 提示文本
+        on_delta: 文本增量回调（可选）
+        attempt: 当前尝试序号（从1开始）
+
+    Returns:
+        提取出的测试代码
+    """
+    limiter = get_rate_limiter_registry()
+    prompt_tokens = estimate_tokens(len(prompt))
+    estimated_tokens = prompt_tokens + int(ai_service.config.get("max_tokens", 0))
+
+    async def _call() -> str:
+        async with limiter.slot(ai_service.config, estimated_tokens) as usage:
+            test_code = await _call_provider(ai_service, prompt, on_delta, attempt)
+            usage["tokens"] = prompt_tokens + estimate_tokens(len(test_code or ""))
+            return test_code
+
+    overload_retries = 0
+    while True:
+        try:
+            return await _call()
+        except Exception as e:
+            if classify_error(e) != OUTCOME_OVERLOAD or overload_retries >= settings.AI_RATE_LIMIT_OVERLOAD_RETRIES:
+                raise
+            overload_retries += 1
+            delay = overload_backoff(overload_retries, e)
+            if delay is None:
+                logger.warning(f"Provider asked to retry after {e.retry_after:.0f}s, giving up: {e}")
+                raise
+            logger.warning(f"Provider overloaded, requeueing call in {delay:.1f}s "
+                           f"({overload_retries}/{settings.AI_RATE_LIMIT_OVERLOAD_RETRIES}): {e}")
+            # 等待发生在共享生成中，调用方按各自的截止时间等待，最后一个调用方离开时等待随生成一起取消
+            await asyncio.sleep(delay)
+
+async def _shared_generation(model_name: str, prompt: str, use_cache: bool, on_delta: Optional[DeltaCallback],
+                             deadline: Optional[Deadline],
+                             generate: Callable[[Optional[DeltaCallback]], Awaitable[str]]) -> str:
+    """
+    相同 (模型, 提示, 是否读缓存) 的并发调用共享同一次生成
+
+    共享的生成不带单个请求的截止时间，每个调用方按自己的截止时间等待，截止时间较短的调用方
+    离开不影响其他调用方；文本增量转发给所有仍在等待的调用方
+
+    Args:
+        model_name: AI模型名称
+        prompt: 提示文本
+        use_cache: 是否读取响应缓存
+        on_delta: 本调用方的文本增量回调（可选）
+        deadline: 本调用方的截止时间（可选）
+        generate: 执行生成的函数，参数为转发增量的回调
+
+    Returns:
+        测试代码
+
+    Raises:
+        DeadlineExceededError: 如果本调用方的截止时间先到
+    """
+    key = single_flight_key(model_name, prompt, "cache" if use_cache else "no-cache")
+    if on_delta is not None:
+        _delta_listeners.setdefault(key, []).append(on_delta)
+
+    async def _broadcast(delta: str, attempt: int) -> None:
+        for listener in list(_delta_listeners.get(key, ())):
+            try:
+                await listener(delta, attempt)
+            except Exception as e:
+                logger.warning(f"Delta listener failed, ignoring: {e}")
+
+    flight = get_single_flight().do(
+        key,
+        lambda: generate(_broadcast if on_delta is not None else None),
+        on_hit=lambda: get_ai_metrics().increment(model_name, "dedup_hits")
+    )
+    try:
+        if deadline is None:
+            return await flight
+        return await deadline.run(flight, "provider call")
+    finally:
+        if on_delta is not None:
+            listeners = _delta_listeners.get(key, [])
+            if on_delta in listeners:
+                listeners.remove(on_delta)
+            if not listeners:
+                _delta_listeners.pop(key, None)
+
+async def generate_packed_tests_with_ai(snippets: List[CodeSnippet], enhanced_prompt: str = None,
+                                       model_name: str = None, use_cache: bool = True,
+                                       on_delta: Optional[DeltaCallback] = None,
+                                       deadline: Optional[Deadline] = None) -> str:
+    """
+    使用AI为一组代码片段生成一个测试模块
+
+    Args:
+        snippets: 同一组的代码片段
+        enhanced_prompt: 增强的提示（可选），提供时替代默认模板
+        model_name: AI模型名称
+        use_cache: 是否读取响应缓存
+        on_delta: 文本增量回调（可选）
+        deadline: 请求截止时间（可选）
+
+    Returns:
+        测试模块代码
+
+    Raises:
+        ValueError: 如果不支持片段的语言
+        AIAPIError: 如果多次尝试后仍未生成代码
+        DeadlineExceededError: 如果截止时间先到
+    """
+    if deadline is not None:
+        deadline.check("prompt build")
+    prompt = build_packed_prompt(snippets, enhanced_prompt)
+    return await _shared_generation(
+        model_name, prompt, use_cache, on_delta, deadline,
+        lambda forward: _generate_packed_for_prompt(snippets, prompt, model_name, use_cache, forward)
+    )
+
+async def _generate_packed_for_prompt(snippets: List[CodeSnippet], prompt: str, model_name: str, use_cache: bool,
+                                      on_delta: Optional[DeltaCallback]) -> str:
+    """按打包提示生成测试模块（带缓存和重试）"""
+    ai_service = AIServiceFactory.get_service(model_name)
+    names = ", ".join(snippet.name for snippet in snippets)
+
+    cache = get_response_cache()
+    cache_key = cache.make_key(model_name, ai_service.config, prompt) if cache else None
+    if cache and use_cache:
+        cached_code = await cache.get(cache_key, model_name)
+        if cached_code:
+            logger.info(f"Response cache hit for packed snippets [{names}] ({model_name})")
+            return cached_code
+
+    max_retries = 3
+    for attempt in range(1, max_retries + 1):
+        test_code = await AIServiceFactory.generate_hedged(
+            model_name,
+            lambda service, is_primary: _generate_once(service, prompt, on_delta if is_primary else None, attempt),
+            lambda code: bool(code and code.strip())
+        )
+        if test_code and test_code.strip():
+            logger.info(f"Generated packed test module for [{names}] on attempt {attempt}")
+            if cache:
+                await cache.set(cache_key, test_code, model_name)
+            return test_code
+        logger.warning(f"Generated packed test module is empty, retrying ({attempt}/{max_retries})")
+
+    raise AIAPIError(f"Failed to generate packed tests for [{names}] after {max_retries} attempts")
+
+async def _generate_for_prompt(snippet: CodeSnippet, prompt: str, model_name: str, use_cache: bool,
+                               on_delta: Optional[DeltaCallback]) -> str:
+    """
+    按最终提示生成并校验测试代码（带缓存、重试和兜底模板）
+
+    Args:
+        snippet: 代码片段
+        prompt: 最终提示
+        model_name: AI模型名称
+        use_cache: 是否读取响应缓存
+        on_delta: 文本增量回调（可选）
+
+    Returns:
+        测试代码
+    """
+    ai_service = AIServiceFactory.get_service(model_name)
+
+    # 查询响应缓存，键为 (模型名称, 模型配置指纹, 最终提示哈希)
+    cache = get_response_cache()
+    cache_key = cache.make_key(model_name, ai_service.config, prompt) if cache else None
+    if cache and use_cache:
+        cached_code = await cache.get(cache_key, model_name)
+        if cached_code:
+            logger.info(f"Response cache hit for {snippet.name} ({model_name})")
+            return cached_code
+
+    max_retries = 3
+    module_path = "broadcast"
+    validator = get_validator(snippet.language)
+    metrics = get_ai_metrics()
+    metrics.increment(model_name, "validated_generations")
+    current_prompt = prompt
+    test_code = ""
+
+    for attempt in range(1, max_retries + 1):
+        # 对冲调用不转发增量，避免两路输出交错
+        test_code = await AIServiceFactory.generate_hedged(
+            model_name,
+            lambda service, is_primary: _generate_once(service, current_prompt, on_delta if is_primary else None,
+                                                       attempt),
+            lambda code: validator.validate_and_repair(code, snippet).valid
+        )
+
+        # 先在本地修复机械性问题（占位模块名、缺少导入等），修复不了的规则问题只记录警告
+        result = validator.validate_and_repair(test_code, snippet)
+        if result.valid:
+            if result.repaired:
+                metrics.increment(model_name, "local_repairs")
+                logger.info(f"Repaired test code locally for {snippet.name}")
+            if result.warnings:
+                logger.warning(f"Test code for {snippet.name} kept with warnings: {'; '.join(result.warnings)}")
+            logger.info(f"Generated valid test code for {snippet.name} on attempt {attempt}")
+            if cache:
+                await cache.set(cache_key, result.code, model_name)
+            return result.code
+
+        test_code = result.code
+        logger.warning(f"Test code for {snippet.name} is structurally broken: {'; '.join(result.errors)}")
+
+        if attempt < max_retries:
+            # 结构性问题才回到模型，只发送当前代码和具体错误
+            metrics.increment(model_name, "reprompts")
+            logger.warning(f"Re-prompting model with repair prompt ({attempt}/{max_retries})")
+            current_prompt = build_repair_prompt(test_code, result.errors, snippet)
+
+    logger.error(f"Failed to generate valid test code for {snippet.name} after {attempt} attempts")
+
+    template = f"""from {module_path} import {snippet.class_name or snippet.name}
+from {module_path} import socketio
 
-        if "from your_module import" in test_code:
-            logger.warning("Using incorrect module name 'your_module'")
-            return False
+import pytest
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock, patch, Mock, call
+from datetime import datetime
+import io
+import sys
 
-        if "mock.patch" in test_code and "mock.patch('broadcast." not in test_code and "mock.patch(\"broadcast." not in test_code:
-            logger.warning("Using incorrect mock.patch path, should use 'broadcast.'")
-            return False
+@pytest.fixture
+def mock_socketio():
+    with mock.patch('broadcast.socketio') as mock_socket:
+        yield mock_socket
 
-    return True
+def test_{snippet.name}_basic():
+    \"\"\"基本测试 {snippet.name} 函数\"\"\"
+    assert True
+"""
 
-def generate_test_with_ai(snippet: CodeSnippet, enhanced_prompt: str = None, model_name: str = None) -> str:
+    test_functions = []
+    if test_code:
+        func_pattern = re.compile(r'def\s+test_\w+\([^)]*\):[^#]*?(?=def|\Z)', re.DOTALL)
+        matches = func_pattern.findall(test_code)
+        if matches:
+            test_functions = matches
+
+    if test_functions:
+        for func in test_functions:
+            fixed_func = func.replace("your_module", module_path)
+            template += "\n" + fixed_func
+
+    return template
+
+async def generate_test_with_ai(snippet: CodeSnippet, enhanced_prompt: str = None, model_name: str = None,
+                                use_cache: bool = True, on_delta: Optional[DeltaCallback] = None,
+                                deadline: Optional[Deadline] = None) -> str:
+    """
+    使用AI为代码片段生成测试代码
+
+    Args:
+        snippet: 代码片段
+        enhanced_prompt: 增强的提示（可选），提供时替代默认模板
+        model_name: AI模型名称
+        use_cache: 是否读取响应缓存；为False时跳过缓存读取，但仍会用新结果刷新缓存
+        on_delta: 文本增量回调（可选），提供时使用提供商的流式接口
+        deadline: 请求截止时间（可选），提示构建和等待生成结果只能使用剩余预算
+
+    Returns:
+        测试代码
+
+    Raises:
+        DeadlineExceededError: 如果截止时间先到
+    """
     try:
+        if deadline is not None:
+            deadline.check("prompt build")
         if enhanced_prompt:
             prompt = enhanced_prompt
         else:
@@ -83,98 +353,14 @@ def generate_test_with_ai(snippet: CodeSnippet, enhanced_prompt: str = None, mod
                 function_name=snippet.name
             )
 
-        ai_service = AIServiceFactory.get_service(model_name)
-        max_retries = 3
-        current_retry = 0
-        module_path = "broadcast"
-
-        while current_retry < max_retries:
-            test_code = ai_service.generate(prompt)
-
-            if validate_test_code(test_code, snippet, module_path):
-                logger.info(f"Generated valid test code for {snippet.name} on attempt {current_retry + 1}")
-                return test_code
-
-            logger.warning(f"Generated test code failed validation, attempting to fix")
-
-            fixed_code = test_code
-
-            if "from your_module import" in fixed_code:
-                fixed_code = fixed_code.replace("from your_module import", f"from {module_path} import")
-                logger.info("Fixed import statement: replaced 'your_module' with 'broadcast'")
-
-            if "mock.patch('your_module." in fixed_code:
-                fixed_code = fixed_code.replace("mock.patch('your_module.", f"mock.patch('{module_path}.")
-                logger.info("Fixed mock.patch path: replaced 'your_module' with 'broadcast'")
-
-            if "mock.patch(\"your_module." in fixed_code:
-                fixed_code = fixed_code.replace("mock.patch(\"your_module.", f"mock.patch(\"{module_path}.")
-                logger.info("Fixed mock.patch path: replaced 'your_module' with 'broadcast'")
-
-            if "import pytest" not in fixed_code:
-                fixed_code = "import pytest\n" + fixed_code
-                logger.info("Added missing pytest import")
-
-            import_statement = f"from {module_path} import {snippet.class_name or snippet.name}"
-            if import_statement not in fixed_code:
-                fixed_code = import_statement + "\n" + fixed_code
-                logger.info(f"Added missing import statement: {import_statement}")
-
-            if validate_test_code(fixed_code, snippet, module_path):
-                logger.info(f"Successfully fixed test code for {snippet.name}")
-                return fixed_code
-
-            current_retry += 1
-            logger.warning(f"Auto-fix failed, retrying ({current_retry}/{max_retries})")
-
-            if current_retry < max_retries:
-                enhanced_prompt = prompt + f"""
-
-极其重要的提示：
-1. 必须使用 "from broadcast import {snippet.class_name or snippet.name}" 而不是 "from your_module import {snippet.class_name or snippet.name}"
-2. 当使用mock.patch时，必须使用 'broadcast.socketio' 而不是 'your_module.socketio'
-3. 必须包含 "import pytest"
-4. 测试函数名必须以 "test_" 开头
-"""
-                prompt = enhanced_prompt
-
-        logger.error(f"Failed to generate valid test code for {snippet.name} after {max_retries} attempts")
-
-        template = f"""from {module_path} import {snippet.class_name or snippet.name}
-from {module_path} import socketio
-
-import pytest
-import unittest
-from unittest import mock
-from unittest.mock import MagicMock, patch, Mock, call
-from datetime import datetime
-import io
-import sys
-
-@pytest.fixture
-def mock_socketio():
-    with mock.patch('broadcast.socketio') as mock_socket:
-        yield mock_socket
-
-def test_{snippet.name}_basic():
-    \"\"\"基本测试 {snippet.name} 函数\"\"\"
-    assert True
-"""
-
-        test_functions = []
-        if test_code:
-            func_pattern = re.compile(r'def\s+test_\w+\([^)]*\):[^#]*?(?=def|\Z)', re.DOTALL)
-            matches = func_pattern.findall(test_code)
-            if matches:
-                test_functions = matches
-
-        if test_functions:
-            for func in test_functions:
-                fixed_func = func.replace("your_module", module_path)
-                template += "\n" + fixed_func
-
-        return template
+        return await _shared_generation(
+            model_name, prompt, use_cache, on_delta, deadline,
+            lambda forward: _generate_for_prompt(snippet, prompt, model_name, use_cache, forward)
+        )
 
+    except DeadlineExceededError:
+        # 超时的片段作为失败结果返回，不用兜底模板冒充生成成功
+        raise
     except Exception as e:
         logger.error(f"Error generating test with AI: {e}")
 
@@ -0,0 +1,102 @@
+"""
+请求截止时间
+每个生成请求携带一个端到端的截止时间，显式传递给解析、提示构建、提供商调用和校验修复各阶段；
+每个阶段只能使用剩余的预算，预算耗尽时抛出 DeadlineExceededError
+"""
+
+import asyncio
+import time
+from typing import Optional, Awaitable, TypeVar
+
+from app.config import settings
+
+T = TypeVar("T")
+
+
+class DeadlineExceededError(Exception):
+    """请求的截止时间已过"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    端到端截止时间
+
+    Args:
+        seconds: 从现在起的预算（秒）
+    """
+
+    def __init__(self, seconds: float):
+        self.budget = max(0.0, seconds)
+        self._expires_at = time.monotonic() + self.budget
+
+    @classmethod
+    def for_request(cls, seconds: Optional[float] = None) -> "Deadline":
+        """
+        按请求指定的预算创建截止时间，预算不能超过 REQUEST_DEADLINE_MAX_SECONDS
+
+        Args:
+            seconds: 请求指定的预算（可选），缺省为 REQUEST_DEADLINE_SECONDS
+        """
+        return cls(min(seconds or settings.REQUEST_DEADLINE_SECONDS, settings.REQUEST_DEADLINE_MAX_SECONDS))
+
+    @classmethod
+    def from_timestamp(cls, expires_at: float) -> "Deadline":
+        """按墙上时间的截止时刻创建（跨实例传递时使用）"""
+        return cls(expires_at - time.time())
+
+    def timestamp(self) -> float:
+        """截止时刻的墙上时间，用于跨实例传递"""
+        return time.time() + self.remaining()
+
+    def remaining(self) -> float:
+        """剩余预算（秒），已过期时为0"""
+        return max(0.0, self._expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self._expires_at
+
+    def check(self, stage: str) -> None:
+        """
+        进入下一阶段前检查预算
+
+        Args:
+            stage: 阶段名称
+
+        Raises:
+            DeadlineExceededError: 如果截止时间已过
+        """
+        if self.expired:
+            raise DeadlineExceededError(stage)
+
+    async def run(self, awaitable: Awaitable[T], stage: str) -> T:
+        """
+        在剩余预算内等待，超时时取消等待的操作
+
+        Args:
+            awaitable: 要等待的操作
+            stage: 阶段名称
+
+        Returns:
+            操作的结果
+
+        Raises:
+            DeadlineExceededError: 如果截止时间先到
+        """
+        if self.expired:
+            # 未等待的协程需要关闭，避免 "never awaited" 警告
+            close = getattr(awaitable, "close", None)
+            if close is not None:
+                close()
+            raise DeadlineExceededError(stage)
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            # 操作自身的超时（如提供商超时）按原异常处理
+            if not self.expired:
+                raise
+            raise DeadlineExceededError(stage) from None
@@ -0,0 +1,936 @@
+"""
+分布式任务队列
+多个后端实例共享一个Redis：任务按加权公平排队（与实例内调度器相同的虚拟完成时间规则，区分用户和通道）
+进入共享的等待集合，任意实例在集群并发上限内领取执行，执行产出的事件通过 pub/sub 发布，
+持有客户端连接的实例订阅后转发给客户端。
+执行中的任务持有带过期时间的租约：实例关闭时任务重新排队，实例崩溃时租约过期后由其他实例重新领取。
+没有配置 REDIS_URL 时使用进程内的替身后端，便于本地测试
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from typing import Dict, Any, Optional, Callable, Awaitable, AsyncIterator, List, Tuple
+
+from app.config import settings
+from app.services.task_scheduler import QueueFullError, TaskCancelledError, LANE_INTERACTIVE
+from app.services.wait_estimator import WaitTimeEstimator
+from app.utils.logger import logger
+
+# 任务处理函数：以分布式任务为参数，产出要转发给客户端的内容（NDJSON行）
+JobHandler = Callable[["DistributedJob"], AsyncIterator[str]]
+
+# 提交结果
+SUBMIT_QUEUED = 1
+SUBMIT_EXISTS = 0
+SUBMIT_QUOTA_EXCEEDED = -1
+
+# 任务状态（见 QueueBackend.job_state）
+JOB_STATE_PENDING = "pending"
+JOB_STATE_RUNNING = "running"
+
+
+class QueueBackend:
+    """
+    分布式队列的存储后端接口
+
+    任务数据为JSON字符串，至少包含 user_id 和 cost；等待中的任务按虚拟完成时间排序，
+    执行中的任务按租约过期时间记录
+    """
+
+    async def submit(self, job_id: str, user_id: str, size: float, data: str, max_pending_per_user: int) -> int:
+        """
+        提交任务：按 max(虚拟时间, 该用户上一个任务的完成时间) + size 计算虚拟完成时间后加入等待集合
+
+        Returns:
+            SUBMIT_QUEUED；任务已存在时返回 SUBMIT_EXISTS；用户等待中的任务超过配额时返回 SUBMIT_QUOTA_EXCEEDED
+        """
+        raise NotImplementedError
+
+    async def pop(self, lease_ttl: float, max_running: int, max_running_per_user: int,
+                  max_running_cost: int) -> Optional[Tuple[str, str]]:
+        """
+        领取虚拟完成时间最小的可执行任务并加入租约；租约已过期的任务先重新排队
+
+        跳过执行中任务数已达 max_running_per_user 的用户；执行中任务的成本总和超出 max_running_cost 时
+        停止领取（没有执行中的任务时总是领取）
+
+        Returns:
+            (任务ID, 任务数据)，集群名额已满或没有可执行的任务时返回None
+        """
+        raise NotImplementedError
+
+    async def renew(self, job_id: str, lease_ttl: float) -> bool:
+        """续期租约，租约已不存在（已过期被重新排队或已结束）时返回False"""
+        raise NotImplementedError
+
+    async def requeue(self, job_id: str) -> bool:
+        """把执行中的任务按原虚拟完成时间放回等待集合"""
+        raise NotImplementedError
+
+    async def finish(self, job_id: str) -> None:
+        """结束任务，删除租约和任务数据"""
+        raise NotImplementedError
+
+    async def remove_pending(self, job_id: str) -> bool:
+        """删除等待中的任务，任务不在等待中时返回False"""
+        raise NotImplementedError
+
+    async def job_state(self, job_id: str) -> Optional[Tuple[str, str, Optional[int]]]:
+        """
+        获取任务状态
+
+        Returns:
+            (任务数据, 状态, 等待位置)，执行中的任务位置为None；任务不存在时返回None
+        """
+        raise NotImplementedError
+
+    async def counts(self) -> Tuple[int, int]:
+        """获取 (等待中, 执行中) 的任务数"""
+        raise NotImplementedError
+
+    async def set_flag(self, key: str, ttl: float) -> None:
+        """设置带过期时间的标记"""
+        raise NotImplementedError
+
+    async def has_flag(self, key: str) -> bool:
+        """检查标记是否存在"""
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: str) -> None:
+        """发布消息"""
+        raise NotImplementedError
+
+    def subscribe(self, channel: str) -> "Subscription":
+        """订阅频道"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """关闭连接"""
+        pass
+
+
+class Subscription:
+    """频道订阅，需先 start() 再读取，用完 close()"""
+
+    async def start(self) -> None:
+        raise NotImplementedError
+
+    async def get(self, timeout: float) -> Optional[str]:
+        """读取下一条消息，超时返回None"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        raise NotImplementedError
+
+
+class InMemoryBackend(QueueBackend):
+    """进程内替身后端，语义与Redis后端一致，用于本地开发和测试"""
+
+    def __init__(self):
+        self._pending: Dict[str, float] = {}
+        self._running: Dict[str, float] = {}
+        self._data: Dict[str, str] = {}
+        self._tags: Dict[str, float] = {}
+        self._user_finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._flags: Dict[str, float] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    def _user(self, job_id: str) -> str:
+        return json.loads(self._data[job_id])["user_id"]
+
+    def _pending_order(self) -> List[str]:
+        return sorted(self._pending, key=lambda job_id: (self._pending[job_id], job_id))
+
+    async def submit(self, job_id: str, user_id: str, size: float, data: str, max_pending_per_user: int) -> int:
+        if job_id in self._data:
+            return SUBMIT_EXISTS
+        if sum(1 for pending in self._pending if self._user(pending) == user_id) >= max_pending_per_user:
+            return SUBMIT_QUOTA_EXCEEDED
+        finish_tag = max(self._virtual_time, self._user_finish.get(user_id, 0.0)) + size
+        self._user_finish[user_id] = finish_tag
+        self._data[job_id] = data
+        self._tags[job_id] = finish_tag
+        self._pending[job_id] = finish_tag
+        return SUBMIT_QUEUED
+
+    async def pop(self, lease_ttl: float, max_running: int, max_running_per_user: int,
+                  max_running_cost: int) -> Optional[Tuple[str, str]]:
+        now = time.time()
+        for job_id in [job_id for job_id, expires in self._running.items() if expires <= now]:
+            del self._running[job_id]
+            if job_id in self._data:
+                self._pending[job_id] = self._tags[job_id]
+        if len(self._running) >= max_running:
+            return None
+
+        per_user: Dict[str, int] = {}
+        running_cost = 0
+        for job_id in self._running:
+            job = json.loads(self._data[job_id])
+            per_user[job["user_id"]] = per_user.get(job["user_id"], 0) + 1
+            running_cost += job["cost"]
+
+        for job_id in self._pending_order():
+            job = json.loads(self._data[job_id])
+            if per_user.get(job["user_id"], 0) >= max_running_per_user:
+                continue
+            if self._running and running_cost + job["cost"] > max_running_cost:
+                return None
+            del self._pending[job_id]
+            self._running[job_id] = now + lease_ttl
+            self._virtual_time = max(self._virtual_time, self._tags[job_id] - job["size"])
+            return job_id, self._data[job_id]
+        return None
+
+    async def renew(self, job_id: str, lease_ttl: float) -> bool:
+        if job_id not in self._running or self._running[job_id] <= time.time():
+            return False
+        self._running[job_id] = time.time() + lease_ttl
+        return True
+
+    async def requeue(self, job_id: str) -> bool:
+        if self._running.pop(job_id, None) is None or job_id not in self._data:
+            return False
+        self._pending[job_id] = self._tags[job_id]
+        return True
+
+    async def finish(self, job_id: str) -> None:
+        self._running.pop(job_id, None)
+        self._data.pop(job_id, None)
+        self._tags.pop(job_id, None)
+
+    async def remove_pending(self, job_id: str) -> bool:
+        if self._pending.pop(job_id, None) is None:
+            return False
+        self._data.pop(job_id, None)
+        self._tags.pop(job_id, None)
+        return True
+
+    async def job_state(self, job_id: str) -> Optional[Tuple[str, str, Optional[int]]]:
+        data = self._data.get(job_id)
+        if data is None:
+            return None
+        if job_id in self._pending:
+            return data, JOB_STATE_PENDING, self._pending_order().index(job_id) + 1
+        return data, JOB_STATE_RUNNING, None
+
+    async def counts(self) -> Tuple[int, int]:
+        now = time.time()
+        return len(self._pending), sum(1 for expires in self._running.values() if expires > now)
+
+    async def set_flag(self, key: str, ttl: float) -> None:
+        self._flags[key] = time.time() + ttl
+
+    async def has_flag(self, key: str) -> bool:
+        expires = self._flags.get(key)
+        if expires is None:
+            return False
+        if expires <= time.time():
+            del self._flags[key]
+            return False
+        return True
+
+    async def publish(self, channel: str, message: str) -> None:
+        for queue in self._subscribers.get(channel, ()):
+            queue.put_nowait(message)
+
+    def subscribe(self, channel: str) -> Subscription:
+        return _InMemorySubscription(self, channel)
+
+
+class _InMemorySubscription(Subscription):
+
+    def __init__(self, backend: InMemoryBackend, channel: str):
+        self._backend = backend
+        self._channel = channel
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def start(self) -> None:
+        self._backend._subscribers.setdefault(self._channel, []).append(self._queue)
+
+    async def get(self, timeout: float) -> Optional[str]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self) -> None:
+        subscribers = self._backend._subscribers.get(self._channel, [])
+        if self._queue in subscribers:
+            subscribers.remove(self._queue)
+        if not subscribers:
+            self._backend._subscribers.pop(self._channel, None)
+
+
+# Redis脚本使用的键（顺序固定）：等待集合、租约集合、任务数据、虚拟完成时间、用户上一个任务的完成时间、虚拟时间
+_KEY_NAMES = ("pending", "running", "data", "tags", "user_finish", "virtual_time")
+
+# 提交任务（原子执行）
+_SUBMIT_SCRIPT = """
+if redis.call('HEXISTS', KEYS[3], ARGV[1]) == 1 then
+    return 0
+end
+local pending = 0
+for _, id in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    local data = redis.call('HGET', KEYS[3], id)
+    if data and cjson.decode(data)['user_id'] == ARGV[2] then
+        pending = pending + 1
+    end
+end
+if pending >= tonumber(ARGV[5]) then
+    return -1
+end
+local virtual_time = tonumber(redis.call('GET', KEYS[6]) or '0')
+local last_finish = tonumber(redis.call('HGET', KEYS[5], ARGV[2]) or '0')
+local finish_tag = math.max(virtual_time, last_finish) + tonumber(ARGV[3])
+redis.call('HSET', KEYS[5], ARGV[2], finish_tag)
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[4])
+redis.call('HSET', KEYS[4], ARGV[1], finish_tag)
+redis.call('ZADD', KEYS[1], finish_tag, ARGV[1])
+return 1
+"""
+
+# 租约过期的任务重新排队后，按虚拟完成时间领取可执行的任务（原子执行）
+_POP_SCRIPT = """
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])) do
+    redis.call('ZREM', KEYS[2], id)
+    local tag = redis.call('HGET', KEYS[4], id)
+    if tag and redis.call('HEXISTS', KEYS[3], id) == 1 then
+        redis.call('ZADD', KEYS[1], tag, id)
+    end
+end
+local running = redis.call('ZRANGE', KEYS[2], 0, -1)
+if #running >= tonumber(ARGV[3]) then
+    return false
+end
+local per_user = {}
+local running_cost = 0
+for _, id in ipairs(running) do
+    local data = redis.call('HGET', KEYS[3], id)
+    if data then
+        local job = cjson.decode(data)
+        per_user[job['user_id']] = (per_user[job['user_id']] or 0) + 1
+        running_cost = running_cost + job['cost']
+    end
+end
+for _, id in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    local data = redis.call('HGET', KEYS[3], id)
+    if not data then
+        redis.call('ZREM', KEYS[1], id)
+    else
+        local job = cjson.decode(data)
+        if (per_user[job['user_id']] or 0) < tonumber(ARGV[4]) then
+            if #running > 0 and running_cost + job['cost'] > tonumber(ARGV[5]) then
+                return false
+            end
+            redis.call('ZREM', KEYS[1], id)
+            redis.call('ZADD', KEYS[2], ARGV[2], id)
+            local start_tag = tonumber(redis.call('HGET', KEYS[4], id)) - job['size']
+            if start_tag > tonumber(redis.call('GET', KEYS[6]) or '0') then
+                redis.call('SET', KEYS[6], start_tag)
+            end
+            return {id, data}
+        end
+    end
+end
+return false
+"""
+
+# 把执行中的任务放回等待集合（原子执行）
+_REQUEUE_SCRIPT = """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+local tag = redis.call('HGET', KEYS[4], ARGV[1])
+if not tag then
+    return 0
+end
+redis.call('ZADD', KEYS[1], tag, ARGV[1])
+return 1
+"""
+
+# 删除等待中的任务（原子执行）
+_REMOVE_PENDING_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HDEL', KEYS[3], ARGV[1])
+redis.call('HDEL', KEYS[4], ARGV[1])
+return 1
+"""
+
+
+class RedisBackend(QueueBackend):
+    """
+    Redis后端：等待中的任务用有序集合（分数为虚拟完成时间），执行中的任务用有序集合保存租约过期时间，
+    任务数据用哈希表，提交、领取和重新排队用Lua脚本原子执行，事件用 pub/sub 发布
+
+    Args:
+        url: Redis连接地址
+        prefix: 键前缀
+    """
+
+    def __init__(self, url: str, prefix: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("分布式队列需要安装 redis 包（redis>=4.5.0）") from e
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._keys = [f"{prefix}:{name}" for name in _KEY_NAMES]
+        self._submit_script = self._redis.register_script(_SUBMIT_SCRIPT)
+        self._pop_script = self._redis.register_script(_POP_SCRIPT)
+        self._requeue_script = self._redis.register_script(_REQUEUE_SCRIPT)
+        self._remove_pending_script = self._redis.register_script(_REMOVE_PENDING_SCRIPT)
+
+    async def submit(self, job_id: str, user_id: str, size: float, data: str, max_pending_per_user: int) -> int:
+        return int(await self._submit_script(keys=self._keys, args=[job_id, user_id, size, data, max_pending_per_user]))
+
+    async def pop(self, lease_ttl: float, max_running: int, max_running_per_user: int,
+                  max_running_cost: int) -> Optional[Tuple[str, str]]:
+        now = time.time()
+        item = await self._pop_script(keys=self._keys, args=[now, now + lease_ttl, max_running, max_running_per_user,
+                                                            max_running_cost])
+        return (item[0], item[1]) if item else None
+
+    async def renew(self, job_id: str, lease_ttl: float) -> bool:
+        running = self._keys[1]
+        expires = await self._redis.zscore(running, job_id)
+        if expires is None or expires <= time.time():
+            return False
+        await self._redis.zadd(running, {job_id: time.time() + lease_ttl}, xx=True)
+        return True
+
+    async def requeue(self, job_id: str) -> bool:
+        return bool(await self._requeue_script(keys=self._keys, args=[job_id]))
+
+    async def finish(self, job_id: str) -> None:
+        pipe = self._redis.pipeline()
+        pipe.zrem(self._keys[1], job_id)
+        pipe.hdel(self._keys[2], job_id)
+        pipe.hdel(self._keys[3], job_id)
+        await pipe.execute()
+
+    async def remove_pending(self, job_id: str) -> bool:
+        return bool(await self._remove_pending_script(keys=self._keys, args=[job_id]))
+
+    async def job_state(self, job_id: str) -> Optional[Tuple[str, str, Optional[int]]]:
+        data = await self._redis.hget(self._keys[2], job_id)
+        if data is None:
+            return None
+        rank = await self._redis.zrank(self._keys[0], job_id)
+        if rank is not None:
+            return data, JOB_STATE_PENDING, rank + 1
+        return data, JOB_STATE_RUNNING, None
+
+    async def counts(self) -> Tuple[int, int]:
+        pending = await self._redis.zcard(self._keys[0])
+        running = await self._redis.zcount(self._keys[1], time.time(), "+inf")
+        return pending, running
+
+    async def set_flag(self, key: str, ttl: float) -> None:
+        await self._redis.set(key, "1", ex=max(1, int(ttl)))
+
+    async def has_flag(self, key: str) -> bool:
+        return bool(await self._redis.exists(key))
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self._redis.publish(channel, message)
+
+    def subscribe(self, channel: str) -> Subscription:
+        return _RedisSubscription(self._redis, channel)
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+
+class _RedisSubscription(Subscription):
+
+    def __init__(self, client, channel: str):
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._channel = channel
+
+    async def start(self) -> None:
+        await self._pubsub.subscribe(self._channel)
+
+    async def get(self, timeout: float) -> Optional[str]:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = await self._pubsub.get_message(timeout=remaining)
+            if message is not None and message.get("type") == "message":
+                return message["data"]
+
+    async def close(self) -> None:
+        await self._pubsub.unsubscribe(self._channel)
+        await self._pubsub.close()
+
+
+class DistributedJob:
+    """工作实例上执行中的任务"""
+
+    def __init__(self, job_id: str, job_type: str, user_id: str, lane: str, payload: Dict[str, Any]):
+        self.task_id = job_id
+        self.job_type = job_type
+        self.user_id = user_id
+        self.lane = lane
+        self.payload = payload
+        self.started_at = time.time()
+        self.progress: Dict[str, Any] = {}
+        # 执行被中止的原因：cancelled（取消）/ lost（租约已失效，任务由其他实例重新领取）
+        self.stop_reason: Optional[str] = None
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self.stop_reason == "cancelled"
+
+    def update_progress(self, **progress: Any) -> None:
+        """更新任务进度（completed、total、current等）"""
+        self.progress.update(progress)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "task_id": self.task_id,
+            "id": self.task_id,
+            "user_id": self.user_id,
+            "lane": self.lane,
+            "type": self.job_type,
+            "status": "running",
+            "start_time": self.started_at,
+            "instance_id": settings.INSTANCE_ID
+        }
+        data.update(self.progress)
+        return data
+
+
+class DistributedQueue:
+    """
+    基于共享后端的分布式任务队列
+
+    Args:
+        backend: 存储后端
+        max_running: 集群范围的最大并发任务数
+        workers: 本实例（进程）同时执行的最大任务数
+    """
+
+    def __init__(self, backend: QueueBackend, max_running: int, workers: int):
+        self.backend = backend
+        self.max_running = max_running
+        self.workers = workers
+        self._prefix = settings.QUEUE_KEY_PREFIX
+        self._handlers: Dict[str, JobHandler] = {}
+        self._running: Dict[str, DistributedJob] = {}
+        self._job_tasks: Dict[str, asyncio.Task] = {}
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._slot_freed = asyncio.Event()
+        # 按本实例执行的任务耗时估算集群队列的等待时间（负载均衡下可代表集群）
+        self.wait_estimator = WaitTimeEstimator(settings.QUEUE_ESTIMATOR_WINDOW, settings.QUEUE_INITIAL_RUN_SECONDS)
+
+    def register_handler(self, job_type: str, handler: JobHandler) -> None:
+        """注册任务处理函数"""
+        self._handlers[job_type] = handler
+
+    def _events_channel(self, job_id: str) -> str:
+        return f"{self._prefix}:events:{job_id}"
+
+    def _cancel_key(self, job_id: str) -> str:
+        return f"{self._prefix}:cancel:{job_id}"
+
+    # ---- 提交方 ----
+
+    async def submit(self, job_type: str, payload: Dict[str, Any], user_id: str = "anonymous",
+                     lane: str = LANE_INTERACTIVE, cost: int = 0, job_id: Optional[str] = None) -> str:
+        """
+        提交任务到集群队列
+
+        Args:
+            job_type: 任务类型
+            payload: 任务参数（可JSON序列化）
+            user_id: 用户ID
+            lane: 通道（interactive / batch）
+            cost: 预估token成本
+            job_id: 任务ID（可选），相同ID的任务在集群中只排队一次
+
+        Returns:
+            任务ID
+
+        Raises:
+            ValueError: 如果通道不存在
+            QueueFullError: 如果用户等待中的任务超过配额
+        """
+        weights = settings.QUEUE_LANE_WEIGHTS
+        if lane not in weights:
+            raise ValueError(f"Unknown queue lane: {lane}")
+        job_id = job_id or str(uuid.uuid4())
+        cost = max(1, cost)
+        size = cost / weights[lane]
+        data = json.dumps({
+            "job_id": job_id,
+            "type": job_type,
+            "user_id": user_id,
+            "lane": lane,
+            "cost": cost,
+            "size": size,
+            "payload": payload,
+            "submitted_at": time.time()
+        })
+        result = await self.backend.submit(job_id, user_id, size, data, settings.QUEUE_MAX_PENDING_PER_USER)
+        if result == SUBMIT_QUOTA_EXCEEDED:
+            raise QueueFullError(f"用户 {user_id} 等待中的任务已达上限 {settings.QUEUE_MAX_PENDING_PER_USER}")
+        if result == SUBMIT_QUEUED:
+            logger.info(f"[{settings.INSTANCE_ID}] Submitted distributed job {job_id} "
+                        f"({job_type}, user={user_id}, lane={lane}, cost={cost})")
+        return job_id
+
+    async def stream_job(self, job_type: str, payload: Dict[str, Any], user_id: str = "anonymous",
+                         lane: str = LANE_INTERACTIVE, cost: int = 0,
+                         queued_event: Optional[Callable[[Dict[str, Any]], str]] = None,
+                         requeued_event: Optional[Callable[[str], str]] = None,
+                         cancelled_event: Optional[Callable[[str], str]] = None,
+                         rejected_event: Optional[Callable[[Exception], str]] = None,
+                         is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> AsyncIterator[str]:
+        """
+        提交任务并转发执行实例发布的事件
+
+        先订阅事件频道再提交任务，保证不会漏掉事件；客户端断开时通知执行实例停止。
+
+        Args:
+            job_type: 任务类型
+            payload: 任务参数（可JSON序列化）
+            user_id: 用户ID
+            lane: 通道
+            cost: 预估token成本
+            queued_event: 把排队状态转换为输出内容的函数（可选），等待领取期间定期产出
+            requeued_event: 执行实例停止、任务重新排队时的输出内容（可选），参数为任务ID
+            cancelled_event: 任务被取消时的输出内容（可选），参数为任务ID
+            rejected_event: 超出用户配额或通道不存在时的输出内容（可选，未提供时抛出异常）
+            is_disconnected: 检查客户端是否已断开的函数（可选），没有事件时检查，断开后取消任务
+
+        Yields:
+            执行实例产出的内容
+        """
+        job_id = str(uuid.uuid4())
+        subscription = self.backend.subscribe(self._events_channel(job_id))
+        await subscription.start()
+        finished = False
+        try:
+            try:
+                await self.submit(job_type, payload, user_id, lane, cost, job_id)
+            except (ValueError, QueueFullError) as e:
+                finished = True
+                if rejected_event is None:
+                    raise
+                yield rejected_event(e)
+                return
+
+            while True:
+                message = await subscription.get(settings.QUEUE_STATUS_UPDATE_INTERVAL)
+                if message is None:
+                    if is_disconnected is not None and await is_disconnected():
+                        logger.info(f"Client of distributed job {job_id} disconnected")
+                        return
+                    if queued_event is not None:
+                        status = await self.get_job_status(job_id)
+                        if status is not None and status["status"] == JOB_STATE_PENDING:
+                            yield queued_event(status)
+                    continue
+                envelope = json.loads(message)
+                if envelope.get("requeued"):
+                    if requeued_event is not None:
+                        yield requeued_event(job_id)
+                    continue
+                if envelope.get("end"):
+                    finished = True
+                    if envelope.get("status") == "cancelled" and cancelled_event is not None:
+                        yield cancelled_event(job_id)
+                    return
+                yield envelope["event"]
+        finally:
+            await subscription.close()
+            if not finished:
+                await self.cancel(job_id)
+
+    async def run_job(self, job_type: str, payload: Dict[str, Any], user_id: str = "anonymous",
+                      lane: str = LANE_INTERACTIVE, cost: int = 0) -> Dict[str, Any]:
+        """
+        提交任务并等待执行结果（非流式），处理函数产出的最后一行JSON即为结果
+
+        Args:
+            job_type: 任务类型
+            payload: 任务参数（可JSON序列化）
+            user_id: 用户ID
+            lane: 通道
+            cost: 预估token成本
+
+        Returns:
+            结果字典
+
+        Raises:
+            ValueError: 如果通道不存在
+            QueueFullError: 如果用户等待中的任务超过配额
+            TaskCancelledError: 如果任务被取消
+            RuntimeError: 如果任务执行失败
+        """
+        result = None
+        cancelled = False
+
+        def _on_cancelled(job_id: str) -> str:
+            nonlocal cancelled
+            cancelled = True
+            return ""
+
+        async for line in self.stream_job(job_type, payload, user_id, lane, cost, cancelled_event=_on_cancelled):
+            if line:
+                result = json.loads(line)
+        if cancelled:
+            raise TaskCancelledError("Task cancelled")
+        if result is None:
+            raise RuntimeError(f"Distributed job {job_type} finished without a result")
+        if result.get("status") == "error":
+            raise RuntimeError(result.get("error") or f"Distributed job {job_type} failed")
+        return result
+
+    async def cancel(self, job_id: str, user_id: Optional[str] = None) -> bool:
+        """
+        请求停止任务：等待中的任务直接出队，执行中的任务由执行实例检查取消标记后中止
+
+        Args:
+            job_id: 任务ID
+            user_id: 用户ID，提供时只能取消自己的任务
+
+        Returns:
+            是否找到任务（已结束的任务返回False）
+
+        Raises:
+            PermissionError: 如果任务不属于该用户
+        """
+        state = await self.backend.job_state(job_id)
+        if state is None:
+            return False
+        if user_id is not None and json.loads(state[0])["user_id"] != user_id:
+            raise PermissionError("Access denied")
+
+        await self.backend.set_flag(self._cancel_key(job_id), settings.QUEUE_JOB_CANCEL_TTL)
+        if await self.backend.remove_pending(job_id):
+            await self.backend.publish(self._events_channel(job_id), json.dumps({"end": True, "status": "cancelled"}))
+        logger.info(f"Distributed job {job_id} cancellation requested")
+        return True
+
+    # ---- 执行方 ----
+
+    async def start(self) -> None:
+        """启动本实例的领取协程"""
+        if self._dispatcher is not None:
+            return
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        logger.info(f"[{settings.INSTANCE_ID}] Started distributed queue dispatcher "
+                    f"({self.workers} local slots, cluster limit {self.max_running})")
+
+    async def stop(self) -> None:
+        """停止领取；本实例执行中的任务重新排队，由其他实例继续执行"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        tasks = list(self._job_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.backend.close()
+
+    async def _dispatch_loop(self) -> None:
+        """本实例有空闲名额时从集群队列领取任务，集群名额已满或没有任务时按间隔轮询"""
+        while True:
+            try:
+                if len(self._job_tasks) >= self.workers:
+                    self._slot_freed.clear()
+                    await self._slot_freed.wait()
+                    continue
+                item = await self.backend.pop(settings.QUEUE_LEASE_TTL, self.max_running,
+                                              settings.QUEUE_MAX_RUNNING_PER_USER, settings.QUEUE_MAX_RUNNING_COST)
+                if item is None:
+                    await asyncio.sleep(settings.QUEUE_WORKER_POLL_INTERVAL)
+                    continue
+                job_id, data = item
+                task = asyncio.create_task(self._run_job(json.loads(data)))
+                self._job_tasks[job_id] = task
+                task.add_done_callback(lambda _, job_id=job_id: self._job_done(job_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Distributed queue dispatcher error: {e}")
+                await asyncio.sleep(settings.QUEUE_WORKER_POLL_INTERVAL)
+
+    def _job_done(self, job_id: str) -> None:
+        self._job_tasks.pop(job_id, None)
+        self._slot_freed.set()
+
+    async def _supervise(self, job: DistributedJob, runner: asyncio.Task) -> None:
+        """
+        执行期间定期续期租约（实例崩溃时租约过期，任务由其他实例重新领取），
+        并检查取消标记，发现任务被取消或租约已失效时中止执行（包括进行中的提供商调用）
+        """
+        poll_interval = max(settings.QUEUE_WORKER_POLL_INTERVAL, 1.0)
+        last_renew = time.monotonic()
+        while not runner.done():
+            await asyncio.sleep(poll_interval)
+            if await self.backend.has_flag(self._cancel_key(job.task_id)):
+                logger.info(f"Distributed job {job.task_id} cancelled, stopping execution")
+                job.stop_reason = "cancelled"
+                runner.cancel()
+                return
+            if time.monotonic() - last_renew >= settings.QUEUE_LEASE_TTL / 3:
+                if not await self.backend.renew(job.task_id, settings.QUEUE_LEASE_TTL):
+                    logger.warning(f"Lease on distributed job {job.task_id} expired, stopping local execution")
+                    job.stop_reason = "lost"
+                    runner.cancel()
+                    return
+                last_renew = time.monotonic()
+
+    async def _publish_events(self, job: DistributedJob, handler: JobHandler) -> None:
+        channel = self._events_channel(job.task_id)
+        stream = handler(job)
+        try:
+            async for event in stream:
+                await self.backend.publish(channel, json.dumps({"event": event}))
+        finally:
+            await stream.aclose()
+
+    async def _run_job(self, message: Dict[str, Any]) -> None:
+        job_id = message["job_id"]
+        channel = self._events_channel(job_id)
+        if await self.backend.has_flag(self._cancel_key(job_id)):
+            logger.info(f"Skipping cancelled distributed job {job_id}")
+            await self.backend.finish(job_id)
+            await self.backend.publish(channel, json.dumps({"end": True, "status": "cancelled"}))
+            return
+
+        handler = self._handlers.get(message["type"])
+        if handler is None:
+            logger.error(f"Unknown distributed job type: {message['type']}")
+            await self.backend.finish(job_id)
+            await self.backend.publish(channel, json.dumps({"event": json.dumps({
+                "error": f"Unknown job type: {message['type']}", "status": "error"
+            }) + "\n"}))
+            await self.backend.publish(channel, json.dumps({"end": True, "status": "failed"}))
+            return
+
+        job = DistributedJob(job_id, message["type"], message["user_id"], message.get("lane", LANE_INTERACTIVE),
+                             message.get("payload", {}))
+        self._running[job_id] = job
+        logger.info(f"[{settings.INSTANCE_ID}] Running distributed job {job_id}, "
+                    f"waited {job.started_at - message.get('submitted_at', job.started_at):.2f}s")
+        runner = asyncio.create_task(self._publish_events(job, handler))
+        supervisor = asyncio.create_task(self._supervise(job, runner))
+        status = "completed"
+        try:
+            await runner
+            self.wait_estimator.record(time.time() - job.started_at)
+        except asyncio.CancelledError:
+            if job.stop_reason is None:
+                # 实例关闭：任务重新排队，由其他实例从头执行
+                status = "requeued"
+                raise
+            status = job.stop_reason
+        except Exception as e:
+            status = "failed"
+            logger.error(f"Distributed job {job_id} failed: {e}")
+            await self.backend.publish(channel, json.dumps({"event": json.dumps({"error": str(e), "status": "error"}) + "\n"}))
+        finally:
+            supervisor.cancel()
+            if not runner.done():
+                runner.cancel()
+            self._running.pop(job_id, None)
+            if status == "requeued" and await self.backend.requeue(job_id):
+                logger.info(f"Distributed job {job_id} requeued, instance stopping")
+            if status in ("requeued", "lost"):
+                # 任务已回到等待集合，提交方继续等待其他实例执行
+                await self.backend.publish(channel, json.dumps({"requeued": True}))
+            else:
+                await self.backend.finish(job_id)
+                await self.backend.publish(channel, json.dumps({"end": True, "status": status}))
+            logger.info(f"Distributed job {job_id} finished on this instance with status {status}")
+
+    # ---- 状态 ----
+
+    async def get_job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取集群任务状态，等待中的任务附带队列位置和预计等待时间
+
+        Returns:
+            状态字典，任务不存在或已结束时返回None
+        """
+        local = self._running.get(job_id)
+        if local is not None:
+            return local.to_dict()
+        state = await self.backend.job_state(job_id)
+        if state is None:
+            return None
+        data, status, position = state
+        job = json.loads(data)
+        result = {
+            "task_id": job_id,
+            "id": job_id,
+            "user_id": job["user_id"],
+            "lane": job.get("lane", LANE_INTERACTIVE),
+            "cost": job["cost"],
+            "type": job["type"],
+            "status": status,
+            "created_at": job["submitted_at"]
+        }
+        if position is not None:
+            pending, running = await self.backend.counts()
+            result["position"] = position
+            result["pending_tasks"] = pending
+            result["estimated_wait"] = self._estimate(running, position - 1)
+        return result
+
+    def _estimate(self, running: int, queued: int) -> float:
+        """其他实例上运行任务的进度不可见，按平均还剩半个执行耗时计算"""
+        estimator = self.wait_estimator
+        in_progress = [(estimator.service_time / 2, 0.0)] * running
+        return round(estimator.estimate(in_progress, queued, self.max_running), 1)
+
+    async def estimate_wait(self) -> float:
+        """估算新任务在集群队列中的等待秒数"""
+        pending, running = await self.backend.counts()
+        if not pending and running < self.max_running:
+            return 0.0
+        return self._estimate(running, pending)
+
+    async def get_status(self) -> Dict[str, Any]:
+        """获取集群队列状态和本实例正在执行的任务"""
+        pending, running = await self.backend.counts()
+        return {
+            "instance_id": settings.INSTANCE_ID,
+            "estimated_wait": await self.estimate_wait(),
+            "cluster_pending": pending,
+            "cluster_running": running,
+            "cluster_max_concurrent": self.max_running,
+            "local_running": len(self._running),
+            "local_slots": self.workers,
+            "tasks": [job.to_dict() for job in self._running.values()]
+        }
+
+# 全局分布式队列实例
+_distributed_queue: Optional[DistributedQueue] = None
+
+def get_distributed_queue() -> DistributedQueue:
+    """获取全局分布式队列实例，没有配置 REDIS_URL 时使用进程内后端"""
+    global _distributed_queue
+    if _distributed_queue is None:
+        if settings.REDIS_URL:
+            backend: QueueBackend = RedisBackend(settings.REDIS_URL, settings.QUEUE_KEY_PREFIX)
+        else:
+            logger.warning("REDIS_URL is not set, distributed queue uses the in-process backend")
+            backend = InMemoryBackend()
+        _distributed_queue = DistributedQueue(
+            backend,
+            max_running=settings.QUEUE_CLUSTER_MAX_CONCURRENT,
+            workers=settings.QUEUE_MAX_CONCURRENT_TASKS
+        )
+    return _distributed_queue
@@ -0,0 +1,192 @@
+"""
+分子系统的有界线程池
+同步阻塞调用（Git API、git子进程、代码解析、AI相关的磁盘I/O）不能在事件循环线程上执行；
+每个子系统使用独立的线程池和有界等待队列，某个子系统变慢（如GitLab故障）只会占满自己的线程，
+不会影响AI生成所需的线程
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, TypeVar
+
+from app.config import settings
+from app.services.latency_histogram import LatencyHistogram
+from app.utils.logger import logger
+
+T = TypeVar("T")
+
+EXECUTOR_AI = "ai"
+EXECUTOR_GIT_API = "git_api"
+EXECUTOR_GIT_SUBPROCESS = "git_subprocess"
+EXECUTOR_PARSE = "parse"
+
+
+class ExecutorSaturatedError(Exception):
+    """线程池的执行和等待名额都已占满"""
+
+    def __init__(self, name: str):
+        super().__init__(f"Executor '{name}' is saturated")
+        self.name = name
+
+
+class BoundedExecutor:
+    """
+    有界线程池：最多 max_workers 个调用同时执行，另有 max_queue 个调用等待，超出时立即拒绝
+
+    Args:
+        name: 子系统名称
+        max_workers: 线程数
+        max_queue: 等待队列长度
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._active = 0
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self.peak_in_flight = 0
+        self.wait_histogram = LatencyHistogram()
+        self.run_histogram = LatencyHistogram()
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        在线程池中执行同步调用
+
+        调用方被取消时线程中的调用仍会执行完毕，名额在调用真正结束后才释放。
+
+        Args:
+            func: 同步函数
+            *args: 位置参数
+            **kwargs: 关键字参数
+
+        Returns:
+            函数返回值
+
+        Raises:
+            ExecutorSaturatedError: 如果执行和等待名额都已占满
+        """
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self.stats["rejected"] += 1
+                raise ExecutorSaturatedError(self.name)
+            self._in_flight += 1
+            self.stats["submitted"] += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+
+        # 与 asyncio.to_thread 一样把上下文变量带到工作线程
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        submitted_at = time.monotonic()
+
+        def _run() -> T:
+            started_at = time.monotonic()
+            with self._lock:
+                self._active += 1
+                self.wait_histogram.record(started_at - submitted_at)
+            ok = False
+            try:
+                result = call()
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._in_flight -= 1
+                    self.stats["completed" if ok else "failed"] += 1
+                    self.run_histogram.record(time.monotonic() - started_at)
+
+        try:
+            future = self._executor.submit(_run)
+        except RuntimeError:
+            # 线程池已关闭
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        """关闭线程池，不等待执行中的调用"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取线程池状态；saturation 为已占用名额占执行和等待名额总数的比例"""
+        with self._lock:
+            in_flight = self._in_flight
+            active = self._active
+            stats = dict(self.stats)
+            wait = self.wait_histogram.snapshot()
+            run = self.run_histogram.snapshot()
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "active": active,
+            "queued": max(0, in_flight - active),
+            "peak_in_flight": self.peak_in_flight,
+            "utilization": round(active / self.max_workers, 3),
+            "saturation": round(in_flight / (self.max_workers + self.max_queue), 3),
+            **stats,
+            "wait": wait,
+            "run": run
+        }
+
+
+# 全局线程池（按子系统名称）
+_executors: Dict[str, BoundedExecutor] = {}
+_executors_lock = threading.Lock()
+
+def get_executor(name: str) -> BoundedExecutor:
+    """
+    获取子系统的线程池，配置见 EXECUTOR_POOLS
+
+    Raises:
+        ValueError: 如果子系统未配置
+    """
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                config = settings.EXECUTOR_POOLS.get(name)
+                if config is None:
+                    raise ValueError(f"Unknown executor: {name}")
+                executor = BoundedExecutor(name, int(config["workers"]), int(config["queue"]))
+                _executors[name] = executor
+                logger.info(f"Created executor '{name}' ({executor.max_workers} workers, queue {executor.max_queue})")
+    return executor
+
+async def run_blocking(name: str, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    在子系统的有界线程池中执行同步阻塞调用
+
+    Args:
+        name: 子系统名称（EXECUTOR_AI / EXECUTOR_GIT_API / EXECUTOR_GIT_SUBPROCESS / EXECUTOR_PARSE）
+        func: 同步函数
+        *args: 位置参数
+        **kwargs: 关键字参数
+
+    Returns:
+        函数返回值
+
+    Raises:
+        ExecutorSaturatedError: 如果线程池已满
+    """
+    return await get_executor(name).run(func, *args, **kwargs)
+
+def get_executors_status() -> Dict[str, Any]:
+    """获取所有已配置线程池的状态"""
+    return {name: get_executor(name).get_status() for name in settings.EXECUTOR_POOLS}
+
+def shutdown_executors() -> None:
+    """关闭所有线程池"""
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown()
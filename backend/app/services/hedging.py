@@ -0,0 +1,215 @@
+"""
+对冲请求
+主调用在按模型学习到的延迟分位数内没有返回时，向同一模型或备用模型再发一次调用，
+先返回且通过校验的结果胜出，其余调用被取消
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Dict, Any, Optional, Callable, Awaitable, Deque
+
+from app.config import settings
+from app.services.ai_metrics import get_ai_metrics
+from app.utils.logger import logger
+
+
+class LatencyTracker:
+    """按模型记录最近的成功调用耗时"""
+
+    def __init__(self, window: int = 200):
+        self._window = window
+        self._latencies: Dict[str, Deque[float]] = {}
+
+    def record(self, model: str, seconds: float) -> None:
+        """记录一次成功调用的耗时"""
+        self._latencies.setdefault(model, deque(maxlen=self._window)).append(seconds)
+
+    def samples(self, model: str) -> int:
+        """获取样本数"""
+        return len(self._latencies.get(model, ()))
+
+    def percentile(self, model: str, percentile: float) -> Optional[float]:
+        """
+        获取耗时分位数
+
+        Args:
+            model: 模型名称
+            percentile: 分位数（0-100）
+
+        Returns:
+            耗时秒数，没有样本时返回None
+        """
+        latencies = self._latencies.get(model)
+        if not latencies:
+            return None
+        ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100.0))
+        return ordered[index]
+
+
+class HedgePolicy:
+    """
+    模型的对冲策略，来自模型配置的 hedge 字段：
+
+        "hedge": {
+            "enabled": true,
+            "percentile": 95,            # 超过该延迟分位数仍未返回时发出对冲调用
+            "backup_model": "chatgpt4.1mini",  # 对冲调用的模型，缺省为同一模型
+            "budget": 0.1,               # 对冲调用占主调用的最大比例
+            "min_samples": 20,           # 样本不足时使用 initial_delay
+            "initial_delay": null        # 样本不足时的对冲延迟（秒），为空则不对冲
+        }
+    """
+
+    def __init__(self, model_name: str, config: Dict[str, Any]):
+        self.model_name = model_name
+        self.enabled = bool(config.get("enabled", True))
+        self.percentile = float(config.get("percentile", settings.AI_HEDGE_DEFAULT_PERCENTILE))
+        self.backup_model = config.get("backup_model") or model_name
+        self.budget = float(config.get("budget", settings.AI_HEDGE_DEFAULT_BUDGET))
+        self.min_samples = int(config.get("min_samples", settings.AI_HEDGE_MIN_SAMPLES))
+        self.initial_delay = config.get("initial_delay")
+
+    @classmethod
+    def from_model_config(cls, model_name: str, model_config: Dict[str, Any]) -> Optional["HedgePolicy"]:
+        """从模型配置读取对冲策略，未配置或已禁用时返回None"""
+        if not settings.AI_HEDGE_ENABLED:
+            return None
+        hedge_config = model_config.get("hedge")
+        if not hedge_config:
+            return None
+        policy = cls(model_name, hedge_config if isinstance(hedge_config, dict) else {})
+        return policy if policy.enabled else None
+
+
+class Hedger:
+    """对冲调用执行器，负责延迟统计、预算控制和胜负统计"""
+
+    def __init__(self, budget_window: int = 200):
+        self.latency = LatencyTracker()
+        self._budget_window = budget_window
+        # 模型 -> 最近主调用是否发出过对冲
+        self._recent: Dict[str, Deque[bool]] = {}
+
+    def hedge_delay(self, policy: HedgePolicy) -> Optional[float]:
+        """获取对冲延迟，样本不足且没有 initial_delay 时返回None"""
+        if self.latency.samples(policy.model_name) >= policy.min_samples:
+            return self.latency.percentile(policy.model_name, policy.percentile)
+        if policy.initial_delay is not None:
+            return float(policy.initial_delay)
+        return None
+
+    def _within_budget(self, policy: HedgePolicy) -> bool:
+        recent = self._recent.get(policy.model_name)
+        if not recent:
+            return policy.budget > 0
+        return sum(recent) + 1 <= policy.budget * (len(recent) + 1)
+
+    def _record_primary(self, model_name: str, hedged: bool) -> None:
+        self._recent.setdefault(model_name, deque(maxlen=self._budget_window)).append(hedged)
+
+    async def _timed(self, model_name: str, call: Callable[[], Awaitable[str]]) -> str:
+        started = time.monotonic()
+        result = await call()
+        self.latency.record(model_name, time.monotonic() - started)
+        return result
+
+    async def run(self, model_name: str, primary: Callable[[], Awaitable[str]],
+                  backup_factory: Callable[[str], Callable[[], Awaitable[str]]],
+                  accept: Callable[[str], bool], policy: Optional[HedgePolicy]) -> str:
+        """
+        执行一次（可能对冲的）调用
+
+        Args:
+            model_name: 主调用的模型名称
+            primary: 主调用
+            backup_factory: 根据模型名称创建对冲调用
+            accept: 结果是否通过校验
+            policy: 对冲策略，为None时只执行主调用
+
+        Returns:
+            胜出的结果；所有调用都没有通过校验时返回第一个成功的结果
+
+        Raises:
+            Exception: 所有调用都失败时抛出主调用的异常
+        """
+        if policy is None:
+            return await self._timed(model_name, primary)
+
+        metrics = get_ai_metrics()
+        delay = self.hedge_delay(policy)
+        primary_task = asyncio.create_task(self._timed(model_name, primary))
+        tasks = {primary_task: model_name}
+
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait({primary_task}, timeout=delay)
+                if not done:
+                    if self._within_budget(policy):
+                        logger.info(f"Hedging {model_name} with {policy.backup_model} after {delay:.2f}s")
+                        hedge_task = asyncio.create_task(
+                            self._timed(policy.backup_model, backup_factory(policy.backup_model))
+                        )
+                        tasks[hedge_task] = policy.backup_model
+                        metrics.increment(model_name, "hedges_sent")
+                    else:
+                        metrics.increment(model_name, "hedge_budget_exhausted")
+            self._record_primary(model_name, len(tasks) > 1)
+
+            fallback_result = None
+            primary_error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        if task is primary_task:
+                            primary_error = task.exception()
+                        logger.warning(f"Call to {tasks[task]} failed: {task.exception()}")
+                        continue
+                    result = task.result()
+                    if accept(result):
+                        if len(tasks) > 1:
+                            metrics.increment(model_name, "primary_wins" if task is primary_task else "hedge_wins")
+                        return result
+                    if fallback_result is None:
+                        fallback_result = result
+
+            # 主调用要么失败，要么成功但未通过校验（此时 fallback_result 已设置）
+            if fallback_result is not None:
+                return fallback_result
+            raise primary_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取对冲统计"""
+        metrics = get_ai_metrics()
+        status = {}
+        for model_name, recent in self._recent.items():
+            hedges = metrics.get_counter(model_name, "hedges_sent")
+            hedge_wins = metrics.get_counter(model_name, "hedge_wins")
+            status[model_name] = {
+                "recent_calls": len(recent),
+                "recent_hedge_rate": round(sum(recent) / len(recent), 3) if recent else 0,
+                "hedges_sent": hedges,
+                "hedge_wins": hedge_wins,
+                "primary_wins": metrics.get_counter(model_name, "primary_wins"),
+                "hedge_win_rate": round(hedge_wins / hedges, 3) if hedges else 0,
+                "p50_seconds": self.latency.percentile(model_name, 50),
+                "p95_seconds": self.latency.percentile(model_name, 95)
+            }
+        return status
+
+# 全局对冲执行器
+_hedger: Optional[Hedger] = None
+
+def get_hedger() -> Hedger:
+    """获取全局对冲执行器"""
+    global _hedger
+    if _hedger is None:
+        _hedger = Hedger()
+    return _hedger
@@ -0,0 +1,125 @@
+"""
+AI提供商HTTP连接池
+按提供商base URL共享长连接（keep-alive，支持HTTP/2）的异步客户端
+"""
+
+import asyncio
+import importlib.util
+from typing import Dict, Any, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.config import settings
+from app.utils.logger import logger
+
+# 未安装h2时httpx无法启用HTTP/2，此时退回HTTP/1.1长连接
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _pool_key(url: str) -> str:
+    """
+    计算连接池键（scheme://host:port）
+
+    Args:
+        url: 请求地址或API base
+
+    Returns:
+        连接池键
+    """
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+class HTTPClientPool:
+    """按base URL复用的异步HTTP客户端池"""
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._lock = asyncio.Lock()
+
+    def _create_client(self) -> httpx.AsyncClient:
+        """创建一个新的共享客户端"""
+        limits = httpx.Limits(
+            max_connections=settings.AI_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.AI_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.AI_HTTP_KEEPALIVE_EXPIRY
+        )
+        return httpx.AsyncClient(
+            http2=settings.AI_HTTP2_ENABLED and _HTTP2_AVAILABLE,
+            limits=limits,
+            timeout=httpx.Timeout(settings.AI_HTTP_DEFAULT_TIMEOUT, connect=settings.AI_HTTP_CONNECT_TIMEOUT)
+        )
+
+    async def get_client(self, url: str) -> httpx.AsyncClient:
+        """
+        获取指定地址对应的共享客户端
+
+        Args:
+            url: 请求地址或API base
+
+        Returns:
+            共享的异步客户端
+        """
+        key = _pool_key(url)
+        client = self._clients.get(key)
+        if client is not None and not client.is_closed:
+            return client
+
+        async with self._lock:
+            client = self._clients.get(key)
+            if client is None or client.is_closed:
+                client = self._create_client()
+                self._clients[key] = client
+                logger.info(f"Created pooled HTTP client for {key}")
+            return client
+
+    async def warmup(self, base_urls) -> None:
+        """
+        预热连接池，提前完成TCP/TLS握手
+
+        Args:
+            base_urls: 需要预热的API base列表
+        """
+        keys = {_pool_key(url) for url in base_urls if url}
+
+        async def _warm(key: str):
+            client = await self.get_client(key)
+            try:
+                # 任何响应（包括404）都说明连接已建立并进入keep-alive池
+                await client.head(key, timeout=settings.AI_HTTP_WARMUP_TIMEOUT)
+                logger.info(f"Warmed up HTTP connection to {key}")
+            except Exception as e:
+                logger.warning(f"Failed to warm up HTTP connection to {key}: {e}")
+
+        await asyncio.gather(*(_warm(key) for key in keys))
+
+    async def close(self) -> None:
+        """关闭所有客户端"""
+        async with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing HTTP client: {e}")
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取连接池状态"""
+        return {
+            "http2_available": _HTTP2_AVAILABLE,
+            "http2_enabled": settings.AI_HTTP2_ENABLED and _HTTP2_AVAILABLE,
+            "max_connections": settings.AI_HTTP_MAX_CONNECTIONS,
+            "clients": sorted(key for key, client in self._clients.items() if not client.is_closed)
+        }
+
+# 全局连接池实例
+_http_client_pool: Optional[HTTPClientPool] = None
+
+def get_http_client_pool() -> HTTPClientPool:
+    """获取全局连接池实例"""
+    global _http_client_pool
+    if _http_client_pool is None:
+        _http_client_pool = HTTPClientPool()
+    return _http_client_pool
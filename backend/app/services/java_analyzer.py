@@ -6,6 +6,10 @@ import re
 import logging
 from typing import Dict, List, Optional
 
+import javalang
+
+from app.services.parsers.java_source import get_java_source
+
 logger = logging.getLogger(__name__)
 
 class JavaCodeAnalyzer:
@@ -57,13 +61,17 @@ class JavaCodeAnalyzer:
         }
         
         try:
-            # 基础信息提取
-            analysis['package'] = self._extract_package(code)
-            analysis['class_name'] = self._extract_class_name(code)
-            analysis['imports'] = self._extract_imports(code)
+            # 基础信息提取：优先使用与 JavaParser 共用的javalang解析结果，解析失败时使用正则
+            source = get_java_source(code)
+            if source.parsed:
+                self._extract_from_tree(source.tree, analysis)
+            else:
+                analysis['package'] = self._extract_package(code)
+                analysis['class_name'] = self._extract_class_name(code)
+                analysis['imports'] = self._extract_imports(code)
+                analysis['methods'] = self._extract_methods(code)
+                analysis['static_methods'] = self._extract_static_methods(code)
             analysis['annotations'] = self._extract_annotations(code)
-            analysis['methods'] = self._extract_methods(code)
-            analysis['static_methods'] = self._extract_static_methods(code)
             
             # Spring Boot特征检测
             analysis['is_spring_boot_app'] = self._is_spring_boot_application(code)
@@ -86,6 +94,27 @@ class JavaCodeAnalyzer:
             
         return analysis
     
+    def _extract_from_tree(self, tree, analysis: Dict) -> None:
+        """从javalang编译单元提取包名、类名、导入和方法信息"""
+        analysis['package'] = tree.package.name if tree.package else None
+        analysis['imports'] = [imp.path + ('.*' if imp.wildcard else '') for imp in tree.imports]
+
+        public_types = [t for t in tree.types if 'public' in t.modifiers]
+        main_type = (public_types or tree.types or [None])[0]
+        analysis['class_name'] = main_type.name if main_type is not None else None
+
+        methods = []
+        for _, method in tree.filter(javalang.tree.MethodDeclaration):
+            visibility = next((m for m in ('public', 'private', 'protected') if m in method.modifiers), 'package')
+            methods.append({
+                'name': method.name,
+                'visibility': visibility,
+                'is_static': 'static' in method.modifiers,
+                'return_type': method.return_type.name if method.return_type else 'void'
+            })
+        analysis['methods'] = methods
+        analysis['static_methods'] = [method['name'] for method in methods if method['is_static']]
+
     def _extract_package(self, code: str) -> Optional[str]:
         """提取包名"""
         match = re.search(r'package\s+([\w.]+)\s*;', code)
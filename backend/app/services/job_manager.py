@@ -0,0 +1,343 @@
+"""
+异步任务管理
+提交后立即返回任务ID，任务在调度器名额内后台执行，每个片段完成时写入检查点；
+实例重启或任务租约过期后，由任意实例接管并只生成剩余的片段。
+分布式模式下任务进入集群队列（类型 durable_job），由领取到的实例在集群名额内执行
+"""
+
+import asyncio
+import json
+import uuid
+from typing import Dict, Any, Optional, AsyncIterator, List, Set
+
+from app.config import settings
+from app.models.schemas import GenerateTestRequest, TestResult
+from app.services.job_store import (
+    JobStore, get_job_store, JOB_RUNNING, JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED,
+    JOB_TERMINAL_STATUSES
+)
+from app.services.distributed_queue import DistributedJob, get_distributed_queue
+from app.services.simple_queue import execute_with_queue
+from app.services.task_scheduler import TaskCancelledError, estimate_task_cost
+from app.services.test_generator import parse_code_async, generate_tests_concurrently, resolve_concurrency
+from app.utils.logger import logger
+
+
+def _result_to_dict(result: TestResult, index: int) -> Dict[str, Any]:
+    """把测试结果转换为可持久化的字典，index为片段在整个任务中的序号"""
+    return {
+        "index": index,
+        "name": result.name,
+        "type": result.type,
+        "test_code": result.test_code,
+        "file_name": result.file_name,
+        "success": result.file_name is not None,
+        "original_snippet": {
+            "name": result.original_snippet.name,
+            "type": result.original_snippet.type,
+            "code": result.original_snippet.code,
+            "language": result.original_snippet.language,
+            "class_name": result.original_snippet.class_name
+        }
+    }
+
+
+class JobManager:
+    """
+    异步任务管理器
+
+    Args:
+        store: 任务存储
+    """
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        # 租约持有者ID：同一实例的多个worker进程共享 INSTANCE_ID，加上进程内随机后缀区分
+        self.owner_id = f"{settings.INSTANCE_ID}:{uuid.uuid4().hex[:8]}"
+        self._running: Dict[str, asyncio.Task] = {}
+        # 任务ID -> 正在订阅的事件流的唤醒事件，本实例执行的任务更新时唤醒，其他实例执行的任务靠轮询
+        self._changed: Dict[str, Set[asyncio.Event]] = {}
+        self._resume_task: Optional[asyncio.Task] = None
+
+    # ---- 提交与查询 ----
+
+    async def submit(self, request: GenerateTestRequest, user_id: str) -> str:
+        """
+        创建任务并在本实例后台执行
+
+        Args:
+            request: 生成测试请求
+            user_id: 用户ID
+
+        Returns:
+            任务ID
+        """
+        job_id = str(uuid.uuid4())
+        await asyncio.to_thread(self.store.create_job, job_id, user_id, request.model_dump())
+        logger.info(f"Created job {job_id} for user {user_id}")
+        if settings.QUEUE_MODE == "distributed":
+            await self._enqueue(job_id, user_id, request)
+        else:
+            await self._start(job_id)
+        return job_id
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态（不含请求参数）"""
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None:
+            return None
+        job.pop("request", None)
+        return job
+
+    async def get_results(self, job_id: str) -> List[Dict[str, Any]]:
+        """获取已完成片段的结果，按片段序号排序"""
+        results = await asyncio.to_thread(self.store.get_results, job_id)
+        return [results[index] for index in sorted(results)]
+
+    async def cancel(self, job_id: str) -> bool:
+        """
+        取消任务，本实例正在执行时立即中止生成
+
+        Returns:
+            任务存在且未结束时返回True
+        """
+        if not await asyncio.to_thread(self.store.update_job, job_id, active_only=True, status=JOB_CANCELLED):
+            return False
+        runner = self._running.get(job_id)
+        if runner is not None and not runner.done():
+            runner.cancel()
+        if settings.QUEUE_MODE == "distributed":
+            # 集群中等待的任务直接出队，其他实例执行中的任务在续期租约时停止
+            await get_distributed_queue().cancel(job_id)
+        self._notify(job_id)
+        return True
+
+    async def events(self, job_id: str) -> AsyncIterator[str]:
+        """
+        任务事件流（NDJSON）：先输出当前状态和已完成的结果，之后输出新完成的片段和进度，任务结束后结束
+
+        Args:
+            job_id: 任务ID
+
+        Yields:
+            NDJSON行
+        """
+        sent = set()
+        event = asyncio.Event()
+        self._changed.setdefault(job_id, set()).add(event)
+        try:
+            while True:
+                event.clear()
+                job = await asyncio.to_thread(self.store.get_job, job_id)
+                if job is None:
+                    yield json.dumps({"error": "Job not found", "status": "error"}) + "\n"
+                    return
+
+                results = await asyncio.to_thread(self.store.get_results, job_id)
+                for index in sorted(results):
+                    if index not in sent:
+                        sent.add(index)
+                        yield json.dumps({**results[index], "job_id": job_id,
+                                          "completed": len(sent), "total": job["total"]}) + "\n"
+
+                yield json.dumps({
+                    "status": "job_" + job["status"],
+                    "job_id": job_id,
+                    "progress": job["progress"],
+                    "completed": job["completed"],
+                    "total": job["total"],
+                    "error": job.get("error")
+                }) + "\n"
+                if job["status"] in JOB_TERMINAL_STATUSES:
+                    return
+
+                try:
+                    await asyncio.wait_for(event.wait(), settings.JOB_EVENT_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # 事件流结束（包括客户端断开）时注销，没有订阅者的任务不再占用条目
+            listeners = self._changed.get(job_id)
+            if listeners is not None:
+                listeners.discard(event)
+                if not listeners:
+                    del self._changed[job_id]
+
+    def _notify(self, job_id: str) -> None:
+        for event in self._changed.get(job_id, ()):
+            event.set()
+
+    # ---- 执行 ----
+
+    async def _start(self, job_id: str) -> bool:
+        """接管任务并在后台执行，任务已被其他实例持有时返回False"""
+        if job_id in self._running:
+            return False
+        claimed = await asyncio.to_thread(self.store.claim_job, job_id, self.owner_id, settings.JOB_LEASE_SECONDS)
+        if not claimed:
+            return False
+        runner = asyncio.create_task(self._run(job_id))
+        self._running[job_id] = runner
+        runner.add_done_callback(lambda _: self._running.pop(job_id, None))
+        return True
+
+    async def _keep_lease(self, job_id: str, runner: asyncio.Task) -> None:
+        """定期续期租约；续期失败说明任务已被取消（可能是其他实例处理的取消请求），中止执行"""
+        while True:
+            await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
+            renewed = await asyncio.to_thread(self.store.renew_job, job_id, self.owner_id, settings.JOB_LEASE_SECONDS)
+            if not renewed:
+                logger.info(f"Lost lease on job {job_id}, stopping")
+                runner.cancel()
+                return
+
+    async def _run(self, job_id: str, queued: bool = True) -> None:
+        """
+        执行已接管的任务
+
+        Args:
+            job_id: 任务ID
+            queued: 是否在本实例调度器的名额内执行（分布式队列的执行实例已持有集群名额时为False）
+        """
+        keeper = asyncio.create_task(self._keep_lease(job_id, asyncio.current_task()))
+        try:
+            job = await asyncio.to_thread(self.store.get_job, job_id)
+            request = GenerateTestRequest(**job["request"])
+            if queued:
+                await execute_with_queue(
+                    lambda: self._generate(job_id, request),
+                    user_id=job["user_id"], lane=request.lane, cost=estimate_task_cost(request.code)
+                )
+            else:
+                await self._generate(job_id, request)
+        except (asyncio.CancelledError, TaskCancelledError):
+            # 通过取消接口取消时状态已写入；实例关闭时保持未结束状态，由其他实例接管
+            logger.info(f"Job {job_id} stopped on this instance")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+            await asyncio.to_thread(self.store.update_job, job_id, active_only=True, status=JOB_FAILED, error=str(e))
+        finally:
+            keeper.cancel()
+            self._notify(job_id)
+
+    async def _generate(self, job_id: str, request: GenerateTestRequest) -> None:
+        """生成尚未有检查点的片段，每个片段完成时写入结果"""
+        file_path = request.git_path if request.git_repo and request.git_path else None
+        snippets = await parse_code_async(request.code, request.language, file_path)
+        # 只有生成成功的片段算作检查点，失败的片段在接管后重新生成
+        done = {index for index, result in (await asyncio.to_thread(self.store.get_results, job_id)).items()
+                if result.get("success")}
+        remaining = [index for index in range(len(snippets)) if index not in done]
+        total = len(snippets)
+        completed = total - len(remaining)
+        if done:
+            logger.info(f"Resuming job {job_id}: {completed}/{total} snippets already checkpointed")
+
+        if not await asyncio.to_thread(self.store.update_job, job_id, active_only=True, status=JOB_RUNNING, total=total,
+                                       completed=completed, progress=int(completed * 100 / total) if total else 100):
+            logger.info(f"Job {job_id} is no longer active, not generating")
+            return
+        self._notify(job_id)
+
+        if remaining:
+            concurrency = resolve_concurrency(request.model, request.max_concurrency)
+            async for result in generate_tests_concurrently([snippets[i] for i in remaining], request.model, concurrency,
+                                                            use_cache=not request.bypass_cache,
+                                                            pack_mode=request.pack_mode):
+                index = remaining[result.index]
+                completed += 1
+                await asyncio.to_thread(self.store.save_result, job_id, index, _result_to_dict(result, index))
+                await asyncio.to_thread(self.store.update_job, job_id, active_only=True, completed=completed,
+                                        progress=int(completed * 100 / total))
+                self._notify(job_id)
+
+        # 生成期间任务可能已被取消（包括其他实例处理的取消请求），只有仍未结束时才标记完成
+        if await asyncio.to_thread(self.store.update_job, job_id, active_only=True, status=JOB_COMPLETED, progress=100):
+            logger.info(f"Job {job_id} completed ({total} snippets)")
+        else:
+            logger.info(f"Job {job_id} finished generating but was no longer active, status left unchanged")
+
+    # ---- 分布式队列 ----
+
+    async def _enqueue(self, job_id: str, user_id: str, request: GenerateTestRequest) -> None:
+        """把任务放入集群队列（任务ID即集群任务ID，已在队列中时不会重复排队）"""
+        await get_distributed_queue().submit("durable_job", {"job_id": job_id}, user_id=user_id, lane=request.lane,
+                                             cost=estimate_task_cost(request.code), job_id=job_id)
+
+    async def run_cluster_job(self, job: DistributedJob) -> AsyncIterator[str]:
+        """
+        分布式队列中异步任务的处理函数：执行实例已持有集群名额，接管任务后直接生成
+
+        实例关闭时停止生成并向上传递取消，集群队列把任务重新排队，由其他实例从检查点继续
+
+        Args:
+            job: 分布式任务，payload 中为任务ID
+
+        Yields:
+            一行任务结束状态（JSON）
+        """
+        job_id = job.payload["job_id"]
+        if job_id in self._running:
+            return
+        claimed = await asyncio.to_thread(self.store.claim_job, job_id, self.owner_id, settings.JOB_LEASE_SECONDS)
+        if not claimed:
+            logger.info(f"Job {job_id} is already held by another instance or finished, skipping")
+            return
+
+        runner = asyncio.create_task(self._run(job_id, queued=False))
+        self._running[job_id] = runner
+        runner.add_done_callback(lambda _: self._running.pop(job_id, None))
+        try:
+            # 不直接 await：执行实例被取消时需要先停止生成，再把取消传回集群队列
+            await asyncio.wait({runner})
+        except asyncio.CancelledError:
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+            # 释放租约，重新排队后领取到任务的实例可以立即接管
+            await asyncio.to_thread(self.store.release_job, job_id, self.owner_id)
+            raise
+        current = await asyncio.to_thread(self.store.get_job, job_id)
+        yield json.dumps({"job_id": job_id, "status": current["status"] if current else None}) + "\n"
+
+    # ---- 接管 ----
+
+    async def start(self) -> None:
+        """启动后台接管循环：定期接管租约已过期的未结束任务（包括本实例重启前的任务）"""
+        if self._resume_task is None:
+            self._resume_task = asyncio.create_task(self._resume_loop())
+
+    async def stop(self) -> None:
+        """停止接管循环和本实例执行中的任务（任务保持未结束状态，租约过期后由其他实例接管）"""
+        tasks = list(self._running.values())
+        if self._resume_task is not None:
+            tasks.append(self._resume_task)
+            self._resume_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _resume_loop(self) -> None:
+        while True:
+            try:
+                job_ids = await asyncio.to_thread(self.store.list_claimable, settings.JOB_RESUME_BATCH)
+                for job_id in job_ids:
+                    if settings.QUEUE_MODE == "distributed":
+                        # 租约已过期的任务重新放入集群队列，由领取到的实例接管
+                        job = await asyncio.to_thread(self.store.get_job, job_id)
+                        if job is not None:
+                            await self._enqueue(job_id, job["user_id"], GenerateTestRequest(**job["request"]))
+                    elif await self._start(job_id):
+                        logger.info(f"Took over job {job_id}")
+            except Exception as e:
+                logger.error(f"Job resume check failed: {e}")
+            await asyncio.sleep(settings.JOB_RESUME_INTERVAL)
+
+# 全局任务管理器实例
+_job_manager: Optional[JobManager] = None
+
+def get_job_manager() -> JobManager:
+    """获取全局任务管理器实例"""
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager(get_job_store())
+    return _job_manager
@@ -0,0 +1,386 @@
+"""
+异步任务持久化存储
+保存任务参数、状态和每个代码片段的生成结果（检查点），实例重启或任务被其他实例接管后
+只需生成剩余的片段。本地使用SQLite，生产环境使用Postgres（deployment/postgres/init.sql 中的 task_status 表）
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, List
+
+from app.config import settings
+from app.utils.logger import logger
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_TERMINAL_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+
+class JobStore:
+    """
+    任务存储接口（同步方法，由调用方放到线程中执行）
+
+    任务字典包含：job_id、user_id、instance_id、status、progress、total、completed、
+    request、error、created_at、updated_at、lease_until
+    """
+
+    def create_job(self, job_id: str, user_id: str, request: Dict[str, Any]) -> None:
+        """创建任务"""
+        raise NotImplementedError
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务，不存在时返回None"""
+        raise NotImplementedError
+
+    def update_job(self, job_id: str, active_only: bool = False, **fields: Any) -> bool:
+        """
+        更新任务字段（status、progress、total、completed、error）
+
+        Args:
+            job_id: 任务ID
+            active_only: 只在任务未结束（pending / running）时更新，避免覆盖已取消或已结束的状态
+            **fields: 要更新的字段
+
+        Returns:
+            是否更新了任务
+        """
+        raise NotImplementedError
+
+    def save_result(self, job_id: str, index: int, result: Dict[str, Any]) -> None:
+        """保存一个片段的生成结果（检查点）"""
+        raise NotImplementedError
+
+    def get_results(self, job_id: str) -> Dict[int, Dict[str, Any]]:
+        """读取已保存的片段结果，键为片段序号"""
+        raise NotImplementedError
+
+    def claim_job(self, job_id: str, instance_id: str, lease_seconds: float) -> bool:
+        """租约为空或已过期时接管未结束的任务，返回是否接管成功"""
+        raise NotImplementedError
+
+    def renew_job(self, job_id: str, instance_id: str, lease_seconds: float) -> bool:
+        """续期该持有者的租约，任务已结束、租约已释放或已被其他持有者接管时返回False"""
+        raise NotImplementedError
+
+    def release_job(self, job_id: str, instance_id: str) -> None:
+        """释放该持有者的租约（清空租约过期时间，保留 instance_id），任务可以立即被其他实例接管"""
+        raise NotImplementedError
+
+    def list_claimable(self, limit: int) -> List[str]:
+        """列出未结束且租约已过期的任务ID"""
+        raise NotImplementedError
+
+
+class SQLiteJobStore(JobStore):
+    """SQLite任务存储，WAL模式下可被多个worker进程共享"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    instance_id TEXT,
+                    status TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    request TEXT NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    lease_until REAL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_results (
+                    job_id TEXT NOT NULL,
+                    snippet_index INTEGER NOT NULL,
+                    result TEXT NOT NULL,
+                    PRIMARY KEY (job_id, snippet_index)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def create_job(self, job_id: str, user_id: str, request: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, user_id, status, request, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, JOB_PENDING, json.dumps(request), now, now)
+            )
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        return job
+
+    def update_job(self, job_id: str, active_only: bool = False, **fields: Any) -> bool:
+        if not fields:
+            return False
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        condition = "job_id = ?"
+        values = [*fields.values(), job_id]
+        if active_only:
+            condition += " AND status IN (?, ?)"
+            values += [JOB_PENDING, JOB_RUNNING]
+        with self._connect() as conn:
+            cursor = conn.execute(f"UPDATE jobs SET {assignments} WHERE {condition}", values)
+            return cursor.rowcount == 1
+
+    def save_result(self, job_id: str, index: int, result: Dict[str, Any]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO job_results (job_id, snippet_index, result) VALUES (?, ?, ?)",
+                (job_id, index, json.dumps(result))
+            )
+
+    def get_results(self, job_id: str) -> Dict[int, Dict[str, Any]]:
+        rows = self._connect().execute(
+            "SELECT snippet_index, result FROM job_results WHERE job_id = ?", (job_id,)
+        ).fetchall()
+        return {row["snippet_index"]: json.loads(row["result"]) for row in rows}
+
+    def claim_job(self, job_id: str, instance_id: str, lease_seconds: float) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """UPDATE jobs SET instance_id = ?, lease_until = ?, updated_at = ?
+                   WHERE job_id = ? AND status IN (?, ?) AND (lease_until IS NULL OR lease_until < ?)""",
+                (instance_id, now + lease_seconds, now, job_id, JOB_PENDING, JOB_RUNNING, now)
+            )
+            return cursor.rowcount == 1
+
+    def renew_job(self, job_id: str, instance_id: str, lease_seconds: float) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """UPDATE jobs SET lease_until = ?, updated_at = ?
+                   WHERE job_id = ? AND status IN (?, ?) AND instance_id = ? AND lease_until IS NOT NULL""",
+                (now + lease_seconds, now, job_id, JOB_PENDING, JOB_RUNNING, instance_id)
+            )
+            return cursor.rowcount == 1
+
+    def release_job(self, job_id: str, instance_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_until = NULL, updated_at = ? WHERE job_id = ? AND instance_id = ?",
+                (time.time(), job_id, instance_id)
+            )
+
+    def list_claimable(self, limit: int) -> List[str]:
+        rows = self._connect().execute(
+            """SELECT job_id FROM jobs WHERE status IN (?, ?) AND (lease_until IS NULL OR lease_until < ?)
+               ORDER BY created_at LIMIT ?""",
+            (JOB_PENDING, JOB_RUNNING, time.time(), limit)
+        ).fetchall()
+        return [row["job_id"] for row in rows]
+
+
+class PostgresJobStore(JobStore):
+    """
+    Postgres任务存储，使用 deployment/postgres/init.sql 中的 task_status 表
+
+    任务参数和片段结果保存在 result_data（JSONB）中：
+    {"request": {...}, "total": n, "completed": k, "results": {"<序号>": {...}}}，
+    每个片段完成时用 jsonb_set 原地写入，不重写整个结果。
+
+    Args:
+        dsn: 数据库连接地址
+    """
+
+    _JOB_COLUMNS = "task_id, user_id, instance_id, status, progress, error_message, result_data, " \
+                   "EXTRACT(EPOCH FROM created_at), EXTRACT(EPOCH FROM updated_at), EXTRACT(EPOCH FROM lease_until)"
+
+    def __init__(self, dsn: str):
+        try:
+            import psycopg2
+        except ImportError as e:
+            raise RuntimeError("Postgres任务存储需要安装 psycopg2-binary") from e
+        self._psycopg2 = psycopg2
+        self.dsn = dsn
+        self._local = threading.local()
+
+        with self._cursor() as cursor:
+            # init.sql 中的表没有租约列，旧库在这里补上
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS task_status (
+                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+                    task_id VARCHAR(255) UNIQUE NOT NULL,
+                    instance_id VARCHAR(100) NOT NULL,
+                    user_id VARCHAR(255) DEFAULT 'anonymous',
+                    status VARCHAR(50) NOT NULL DEFAULT 'pending',
+                    progress INTEGER DEFAULT 0,
+                    start_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    end_time TIMESTAMP WITH TIME ZONE,
+                    error_message TEXT,
+                    result_data JSONB,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("ALTER TABLE task_status ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP WITH TIME ZONE")
+
+    def _connection(self):
+        """获取当前线程的数据库连接（自动提交）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.closed:
+            conn = self._psycopg2.connect(self.dsn)
+            conn.autocommit = True
+            self._local.conn = conn
+        return conn
+
+    def _cursor(self):
+        return self._connection().cursor()
+
+    def create_job(self, job_id: str, user_id: str, request: Dict[str, Any]) -> None:
+        data = {"request": request, "total": None, "completed": 0, "results": {}}
+        with self._cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO task_status (task_id, instance_id, user_id, status, result_data) VALUES (%s, %s, %s, %s, %s)",
+                (job_id, settings.INSTANCE_ID, user_id, JOB_PENDING, json.dumps(data))
+            )
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._cursor() as cursor:
+            cursor.execute(f"SELECT {self._JOB_COLUMNS} FROM task_status WHERE task_id = %s", (job_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        data = row[6] or {}
+        return {
+            "job_id": row[0],
+            "user_id": row[1],
+            "instance_id": row[2],
+            "status": row[3],
+            "progress": row[4] or 0,
+            "error": row[5],
+            "request": data.get("request", {}),
+            "total": data.get("total"),
+            "completed": data.get("completed", 0),
+            "created_at": float(row[7]) if row[7] is not None else None,
+            "updated_at": float(row[8]) if row[8] is not None else None,
+            "lease_until": float(row[9]) if row[9] is not None else None
+        }
+
+    def update_job(self, job_id: str, active_only: bool = False, **fields: Any) -> bool:
+        if not fields:
+            return False
+        assignments = []
+        values: List[Any] = []
+        for name, value in fields.items():
+            if name in ("total", "completed"):
+                assignments.append(f"result_data = jsonb_set(result_data, '{{{name}}}', %s::jsonb, true)")
+                values.append(json.dumps(value))
+            elif name == "error":
+                assignments.append("error_message = %s")
+                values.append(value)
+            elif name in ("status", "progress"):
+                assignments.append(f"{name} = %s")
+                values.append(value)
+        if fields.get("status") in JOB_TERMINAL_STATUSES:
+            assignments.append("end_time = CURRENT_TIMESTAMP")
+        condition = "task_id = %s"
+        values.append(job_id)
+        if active_only:
+            condition += " AND status IN (%s, %s)"
+            values += [JOB_PENDING, JOB_RUNNING]
+        with self._cursor() as cursor:
+            cursor.execute(f"UPDATE task_status SET {', '.join(assignments)} WHERE {condition}", values)
+            return cursor.rowcount == 1
+
+    def save_result(self, job_id: str, index: int, result: Dict[str, Any]) -> None:
+        with self._cursor() as cursor:
+            cursor.execute(
+                "UPDATE task_status SET result_data = jsonb_set(result_data, ARRAY['results', %s], %s::jsonb, true) "
+                "WHERE task_id = %s",
+                (str(index), json.dumps(result), job_id)
+            )
+
+    def get_results(self, job_id: str) -> Dict[int, Dict[str, Any]]:
+        with self._cursor() as cursor:
+            cursor.execute("SELECT result_data -> 'results' FROM task_status WHERE task_id = %s", (job_id,))
+            row = cursor.fetchone()
+        if row is None or not row[0]:
+            return {}
+        return {int(index): result for index, result in row[0].items()}
+
+    def claim_job(self, job_id: str, instance_id: str, lease_seconds: float) -> bool:
+        with self._cursor() as cursor:
+            cursor.execute(
+                """UPDATE task_status
+                   SET instance_id = %s, lease_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                   WHERE task_id = %s AND status IN (%s, %s)
+                   AND (lease_until IS NULL OR lease_until < CURRENT_TIMESTAMP)""",
+                (instance_id, lease_seconds, job_id, JOB_PENDING, JOB_RUNNING)
+            )
+            return cursor.rowcount == 1
+
+    def renew_job(self, job_id: str, instance_id: str, lease_seconds: float) -> bool:
+        with self._cursor() as cursor:
+            cursor.execute(
+                """UPDATE task_status SET lease_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                   WHERE task_id = %s AND status IN (%s, %s) AND instance_id = %s AND lease_until IS NOT NULL""",
+                (lease_seconds, job_id, JOB_PENDING, JOB_RUNNING, instance_id)
+            )
+            return cursor.rowcount == 1
+
+    def release_job(self, job_id: str, instance_id: str) -> None:
+        with self._cursor() as cursor:
+            cursor.execute(
+                "UPDATE task_status SET lease_until = NULL WHERE task_id = %s AND instance_id = %s",
+                (job_id, instance_id)
+            )
+
+    def list_claimable(self, limit: int) -> List[str]:
+        with self._cursor() as cursor:
+            cursor.execute(
+                """SELECT task_id FROM task_status
+                   WHERE status IN (%s, %s) AND result_data ? 'request'
+                   AND (lease_until IS NULL OR lease_until < CURRENT_TIMESTAMP)
+                   ORDER BY created_at LIMIT %s""",
+                (JOB_PENDING, JOB_RUNNING, limit)
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+# 全局任务存储实例
+_job_store: Optional[JobStore] = None
+
+def get_job_store() -> JobStore:
+    """获取全局任务存储实例：配置了Postgres地址时使用Postgres，否则使用本地SQLite"""
+    global _job_store
+    if _job_store is None:
+        if settings.JOB_DATABASE_URL.startswith(("postgresql://", "postgres://")):
+            _job_store = PostgresJobStore(settings.JOB_DATABASE_URL)
+            logger.info("Job store: Postgres")
+        else:
+            _job_store = SQLiteJobStore(settings.JOB_DB_PATH)
+            logger.info(f"Job store: SQLite ({settings.JOB_DB_PATH})")
+    return _job_store
@@ -0,0 +1,93 @@
+"""
+延迟直方图
+HDR风格的对数分桶直方图：每个桶覆盖固定的相对精度，内存占用只与数值范围的数量级有关，
+可以持续记录而不保存原始样本，并随时读取 p50/p95/p99 等分位数
+"""
+
+import math
+from typing import Dict, Any, Optional
+
+
+class LatencyHistogram:
+    """
+    对数分桶的延迟直方图
+
+    Args:
+        precision: 相对精度，默认1%（任何分位数的误差不超过该比例）
+        resolution: 最小分辨率（秒），小于该值的样本归入第一个桶
+    """
+
+    def __init__(self, precision: float = 0.01, resolution: float = 0.001):
+        self._log_base = math.log1p(precision)
+        self._resolution = resolution
+        self._buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def _bucket(self, value: float) -> int:
+        if value <= self._resolution:
+            return 0
+        return int(math.log(value / self._resolution) / self._log_base) + 1
+
+    def _bucket_value(self, bucket: int) -> float:
+        """桶的代表值（桶上下界的几何中点）"""
+        if bucket == 0:
+            return self._resolution
+        return self._resolution * math.exp((bucket - 0.5) * self._log_base)
+
+    def record(self, value: float) -> None:
+        """
+        记录一个样本
+
+        Args:
+            value: 耗时（秒），负数按0处理
+        """
+        value = max(0.0, value)
+        bucket = self._bucket(value)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """
+        获取分位数
+
+        Args:
+            percentile: 分位数（0-100）
+
+        Returns:
+            耗时秒数，没有样本时返回None
+        """
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * percentile / 100.0))
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                # 代表值限制在实际观测范围内，避免小样本时超出最大值
+                return min(max(self._bucket_value(bucket), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取统计快照（秒，保留3位小数）"""
+        def _round(value: Optional[float]) -> Optional[float]:
+            return None if value is None else round(value, 3)
+
+        return {
+            "count": self.count,
+            "mean": _round(self.mean),
+            "min": _round(self.min),
+            "max": _round(self.max),
+            "p50": _round(self.percentile(50)),
+            "p95": _round(self.percentile(95)),
+            "p99": _round(self.percentile(99))
+        }
@@ -0,0 +1,222 @@
+"""
+事件循环延迟监控和阻塞调用检测
+心跳协程按固定间隔唤醒，实际唤醒时间与预期的差值即为事件循环延迟，记录到直方图；
+看门狗线程发现心跳超过阈值未更新时，抓取事件循环线程当前的调用栈，定位阻塞事件循环的回调。
+阻塞调用检测在事件循环线程上执行同步socket或子进程调用时告警或抛出异常（用于测试）
+"""
+
+import asyncio
+import functools
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Dict, Any, Optional, Deque, Callable, List, Tuple
+
+from app.config import settings
+from app.services.latency_histogram import LatencyHistogram
+from app.utils.logger import logger
+
+BLOCKING_CHECK_OFF = "off"
+BLOCKING_CHECK_WARN = "warn"
+BLOCKING_CHECK_RAISE = "raise"
+
+
+class BlockingCallError(RuntimeError):
+    """在事件循环线程上执行了同步阻塞调用"""
+    pass
+
+
+class LoopLagMonitor:
+    """
+    事件循环延迟监控
+
+    Args:
+        interval: 心跳间隔（秒）
+        stall_threshold: 判定为卡顿的延迟（秒）
+        history_size: 保留的卡顿记录数
+    """
+
+    def __init__(self, interval: float, stall_threshold: float, history_size: int):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.lag_histogram = LatencyHistogram()
+        self.stall_count = 0
+        self.blocking_calls = 0
+        self._stalls: Deque[Dict[str, Any]] = deque(maxlen=history_size)
+        self._blocking_history: Deque[Dict[str, Any]] = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._heartbeat = time.monotonic()
+        self._current_stall: Optional[Dict[str, Any]] = None
+        self._loop_thread_id: Optional[int] = None
+        self._beat_task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """在事件循环中启动心跳协程和看门狗线程"""
+        if self._beat_task is not None:
+            return
+        self.bind_loop_thread()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._beat_task = asyncio.create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Event loop monitor started (interval {self.interval}s, stall threshold {self.stall_threshold}s)")
+
+    async def stop(self) -> None:
+        """停止心跳协程和看门狗线程"""
+        self._stopped.set()
+        if self._beat_task is not None:
+            self._beat_task.cancel()
+            await asyncio.gather(self._beat_task, return_exceptions=True)
+            self._beat_task = None
+        self._watchdog = None
+
+    async def _beat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            with self._lock:
+                self.lag_histogram.record(lag)
+                self._heartbeat = now
+                stall, self._current_stall = self._current_stall, None
+            if stall is not None:
+                stall["duration"] = round(lag, 3)
+                logger.warning(f"Event loop stalled for {lag:.3f}s, blocked at:\n{stall['stack']}")
+
+    def _watch(self) -> None:
+        """看门狗线程：心跳超时时抓取事件循环线程的调用栈（每次卡顿只抓一次）"""
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                stalled_for = time.monotonic() - self._heartbeat - self.interval
+                if stalled_for < self.stall_threshold or self._current_stall is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+                self._current_stall = {
+                    "detected_at": time.time(),
+                    "duration": None,
+                    "stack": stack
+                }
+                self._stalls.append(self._current_stall)
+                self.stall_count += 1
+
+    def bind_loop_thread(self) -> None:
+        """把当前线程登记为事件循环线程（在事件循环中调用）"""
+        self._loop_thread_id = threading.get_ident()
+
+    def is_loop_thread(self) -> bool:
+        return self._loop_thread_id is not None and threading.get_ident() == self._loop_thread_id
+
+    def record_blocking_call(self, call: str) -> None:
+        """记录一次在事件循环线程上执行的阻塞调用"""
+        # 跳过检测本身的栈帧，从调用方开始
+        stack = "".join(traceback.format_stack(sys._getframe(3)))
+        with self._lock:
+            self.blocking_calls += 1
+            self._blocking_history.append({"call": call, "detected_at": time.time(), "stack": stack})
+        logger.warning(f"Blocking call {call} on the event loop thread:\n{stack}")
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取延迟分位数、卡顿次数和最近的卡顿调用栈"""
+        with self._lock:
+            return {
+                "running": self._beat_task is not None,
+                "interval": self.interval,
+                "stall_threshold": self.stall_threshold,
+                "lag": self.lag_histogram.snapshot(),
+                "stall_count": self.stall_count,
+                "stalls": list(self._stalls),
+                "blocking_calls": self.blocking_calls,
+                "recent_blocking_calls": list(self._blocking_history)
+            }
+
+
+# ---- 阻塞调用检测 ----
+
+# 被替换的调用：(所属对象, 名称, 原始调用, 是否为该对象自身的属性)
+_patched: List[Tuple[Any, str, Any, bool]] = []
+# 嵌套的受检调用（如 subprocess.run 内部的 communicate）只在最外层记录一次
+_guard_state = threading.local()
+
+def _check_blocking(call: str) -> None:
+    """当前线程是事件循环线程时按 LOOP_BLOCKING_CHECK 告警或抛出异常"""
+    monitor = get_loop_monitor()
+    if not monitor.is_loop_thread():
+        return
+    monitor.record_blocking_call(call)
+    if settings.LOOP_BLOCKING_CHECK == BLOCKING_CHECK_RAISE:
+        raise BlockingCallError(f"Blocking call {call} on the event loop thread")
+
+def _guarded(label: str, original: Callable, is_socket_method: bool = False) -> Callable:
+    @functools.wraps(original)
+    def guarded(*args, **kwargs):
+        if getattr(_guard_state, "active", False):
+            return original(*args, **kwargs)
+        # 事件循环自身使用非阻塞socket，不受限制
+        if not is_socket_method or args[0].gettimeout() != 0.0:
+            _check_blocking(label)
+        _guard_state.active = True
+        try:
+            return original(*args, **kwargs)
+        finally:
+            _guard_state.active = False
+
+    return guarded
+
+def _patch(owner: Any, name: str, label: str, is_socket_method: bool = False) -> None:
+    original = getattr(owner, name)
+    _patched.append((owner, name, original, name in vars(owner)))
+    setattr(owner, name, _guarded(label, original, is_socket_method))
+
+def install_blocking_detector() -> None:
+    """
+    在事件循环中按 LOOP_BLOCKING_CHECK 安装阻塞调用检测（warn 记录并告警，raise 抛出 BlockingCallError）
+
+    检测同步socket调用（connect、recv、send、DNS解析等）和等待子进程结束的调用（subprocess.run、communicate、wait等），
+    只在事件循环线程上生效，线程池中的调用不受影响
+    """
+    if settings.LOOP_BLOCKING_CHECK == BLOCKING_CHECK_OFF or _patched:
+        return
+    get_loop_monitor().bind_loop_thread()
+    for name in ("connect", "connect_ex", "recv", "recv_into", "recvfrom", "send", "sendall", "sendto", "accept"):
+        _patch(socket.socket, name, f"socket.{name}", is_socket_method=True)
+    for name in ("getaddrinfo", "gethostbyname", "create_connection"):
+        _patch(socket, name, f"socket.{name}")
+    for name in ("run", "call", "check_call", "check_output"):
+        _patch(subprocess, name, f"subprocess.{name}")
+    for name in ("communicate", "wait"):
+        _patch(subprocess.Popen, name, f"subprocess.Popen.{name}")
+    logger.info(f"Blocking call detector installed (mode: {settings.LOOP_BLOCKING_CHECK})")
+
+def uninstall_blocking_detector() -> None:
+    """恢复被替换的原始调用"""
+    while _patched:
+        owner, name, original, own_attribute = _patched.pop()
+        if own_attribute:
+            setattr(owner, name, original)
+        else:
+            # 原来是继承的方法（如 socket.socket 从 _socket.socket 继承的 recv），删除覆盖即可
+            delattr(owner, name)
+
+
+# 全局监控实例
+_loop_monitor: Optional[LoopLagMonitor] = None
+
+def get_loop_monitor() -> LoopLagMonitor:
+    """获取全局事件循环监控实例"""
+    global _loop_monitor
+    if _loop_monitor is None:
+        _loop_monitor = LoopLagMonitor(
+            interval=settings.LOOP_MONITOR_INTERVAL,
+            stall_threshold=settings.LOOP_STALL_THRESHOLD,
+            history_size=settings.LOOP_STALL_HISTORY
+        )
+    return _loop_monitor
@@ -0,0 +1,230 @@
+"""
+代码解析结果缓存
+按 (语言, 解析器版本, 内容哈希) 缓存解析出的代码片段，内存LRU按字节数淘汰。
+上传文件和获取Git文件内容时登记源代码并返回解析句柄，生成接口可以只提交句柄；
+同一份代码重新生成、切换模型或重试时都不再重复解析。
+配置了 REDIS_URL（多实例部署）时源代码同时登记到Redis，任意实例签发的句柄在其他实例上也能取回
+"""
+
+import hashlib
+import json
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.config import settings
+from app.models.schemas import CodeSnippet
+from app.services.parser_factory import ParserFactory
+
+
+class ParseHandleNotFoundError(ValueError):
+    """解析句柄不存在（已被淘汰或已过期），需要重新提交代码"""
+
+    def __init__(self, handle: str):
+        super().__init__(f"Parse handle not found or expired, please resubmit the code: {handle}")
+        self.handle = handle
+
+
+def make_parse_handle(language: str, code: str) -> str:
+    """按语言和内容哈希生成解析句柄"""
+    digest = hashlib.sha256(code.encode("utf-8", errors="surrogatepass")).hexdigest()
+    return f"{language}:{digest}"
+
+
+def _entry_size(code: str, snippets: Optional[List[CodeSnippet]]) -> int:
+    """估算条目占用的内存（字节）"""
+    size = sys.getsizeof(code)
+    for snippet in snippets or []:
+        size += sys.getsizeof(snippet.code) + sys.getsizeof(snippet.name) + 256
+    return size
+
+
+class _ParseEntry:
+    __slots__ = ("language", "code", "snippets", "parser_version", "size")
+
+    def __init__(self, language: str, code: str, snippets: Optional[List[CodeSnippet]], parser_version: Optional[str]):
+        self.language = language
+        self.code = code
+        self.snippets = snippets
+        self.parser_version = parser_version
+        self.size = _entry_size(code, snippets)
+
+
+class ParseCache:
+    """
+    解析结果缓存（内存LRU，按字节数限制）
+
+    条目以解析句柄（语言 + 内容哈希）为键，保存源代码和解析结果；解析结果记录解析器版本，
+    解析器升级后旧结果视为未命中
+
+    Args:
+        max_bytes: 缓存占用内存上限（字节）
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _ParseEntry]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get_source(self, handle: str) -> Tuple[str, str]:
+        """
+        按句柄获取源代码
+
+        Args:
+            handle: 解析句柄
+
+        Returns:
+            (语言, 源代码)
+
+        Raises:
+            ParseHandleNotFoundError: 如果句柄不存在
+        """
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                raise ParseHandleNotFoundError(handle)
+            self._entries.move_to_end(handle)
+            return entry.language, entry.code
+
+    def get_snippets(self, language: str, code: str) -> Optional[List[CodeSnippet]]:
+        """
+        获取代码的缓存解析结果
+
+        Args:
+            language: 编程语言
+            code: 源代码
+
+        Returns:
+            代码片段列表（file_path 为空），未命中时返回None
+        """
+        handle = make_parse_handle(language, code)
+        version = ParserFactory.get_parser(language).version
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None or entry.snippets is None or entry.parser_version != version:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(handle)
+            self.stats["hits"] += 1
+            return entry.snippets
+
+    def put(self, language: str, code: str, snippets: Optional[List[CodeSnippet]] = None) -> Optional[str]:
+        """
+        登记源代码（和解析结果），超出字节上限时淘汰最久未使用的条目
+
+        Args:
+            language: 编程语言
+            code: 源代码
+            snippets: 解析结果（file_path 为空），为None时只登记源代码
+
+        Returns:
+            解析句柄；条目超过缓存上限无法保存（且没有已登记的源代码）时返回None
+        """
+        handle = make_parse_handle(language, code)
+        version = ParserFactory.get_parser(language).version if snippets is not None else None
+        with self._lock:
+            existing = self._entries.get(handle)
+            if snippets is None and existing is not None:
+                # 只登记源代码时保留已有的解析结果
+                self._entries.move_to_end(handle)
+                return handle
+
+            entry = _ParseEntry(language, code, snippets, version)
+            if entry.size > self.max_bytes:
+                # 保存不了的条目不签发句柄，已登记的源代码仍然可以按句柄取回
+                return handle if existing is not None else None
+            if existing is not None:
+                self._remove(handle)
+            self._entries[handle] = entry
+            self._size += entry.size
+
+            while self._size > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+        return handle
+
+    def _remove(self, handle: str) -> None:
+        """删除条目（调用方需持有锁）"""
+        entry = self._entries.pop(handle)
+        self._size -= entry.size
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                **self.stats
+            }
+
+
+class SharedSourceStore:
+    """
+    多实例共享的源代码登记（Redis），按解析句柄保存 (语言, 源代码)，过期后需要重新提交代码
+
+    同步客户端，由调用方放到线程中执行
+
+    Args:
+        url: Redis连接地址
+        prefix: 键前缀
+        ttl: 保留时间（秒）
+    """
+
+    def __init__(self, url: str, prefix: str, ttl: int):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("共享解析句柄需要安装 redis 包（redis>=4.5.0）") from e
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, handle: str) -> str:
+        return f"{self._prefix}:{handle}"
+
+    def put(self, handle: str, language: str, code: str) -> None:
+        """登记源代码，已登记时刷新保留时间"""
+        self._redis.set(self._key(handle), json.dumps({"language": language, "code": code}), ex=self.ttl)
+
+    def get(self, handle: str) -> Optional[Tuple[str, str]]:
+        """
+        按句柄获取源代码
+
+        Returns:
+            (语言, 源代码)，句柄不存在或已过期时返回None
+        """
+        data = self._redis.get(self._key(handle))
+        if data is None:
+            return None
+        entry = json.loads(data)
+        return entry["language"], entry["code"]
+
+
+# 全局解析缓存实例
+_parse_cache: Optional[ParseCache] = None
+_shared_source_store: Optional[SharedSourceStore] = None
+
+def get_parse_cache() -> ParseCache:
+    """获取全局解析缓存实例"""
+    global _parse_cache
+    if _parse_cache is None:
+        _parse_cache = ParseCache(settings.PARSE_CACHE_MAX_BYTES)
+    return _parse_cache
+
+def get_shared_source_store() -> Optional[SharedSourceStore]:
+    """获取共享源代码登记实例，没有配置 REDIS_URL（单实例部署）时返回None"""
+    global _shared_source_store
+    if _shared_source_store is None and settings.REDIS_URL:
+        _shared_source_store = SharedSourceStore(settings.REDIS_URL, settings.PARSE_HANDLE_KEY_PREFIX,
+                                                 settings.PARSE_HANDLE_TTL)
+    return _shared_source_store
@@ -1,4 +1,6 @@
-from typing import List, Optional
+import re
+from bisect import bisect_left, bisect_right
+from typing import List, Optional, Dict, Pattern
 
 # 根据运行位置动态调整导入路径
 try:
@@ -6,80 +8,205 @@ try:
 except ModuleNotFoundError:
     from models.schemas import CodeSnippet
 
+class LineIndex:
+    """
+    源代码的行偏移索引，每个源文件只构建一次
+
+    按行号或字符偏移直接切片，避免每提取一个函数就重新 splitlines 或统计换行符，
+    使提取时间与文件大小成线性关系
+
+    Args:
+        code: 代码字符串
+    """
+
+    # 只按 \n、\r\n、\r 分行，与编译器的行号一致（splitlines 还会在 \f 等字符处分行）
+    _NEWLINE = re.compile(r"\r\n|\r|\n")
+
+    def __init__(self, code: str):
+        self.code = code
+        self.lines: List[str] = []
+        # 每行起始字符偏移
+        self.offsets: List[int] = []
+        start = 0
+        for match in self._NEWLINE.finditer(code):
+            self.offsets.append(start)
+            self.lines.append(code[start:match.start()])
+            start = match.end()
+        if start < len(code):
+            self.offsets.append(start)
+            self.lines.append(code[start:])
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def line_of(self, offset: int) -> int:
+        """字符偏移所在的行号（0-indexed）"""
+        return max(0, bisect_right(self.offsets, offset) - 1)
+
+    def slice(self, start_line: int, end_line: int) -> str:
+        """
+        提取行区间的代码
+
+        Args:
+            start_line: 起始行号（0-indexed，包含）
+            end_line: 结束行号（0-indexed，不包含）
+
+        Returns:
+            以换行符连接的代码
+        """
+        return "\n".join(self.lines[start_line:end_line])
+
+# 各语言中需要跳过的非代码片段（注释、字符串和字符字面量）；未闭合的字面量到行尾或文件尾为止
+_COMMENT_PATTERNS = [r"//[^\n]*", r"/\*[\s\S]*?(?:\*/|\Z)"]
+_QUOTED_PATTERNS = [r'"(?:\\.|[^"\\\n])*"?', r"'(?:\\.|[^'\\\n])*'?"]
+_LANGUAGE_LITERALS = {
+    # 反引号原始字符串
+    "go": [r"`[^`]*`?"],
+    # 文本块
+    "java": [r'"""[\s\S]*?(?:"""|\Z)'],
+    # 原始字符串 R"delim(...)delim"
+    "cpp": [r'(?:u8|u|U|L)?R"([^()\\\s]{0,16})\([\s\S]*?(?:\)\1"|\Z)'],
+    # 逐字字符串 @"..."（含 $@"..."、@$"..."），双引号转义
+    "csharp": [r'(?:\$@|@\$?)"(?:""|[^"])*"?'],
+}
+_brace_patterns: Dict[str, Pattern] = {}
+
+def _brace_pattern(language: Optional[str]) -> Pattern:
+    pattern = _brace_patterns.get(language)
+    if pattern is None:
+        skipped = _LANGUAGE_LITERALS.get(language, []) + _COMMENT_PATTERNS + _QUOTED_PATTERNS
+        pattern = re.compile("|".join(f"(?:{p})" for p in skipped) + r"|(?P<brace>[{}])")
+        _brace_patterns[language] = pattern
+    return pattern
+
+class BraceIndex:
+    """
+    大括号配对索引，每个源文件只构建一次
+
+    一次词法扫描跳过注释、字符串和字符字面量，用栈把每个左括号与对应的右括号配对，
+    之后查找类或函数体的结束位置只需二分查找和字典查询，不再从每个成员的位置重新逐字符扫描。
+
+    Args:
+        code: 代码字符串
+        language: 语言（go / java / cpp / csharp），决定额外跳过的字面量语法
+    """
+
+    def __init__(self, code: str, language: Optional[str] = None):
+        self.code = code
+        # 左括号位置（升序）和左括号位置 -> 右括号位置
+        self.opens: List[int] = []
+        self.pairs: Dict[int, int] = {}
+        # 跳过的注释和字面量区间（起点升序）
+        self._skipped_starts: List[int] = []
+        self._skipped_ends: List[int] = []
+        stack: List[int] = []
+        for match in _brace_pattern(language).finditer(code):
+            if match.lastgroup != "brace":
+                self._skipped_starts.append(match.start())
+                self._skipped_ends.append(match.end())
+                continue
+            pos = match.start()
+            if code[pos] == "{":
+                self.opens.append(pos)
+                stack.append(pos)
+            elif stack:
+                self.pairs[stack.pop()] = pos
+
+    def in_code(self, pos: int) -> bool:
+        """pos 是否位于注释和字面量之外"""
+        i = bisect_right(self._skipped_starts, pos) - 1
+        return i < 0 or pos >= self._skipped_ends[i]
+
+    def next_open(self, pos: int) -> Optional[int]:
+        """pos 及之后第一个（不在注释或字符串中的）左括号位置"""
+        i = bisect_left(self.opens, pos)
+        return self.opens[i] if i < len(self.opens) else None
+
+    def closing(self, open_pos: int) -> Optional[int]:
+        """左括号对应的右括号位置，未闭合时返回None"""
+        return self.pairs.get(open_pos)
+
+    def block_end(self, pos: int) -> int:
+        """
+        pos 之后第一个代码块的结束位置
+
+        Args:
+            pos: 起始位置（类或函数声明的开头）
+
+        Returns:
+            右括号之后的位置；没有代码块或代码块未闭合时返回代码长度
+        """
+        open_pos = self.next_open(pos)
+        close_pos = self.pairs.get(open_pos) if open_pos is not None else None
+        return close_pos + 1 if close_pos is not None else len(self.code)
+
 class BaseParser:
     """代码解析器基类"""
     
-    def parse_code(self, code: str) -> List[CodeSnippet]:
+    def parse_code(self, code: str, file_path: str = None) -> List[CodeSnippet]:
         """
         解析代码，提取函数和方法
         
         Args:
             code: 代码字符串
+            file_path: 文件路径（可选）
             
         Returns:
             代码片段列表
         """
         raise NotImplementedError("子类必须实现此方法")
     
-    def find_closing_brace(self, code: str, start_pos: int) -> int:
+    # 解析器对应的语言，用于构建 BraceIndex
+    language: Optional[str] = None
+    # 解析器版本，提取逻辑或片段格式变化时递增，使解析缓存中的旧结果失效
+    version: str = "1"
+
+    def brace_index(self, code: str) -> BraceIndex:
+        """为代码构建大括号配对索引（解析一个文件时构建一次，传给后续查找）"""
+        return BraceIndex(code, self.language)
+
+    def find_closing_brace(self, code: str, start_pos: int, index: Optional[BraceIndex] = None) -> int:
         """
         查找匹配的右大括号位置
-        
+
         Args:
             code: 代码字符串
             start_pos: 起始位置
-            
+            index: 代码的大括号配对索引，为None时临时构建
+
         Returns:
-            右大括号位置
+            右大括号之后的位置
         """
-        brace_count = 0
-        found_opening_brace = False
-        
-        for i in range(start_pos, len(code)):
-            if code[i] == '{':
-                found_opening_brace = True
-                brace_count += 1
-            elif code[i] == '}':
-                brace_count -= 1
-            
-            if found_opening_brace and brace_count == 0:
-                return i + 1
-        
-        return len(code)
-    
-    def extract_function_body(self, code: str, start_line: int, end_line: Optional[int] = None) -> str:
+        if index is None:
+            index = self.brace_index(code)
+        return index.block_end(start_pos)
+
+    def extract_function_body(self, code: str, start_line: int, end_line: Optional[int] = None,
+                              index: Optional[BraceIndex] = None, lines: Optional[LineIndex] = None) -> str:
         """
         提取函数体
-        
+
         Args:
             code: 代码字符串
             start_line: 起始行号（0-indexed）
             end_line: 结束行号（0-indexed），如果为None则自动查找
-            
+            index: 代码的大括号配对索引，为None时临时构建
+            lines: 代码的行偏移索引，为None时临时构建
+
         Returns:
             函数体代码
         """
-        lines = code.splitlines()
-        
+        if lines is None:
+            lines = LineIndex(code)
+        if start_line >= len(lines):
+            return ""
+
         if end_line is None:
-            # 查找函数体结束位置
-            brace_count = 0
-            found_opening_brace = False
-            end_line = start_line
-            
-            for i in range(start_line, len(lines)):
-                line = lines[i]
-                for char in line:
-                    if char == '{':
-                        found_opening_brace = True
-                        brace_count += 1
-                    elif char == '}':
-                        brace_count -= 1
-                
-                if found_opening_brace and brace_count == 0:
-                    end_line = i
-                    break
-                
-                end_line = i
-        
-        return "\n".join(lines[start_line:end_line+1])
+            # 函数体结束位置为起始行之后第一个代码块的右括号所在行
+            if index is None:
+                index = self.brace_index(code)
+            open_pos = index.next_open(lines.offsets[start_line])
+            close_pos = index.closing(open_pos) if open_pos is not None else None
+            end_line = lines.line_of(close_pos) if close_pos is not None else len(lines) - 1
+
+        return lines.slice(start_line, end_line + 1)
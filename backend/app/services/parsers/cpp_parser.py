@@ -1,95 +1,391 @@
 import re
-from typing import List, Dict, Any, Optional, Tuple
+import time
+from typing import List, Dict, Optional, Tuple, NamedTuple
+from app.config import settings
 from app.models.schemas import CodeSnippet
 from app.services.parsers.base_parser import BaseParser
 from app.utils.logger import logger
 
+# 词法规则：注释、预处理指令和空白直接跳过；字面量整体作为一个记号，其中的括号不参与配对
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<skip>^[ \t]*\#(?:\\\r?\n|[^\n])*|//[^\n]*|/\*[\s\S]*?(?:\*/|\Z)|[^\S\n]+|\n)
+  | (?P<literal>(?:u8|u|U|L)?R"(?P<delim>[^()\\\s]{0,16})\([\s\S]*?(?:\)(?P=delim)"|\Z)
+      | (?:u8|u|U|L)?"(?:\\.|[^"\\\n])*"?
+      | (?:u8|u|U|L)?'(?:\\.|[^'\\\n])*'?
+      | \.?\d(?:[\w.]|'(?=\w)|[eEpP][+-])*)
+  | (?P<ident>[A-Za-z_$][\w$]*)
+  | (?P<punct>::|->|\.\.\.|.)
+""", re.VERBOSE | re.MULTILINE)
+
+# 名称后跟括号但不是函数名的关键字
+_NON_FUNCTION_NAMES = {
+    "__attribute__", "__declspec", "alignas", "alignof", "decltype", "noexcept", "throw", "sizeof",
+    "requires", "static_assert", "if", "for", "while", "switch", "return", "catch", "typeid"
+}
+_CLASS_KEYWORDS = {"class", "struct", "union"}
+_ACCESS_LABELS = {"public", "private", "protected", "signals", "slots", "Q_SIGNALS", "Q_SLOTS"}
+
+
+class _Token(NamedTuple):
+    kind: str
+    text: str
+    start: int
+    end: int
+
+
+class _Scope(NamedTuple):
+    kind: str  # namespace / class
+    name: Optional[str]
+
+
 class CppParser(BaseParser):
-    """C++代码解析器"""
+    """
+    C++代码解析器
+
+    基于记号流的单遍识别：先用一个正则把源码切分为记号（跳过注释、预处理指令，字面量整体为一个记号），
+    再按语句前缀判断每个左括号开启的是命名空间、类、函数体还是其他代码块，函数体整体跳过。
+    支持类内定义的方法、类外定义的 Class::method、命名空间、模板和构造函数初始化列表，
+    时间与文件大小成线性关系，单个文件受 CPP_PARSE_TIME_BUDGET 限制
+    """
+
+    language = "cpp"
 
-    def parse_code(self, code: str) -> List[CodeSnippet]:
+    # 每处理多少个记号检查一次时间预算
+    _BUDGET_CHECK_INTERVAL = 4096
+
+    def parse_code(self, code: str, file_path: str = None) -> List[CodeSnippet]:
         """
         解析C++代码，提取函数和方法
 
         Args:
             code: C++代码字符串
+            file_path: 文件路径（可选）
 
         Returns:
-            代码片段列表
+            代码片段列表；超出时间预算时返回已提取的部分
         """
         try:
-            snippets = []
+            deadline = time.monotonic() + settings.CPP_PARSE_TIME_BUDGET
+            tokens = self._tokenize(code, deadline)
+            if tokens is None:
+                logger.warning(f"C++ tokenization exceeded the {settings.CPP_PARSE_TIME_BUDGET}s budget: {file_path}")
+                return []
+            return self._scan(code, tokens, deadline, file_path)
+
+        except Exception as e:
+            logger.error(f"Error parsing C++ code: {e}")
+            return []
+
+    def _tokenize(self, code: str, deadline: float) -> Optional[List[_Token]]:
+        """切分记号，超出时间预算时返回None"""
+        tokens = []
+        for count, match in enumerate(_TOKEN_PATTERN.finditer(code)):
+            if count % self._BUDGET_CHECK_INTERVAL == 0 and time.monotonic() > deadline:
+                return None
+            kind = match.lastgroup
+            if kind != "skip":
+                tokens.append(_Token(kind, match.group(), match.start(), match.end()))
+        return tokens
+
+    @staticmethod
+    def _brace_pairs(tokens: List[_Token]) -> Dict[int, int]:
+        """记号下标：左括号 -> 右括号"""
+        pairs = {}
+        stack = []
+        for i, token in enumerate(tokens):
+            if token.text == "{":
+                stack.append(i)
+            elif token.text == "}" and stack:
+                pairs[stack.pop()] = i
+        return pairs
+
+    def _scan(self, code: str, tokens: List[_Token], deadline: float, file_path: str = None) -> List[CodeSnippet]:
+        """
+        单遍扫描记号流，提取函数和方法
+
+        Args:
+            code: C++代码字符串
+            tokens: 记号列表
+            deadline: 时间预算截止时刻（time.monotonic）
+            file_path: 文件路径
+
+        Returns:
+            代码片段列表
+        """
+        snippets = []
+        pairs = self._brace_pairs(tokens)
+        scopes: List[_Scope] = []
+        namespaces = set()
+        # 当前语句的第一个记号
+        stmt = 0
+        i = 0
+        checked_at = 0
 
-            # 查找类定义
-            class_matches = list(re.finditer(r'class\s+([A-Za-z0-9_]+)(?:\s*:\s*(?:public|protected|private)\s+[A-Za-z0-9_]+)?\s*\{', code))
-            class_ranges = []
+        while i < len(tokens):
+            if i - checked_at >= self._BUDGET_CHECK_INTERVAL:
+                checked_at = i
+                if time.monotonic() > deadline:
+                    logger.warning(f"C++ parsing exceeded the {settings.CPP_PARSE_TIME_BUDGET}s budget, "
+                                   f"returning {len(snippets)} snippets found so far: {file_path}")
+                    break
 
-            for class_match in class_matches:
-                class_name = class_match.group(1)
-                class_start = class_match.start()
+            text = tokens[i].text
+            if text == ";":
+                stmt = i + 1
+            elif text == "}":
+                if scopes:
+                    scopes.pop()
+                stmt = i + 1
+            elif text == ":" and i > stmt and tokens[i - 1].text in _ACCESS_LABELS:
+                # public: 等访问控制标签（基类列表中访问控制关键字在冒号之后）
+                stmt = i + 1
+            elif text == "{":
+                kind, name, qualifier = self._classify(tokens, stmt, i)
+                close = pairs.get(i, len(tokens) - 1)
+                if kind == "namespace":
+                    scopes.append(_Scope("namespace", name))
+                    namespaces.add(self._qualified(scopes, "namespace"))
+                    stmt = i + 1
+                elif kind == "class":
+                    scopes.append(_Scope("class", name))
+                    stmt = i + 1
+                elif kind == "function":
+                    snippet = self._function_snippet(code, tokens, stmt, close, name, qualifier, scopes, namespaces,
+                                                     file_path)
+                    if snippet is not None:
+                        snippets.append(snippet)
+                    i = close
+                    stmt = close + 1
+                elif kind == "init":
+                    # 构造函数初始化列表中的 member{...}，语句继续
+                    i = close
+                else:
+                    # 枚举、初始化列表等其他代码块整体跳过
+                    i = close
+                    stmt = close + 1
+            i += 1
 
-                # 查找类结束位置
-                class_end = self._find_closing_brace(code, class_start)
-                class_ranges.append((class_start, class_end, class_name))
+        return snippets
 
-            # 查找类方法
-            for start, end, class_name in class_ranges:
-                class_code = code[start:end]
+    def _classify(self, tokens: List[_Token], stmt: int, brace: int) -> Tuple[str, Optional[str], Optional[str]]:
+        """
+        判断左括号开启的代码块类型
+
+        Args:
+            tokens: 记号列表
+            stmt: 语句第一个记号的下标
+            brace: 左括号的下标
+
+        Returns:
+            (类型, 名称, 限定名)；类型为 namespace / class / function / init / block
+        """
+        j = stmt
+        # 跳过模板头 template<...>
+        while j + 1 < brace and tokens[j].text == "template" and tokens[j + 1].text == "<":
+            j = self._skip_angles(tokens, j + 1, brace)
+        if j >= brace:
+            return "block", None, None
 
-                # 查找方法定义
-                method_pattern = r'(?:virtual\s+)?(?:static\s+)?(?:inline\s+)?(?:explicit\s+)?(?:const\s+)?(?:[A-Za-z0-9_:]+(?:<[^>]*>)?(?:\s*\*|\s*&)?\s+)?([A-Za-z0-9_]+)\s*\([^)]*\)(?:\s*const)?\s*(?:noexcept)?\s*(?:override)?\s*(?:final)?\s*(?:=\s*0)?\s*\{'
-                method_matches = re.finditer(method_pattern, class_code)
+        texts = [t.text for t in tokens[j:brace]]
+        if "namespace" in texts[:2]:
+            name = "".join(texts[texts.index("namespace") + 1:])
+            return "namespace", name or None, None
+        if texts[0] == "extern" and len(texts) == 2 and tokens[j + 1].kind == "literal":
+            # extern "C" { ... } 与命名空间一样透明
+            return "namespace", None, None
 
-                for method_match in method_matches:
-                    method_name = method_match.group(1)
-                    if method_name == class_name:  # 构造函数
+        # 顶层（不在圆括号和尖括号内）的记号
+        depth = 0
+        angle = 0
+        paren = None
+        operator_at = None
+        init_list = False
+        k = j
+        while k < brace:
+            token_text = tokens[k].text
+            if depth == 0 and angle == 0:
+                if token_text in _CLASS_KEYWORDS and paren is None:
+                    if "enum" in texts[:k - j]:
+                        return "block", None, None
+                    return "class", self._class_name(tokens, k + 1, brace), None
+                if token_text == "=" and paren is None and operator_at is None:
+                    return "block", None, None
+                if token_text == "operator" and paren is None:
+                    operator_at = k
+                    # operator() 的第一对括号是名称的一部分
+                    if k + 2 < brace and tokens[k + 1].text == "(" and tokens[k + 2].text == ")":
+                        k += 3
                         continue
+                if token_text == "(" and paren is None:
+                    prev = tokens[k - 1] if k > j else None
+                    if operator_at is not None or (prev is not None and prev.kind == "ident"
+                                                   and prev.text not in _NON_FUNCTION_NAMES):
+                        paren = k
+                    else:
+                        # __attribute__((...)) 等，跳过括号
+                        k = self._skip_parens(tokens, k, brace)
+                        continue
+                elif paren is not None and token_text == ":":
+                    init_list = True
+                elif paren is not None and token_text in (",", "=") and not init_list:
+                    # int x(1), y{2}; 等不是函数定义
+                    return "block", None, None
+            if token_text in ("(", "["):
+                depth += 1
+            elif token_text in (")", "]"):
+                depth -= 1
+            elif depth == 0 and token_text == "<" and k > j and tokens[k - 1].kind == "ident" \
+                    and tokens[k - 1].text != "operator":
+                angle += 1
+            elif depth == 0 and token_text == ">" and angle > 0:
+                angle -= 1
+            k += 1
 
-                    method_start = method_match.start()
-                    method_end = self._find_closing_brace(class_code, method_start)
+        if paren is None:
+            return "block", None, None
 
-                    method_code = class_code[method_start:method_end]
+        params_end = self._skip_parens(tokens, paren, brace)
+        # 构造函数初始化列表（签名后的单个冒号）中成员后面的 {...} 不是函数体
+        if any(t.text == ":" for t in tokens[params_end:brace]) \
+                and (tokens[brace - 1].kind == "ident" or tokens[brace - 1].text == ">"):
+            return "init", None, None
 
-                    snippets.append(CodeSnippet(
-                        name=method_name,
-                        type="method",
-                        code=method_code,
-                        language="cpp",
-                        class_name=class_name
-                    ))
+        if operator_at is not None:
+            name_start = operator_at
+            symbol = tokens[operator_at + 1:paren]
+            # operator== / operator() / operator bool
+            if all(t.kind == "punct" for t in symbol):
+                name = "operator" + "".join(t.text for t in symbol)
+            else:
+                name = "operator " + " ".join(t.text for t in symbol)
+        else:
+            name_start = paren - 1
+            name = tokens[name_start].text
+            if name_start > j and tokens[name_start - 1].text == "~":
+                name_start -= 1
+                name = "~" + name
+        return "function", name, self._qualifier(tokens, j, name_start)
 
-            # 查找全局函数
-            func_pattern = r'(?:static\s+)?(?:inline\s+)?(?:[A-Za-z0-9_:]+(?:<[^>]*>)?(?:\s*\*|\s*&)?\s+)?([A-Za-z0-9_]+)\s*\([^)]*\)(?:\s*const)?\s*(?:noexcept)?\s*\{'
-            func_matches = re.finditer(func_pattern, code)
+    @staticmethod
+    def _skip_parens(tokens: List[_Token], start: int, limit: int) -> int:
+        """从左圆括号跳到对应右圆括号之后"""
+        depth = 0
+        for k in range(start, limit):
+            if tokens[k].text == "(":
+                depth += 1
+            elif tokens[k].text == ")":
+                depth -= 1
+                if depth == 0:
+                    return k + 1
+        return limit
 
-            for func_match in func_matches:
-                func_start = func_match.start()
+    @staticmethod
+    def _skip_angles(tokens: List[_Token], start: int, limit: int) -> int:
+        """从左尖括号跳到对应右尖括号之后（圆括号内的比较运算符不计入）"""
+        depth = 0
+        parens = 0
+        for k in range(start, limit):
+            text = tokens[k].text
+            if text == "(":
+                parens += 1
+            elif text == ")":
+                parens -= 1
+            elif parens == 0 and text == "<":
+                depth += 1
+            elif parens == 0 and text == ">":
+                depth -= 1
+                if depth == 0:
+                    return k + 1
+        return limit
 
-                # 检查是否在类内
-                in_class = False
-                for start, end, _ in class_ranges:
-                    if start <= func_start <= end:
-                        in_class = True
-                        break
+    def _class_name(self, tokens: List[_Token], start: int, brace: int) -> Optional[str]:
+        """类关键字之后、基类列表之前的最后一个标识符（跳过导出宏、属性和模板特化参数）"""
+        name = None
+        k = start
+        while k < brace:
+            token = tokens[k]
+            if token.text == ":":
+                break
+            if token.text == "<":
+                k = self._skip_angles(tokens, k, brace)
+                continue
+            if token.text in ("(", "["):
+                k = self._skip_parens(tokens, k, brace) if token.text == "(" else k + 1
+                continue
+            if token.kind == "ident" and token.text not in ("final", "alignas"):
+                name = token.text
+            k += 1
+        return name
 
-                if not in_class:
-                    func_name = func_match.group(1)
-                    func_end = self._find_closing_brace(code, func_start)
+    @staticmethod
+    def _qualifier(tokens: List[_Token], stmt: int, name_start: int) -> Optional[str]:
+        """类外定义的限定名，如 ns::Foo<T>::bar 中的 ns::Foo"""
+        parts = []
+        k = name_start
+        while k - 2 >= stmt and tokens[k - 1].text == "::":
+            k -= 2
+            if tokens[k].text == ">":
+                # 跳过模板实参 Foo<T>::
+                depth = 0
+                while k >= stmt:
+                    if tokens[k].text == ">":
+                        depth += 1
+                    elif tokens[k].text == "<":
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    k -= 1
+                k -= 1
+            if k < stmt or tokens[k].kind != "ident":
+                break
+            parts.append(tokens[k].text)
+        return "::".join(reversed(parts)) or None
 
-                    func_code = code[func_start:func_end]
+    @staticmethod
+    def _qualified(scopes: List[_Scope], kind: str) -> str:
+        return "::".join(scope.name for scope in scopes if scope.kind == kind and scope.name)
 
-                    snippets.append(CodeSnippet(
-                        name=func_name,
-                        type="function",
-                        code=func_code,
-                        language="cpp",
-                        class_name=None
-                    ))
+    def _function_snippet(self, code: str, tokens: List[_Token], stmt: int, close: int, name: str,
+                          qualifier: Optional[str], scopes: List[_Scope], namespaces: set,
+                          file_path: str = None) -> Optional[CodeSnippet]:
+        """
+        为函数定义创建代码片段，构造函数和析构函数不提取
 
-            return snippets
+        Args:
+            code: C++代码字符串
+            tokens: 记号列表
+            stmt: 定义的第一个记号（含模板头）
+            close: 函数体右括号的下标
+            name: 函数名
+            qualifier: 类外定义的限定名
+            scopes: 当前的命名空间和类作用域
+            namespaces: 已出现的命名空间（限定名）
+            file_path: 文件路径
 
-        except Exception as e:
-            logger.error(f"Error parsing C++ code: {e}")
-            return []
+        Returns:
+            代码片段，构造函数和析构函数返回None
+        """
+        class_path = [scope.name for scope in scopes if scope.kind == "class" and scope.name]
+        if qualifier:
+            # 去掉限定名中的命名空间部分（ns::Foo::bar 的类为 Foo，ns::bar 为普通函数）
+            parts = qualifier.split("::")
+            current_namespace = self._qualified(scopes, "namespace")
+            for k in range(len(parts), 0, -1):
+                prefix = "::".join(parts[:k])
+                if prefix in namespaces or (current_namespace and f"{current_namespace}::{prefix}" in namespaces):
+                    parts = parts[k:]
+                    break
+            class_path.extend(parts)
+        class_name = "::".join(class_path) or None
+
+        if class_name and (name == class_path[-1] or name.startswith("~")):
+            return None
 
-    # 使用基类的find_closing_brace方法
+        return CodeSnippet(
+            name=name,
+            type="method" if class_name else "function",
+            code=code[tokens[stmt].start:tokens[close].end],
+            language="cpp",
+            class_name=class_name,
+            file_path=file_path
+        )
@@ -7,22 +7,26 @@ from app.utils.logger import logger
 class CSharpParser(BaseParser):
     """C#代码解析器"""
 
-    def parse_code(self, code: str) -> List[CodeSnippet]:
+    language = "csharp"
+
+    def parse_code(self, code: str, file_path: str = None) -> List[CodeSnippet]:
         """
         解析C#代码，提取方法和类
 
         Args:
             code: C#代码字符串
+            file_path: 文件路径（可选）
 
         Returns:
             代码片段列表
         """
         try:
             snippets = []
+            index = self.brace_index(code)
 
             # 查找类定义
-            class_pattern = r'(?:public|private|protected|internal|static)?\s+(?:abstract|sealed)?\s+class\s+([A-Za-z0-9_]+)(?:\s*:\s*[A-Za-z0-9_,\s<>]+)?\s*\{'
-            class_matches = list(re.finditer(class_pattern, code))
+            class_pattern = r'(?:(?:public|private|protected|internal|static|abstract|sealed|partial)\s+)*class\s+([A-Za-z0-9_]+)(?:\s*:\s*[A-Za-z0-9_,\s<>]+)?\s*\{'
+            class_matches = [m for m in re.finditer(class_pattern, code) if index.in_code(m.start())]
 
             # 查找类方法
             for class_match in class_matches:
@@ -30,23 +34,11 @@ class CSharpParser(BaseParser):
                 class_start = class_match.start()
 
                 # 确定类结束位置
-                brace_count = 0
-                class_end = class_start
-
-                for j in range(class_start, len(code)):
-                    if code[j] == '{':
-                        brace_count += 1
-                    elif code[j] == '}':
-                        brace_count -= 1
-                        if brace_count == 0:
-                            class_end = j + 1
-                            break
-
-                class_code = code[class_start:class_end]
+                class_end = self.find_closing_brace(code, class_start, index)
 
                 # 在类内查找方法
                 method_pattern = r'(?:public|private|protected|internal|static|virtual|override|abstract|sealed|async)(?:\s+(?:public|private|protected|internal|static|virtual|override|abstract|sealed|async))*\s+(?:[A-Za-z0-9_<>[\],\s]+)\s+([A-Za-z0-9_]+)\s*\([^)]*\)(?:\s*where\s+[^{]+)?\s*\{'
-                method_matches = re.finditer(method_pattern, class_code)
+                method_matches = re.compile(method_pattern).finditer(code, class_start, class_end)
 
                 for method_match in method_matches:
                     method_name = method_match.group(1)
@@ -54,21 +46,12 @@ class CSharpParser(BaseParser):
                         continue
 
                     method_start = method_match.start()
+                    if not index.in_code(method_start):
+                        continue
 
                     # 查找方法体结束位置
-                    brace_count = 0
-                    method_end = method_start
-
-                    for j in range(method_start, len(class_code)):
-                        if class_code[j] == '{':
-                            brace_count += 1
-                        elif class_code[j] == '}':
-                            brace_count -= 1
-                            if brace_count == 0:
-                                method_end = j + 1
-                                break
-
-                    method_code = class_code[method_start:method_end]
+                    method_end = self.find_closing_brace(code, method_start, index)
+                    method_code = code[method_start:method_end]
 
                     snippets.append(CodeSnippet(
                         name=method_name,
@@ -80,7 +63,7 @@ class CSharpParser(BaseParser):
 
             # 查找全局函数（在C#中不常见，但可能存在于静态类中）
             # 排除类定义内的代码
-            class_ranges = [(m.start(), m.end()) for m in class_matches]
+            class_ranges = [(m.start(), self.find_closing_brace(code, m.start(), index)) for m in class_matches]
 
             func_pattern = r'(?:public|private|protected|internal|static|async)(?:\s+(?:public|private|protected|internal|static|async))*\s+(?:[A-Za-z0-9_<>[\],\s]+)\s+([A-Za-z0-9_]+)\s*\([^)]*\)(?:\s*where\s+[^{]+)?\s*\{'
             func_matches = re.finditer(func_pattern, code)
@@ -95,22 +78,11 @@ class CSharpParser(BaseParser):
                         in_class = True
                         break
 
-                if not in_class:
+                if not in_class and index.in_code(func_start):
                     func_name = func_match.group(1)
 
                     # 查找函数体结束位置
-                    brace_count = 0
-                    func_end = func_start
-
-                    for j in range(func_start, len(code)):
-                        if code[j] == '{':
-                            brace_count += 1
-                        elif code[j] == '}':
-                            brace_count -= 1
-                            if brace_count == 0:
-                                func_end = j + 1
-                                break
-
+                    func_end = self.find_closing_brace(code, func_start, index)
                     func_code = code[func_start:func_end]
 
                     snippets.append(CodeSnippet(
@@ -1,31 +1,36 @@
 import re
 from typing import List, Dict, Any, Optional
 from app.models.schemas import CodeSnippet
-from app.services.parsers.base_parser import BaseParser
+from app.services.parsers.base_parser import BaseParser, BraceIndex, LineIndex
 from app.utils.logger import logger
 
 class GoParser(BaseParser):
     """Go代码解析器"""
 
-    def parse_code(self, code: str) -> List[CodeSnippet]:
+    language = "go"
+
+    def parse_code(self, code: str, file_path: str = None) -> List[CodeSnippet]:
         """
         解析Go代码，提取函数和方法
 
         Args:
             code: Go代码字符串
+            file_path: 文件路径（可选）
 
         Returns:
             代码片段列表
         """
         try:
             snippets = []
-            lines = code.splitlines()
+            index = self.brace_index(code)
+            line_index = LineIndex(code)
+            lines = line_index.lines
             i = 0
 
             while i < len(lines):
                 line = lines[i]
                 # 查找函数定义
-                if re.match(r'\s*func\s+', line):
+                if re.match(r'\s*func\s+', line) and index.in_code(line_index.offsets[i]):
                     func_start = i
                     func_name = ""
                     class_name = None
@@ -40,26 +45,8 @@ class GoParser(BaseParser):
                             if receiver_match:
                                 class_name = receiver_match.group(1)
 
-                    # 查找函数体结束
-                    brace_count = 0
-                    func_end = func_start
-
-                    for j in range(i, len(lines)):
-                        line_j = lines[j]
-                        for char in line_j:
-                            if char == '{':
-                                brace_count += 1
-                            elif char == '}':
-                                brace_count -= 1
-
-                        if brace_count > 0:
-                            func_end = j
-
-                        if brace_count == 0 and '{' in line_j:
-                            func_end = j
-                            break
-
-                    func_code = "\n".join(lines[func_start:func_end+1])
+                    func_end = self._find_body_end_line(index, line_index, func_start)
+                    func_code = line_index.slice(func_start, func_end + 1)
 
                     snippets.append(CodeSnippet(
                         name=func_name,
@@ -77,3 +64,31 @@ class GoParser(BaseParser):
         except Exception as e:
             logger.error(f"Error parsing Go code: {e}")
             return []
+
+    @staticmethod
+    def _find_body_end_line(index: BraceIndex, line_index: LineIndex, func_start: int) -> int:
+        """
+        查找函数体右括号所在的行
+
+        签名中的 struct{}、interface{} 等类型字面量在同一行闭合后还有后续内容，跳过这些括号对，
+        第一个闭合后行尾没有其他代码的括号对即为函数体
+
+        Args:
+            index: 大括号配对索引
+            line_index: 行偏移索引
+            func_start: 函数定义所在行（0-indexed）
+
+        Returns:
+            函数体结束行（0-indexed）
+        """
+        open_pos = index.next_open(line_index.offsets[func_start])
+        while open_pos is not None:
+            close_pos = index.closing(open_pos)
+            if close_pos is None:
+                return len(line_index) - 1
+            close_line = line_index.line_of(close_pos)
+            rest = line_index.lines[close_line][close_pos - line_index.offsets[close_line] + 1:].strip()
+            if not rest or rest.startswith("//") or rest.startswith("/*"):
+                return close_line
+            open_pos = index.next_open(close_pos + 1)
+        return len(line_index) - 1
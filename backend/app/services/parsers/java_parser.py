@@ -1,16 +1,42 @@
+import re
 import javalang
-from typing import List, Dict, Any, Optional
+from typing import List, Optional, NamedTuple
 from app.models.schemas import CodeSnippet
-from app.services.parsers.base_parser import BaseParser
+from app.services.parsers.base_parser import BaseParser, LineIndex
+from app.services.parsers.java_source import JavaSource, get_java_source
 from app.utils.logger import logger
 
+# 词法提取使用的记号：注释和空白跳过，字面量（含文本块）整体作为一个记号
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<skip>\s+|//[^\n]*|/\*[\s\S]*?(?:\*/|\Z))
+  | (?P<literal>\"\"\"[\s\S]*?(?:\"\"\"|\Z)|"(?:\\.|[^"\\\n])*"?|'(?:\\.|[^'\\\n])*'?|\.?\d(?:[\w.]|[eEpP][+-])*)
+  | (?P<ident>[A-Za-z_$][\w$]*)
+  | (?P<punct>.)
+""", re.VERBOSE)
+
+_TYPE_KEYWORDS = {"class", "interface", "enum"}
+# 提取方法的类型声明（注解声明没有方法体）
+_TREE_TYPES = (javalang.tree.ClassDeclaration, javalang.tree.EnumDeclaration, javalang.tree.InterfaceDeclaration)
+_NON_METHOD_NAMES = {"if", "for", "while", "switch", "catch", "synchronized", "try", "return", "new"}
+
+
+class _Token(NamedTuple):
+    kind: str
+    text: str
+    start: int
+
+
 class JavaParser(BaseParser):
     """Java代码解析器"""
 
+    language = "java"
+
     def parse_code(self, code: str, file_path: str = None) -> List[CodeSnippet]:
         """
         解析Java代码，提取方法和类
 
+        优先使用javalang的编译单元（与 JavaCodeAnalyzer 共用缓存），javalang不支持的语法或文件过大时使用词法提取
+
         Args:
             code: Java代码字符串
             file_path: 文件路径（可选）
@@ -19,47 +45,190 @@ class JavaParser(BaseParser):
             代码片段列表
         """
         try:
-            tree = javalang.parse.parse(code)
-            snippets = []
+            source = get_java_source(code)
+            if source.parsed:
+                return self._parse_tree(source, file_path)
+            return self._parse_with_lexer(code, source.lines, file_path)
 
-            # 遍历所有类
-            for path, class_node in tree.filter(javalang.tree.ClassDeclaration):
-                class_name = class_node.name
+        except Exception as e:
+            logger.error(f"Error parsing Java code: {e}")
+            return []
 
-                # 遍历类中的所有方法
-                for method_node in class_node.methods:
-                    method_code = self.extract_method_code(code, method_node)
+    def _parse_tree(self, source: JavaSource, file_path: str = None) -> List[CodeSnippet]:
+        """
+        从javalang编译单元提取方法，结束位置取自记号流
 
-                    snippets.append(CodeSnippet(
-                        name=method_node.name,
-                        type="method",
-                        code=method_code,
-                        language="java",
-                        class_name=class_name
-                    ))
+        与词法提取的范围一致：类、枚举和接口（含嵌套的成员类型）中有方法体的方法，按源码顺序排列；
+        方法体内的局部类和匿名类不提取
+        """
+        methods = []
 
-            return snippets
+        for type_node in self._member_types(source.tree.types):
+            # 抽象方法和接口中没有 default/static 的方法没有方法体，不提取
+            for method_node in type_node.methods:
+                method_code = self.extract_method_code(source, method_node)
+                if not method_code:
+                    continue
 
-        except Exception as e:
-            logger.error(f"Error parsing Java code: {e}")
-            return []
+                methods.append((method_node.position.line, CodeSnippet(
+                    name=method_node.name,
+                    type="method",
+                    code=method_code,
+                    language="java",
+                    class_name=type_node.name,
+                    file_path=file_path
+                )))
+
+        methods.sort(key=lambda item: item[0])
+        return [snippet for _, snippet in methods]
+
+    @classmethod
+    def _member_types(cls, declarations):
+        """遍历类型声明及其成员类型（不进入方法体）"""
+        for node in declarations or []:
+            if not isinstance(node, javalang.tree.TypeDeclaration):
+                continue
+            if isinstance(node, _TREE_TYPES):
+                yield node
+            body = node.body.declarations if isinstance(node, javalang.tree.EnumDeclaration) else node.body
+            yield from cls._member_types(body)
 
-    def extract_method_code(self, code_str: str, method_node) -> str:
+    def extract_method_code(self, source: JavaSource, method_node) -> str:
         """
-        提取Java方法代码的简化实现
+        提取Java方法代码
 
         Args:
-            code_str: 完整的Java代码
+            source: 代码的解析结果
             method_node: 方法节点
 
         Returns:
-            方法源代码
+            方法源代码（从注解和修饰符所在行到方法体右括号所在行），没有方法体时返回空字符串
         """
-        if not hasattr(method_node, 'position') or method_node.position is None:
+        if not hasattr(method_node, 'position') or method_node.position is None or method_node.body is None:
             return ""
 
-        # 使用源代码位置信息
-        start_line = method_node.position.line - 1
+        start_line = source.declaration_start_line(method_node)
+        end_line = source.body_end_line(method_node)
+        if start_line is None or end_line is None:
+            return ""
+        return source.lines.slice(start_line, end_line + 1)
+
+    def _parse_with_lexer(self, code: str, lines: LineIndex, file_path: str = None) -> List[CodeSnippet]:
+        """
+        词法提取：单遍扫描记号流，按语句前缀判断左括号开启的是类型声明、方法体还是其他代码块，
+        方法体和其他代码块整体跳过
+
+        Args:
+            code: Java代码字符串
+            lines: 行偏移索引
+            file_path: 文件路径
+
+        Returns:
+            代码片段列表
+        """
+        tokens = [_Token(m.lastgroup, m.group(), m.start())
+                  for m in _TOKEN_PATTERN.finditer(code) if m.lastgroup != "skip"]
+        pairs = {}
+        stack = []
+        for i, token in enumerate(tokens):
+            if token.text == "{":
+                stack.append(i)
+            elif token.text == "}" and stack:
+                pairs[stack.pop()] = i
+
+        snippets = []
+        # 类型声明的名称栈（None 表示匿名或无法识别）
+        types: List[Optional[str]] = []
+        # 与名称栈对应：是否处于枚举常量列表中（枚举体第一个 ; 之前），常量的类体不是方法
+        enum_constants: List[bool] = []
+        stmt = 0
+        parens = 0
+        i = 0
+        while i < len(tokens):
+            text = tokens[i].text
+            if text == "(":
+                parens += 1
+            elif text == ")":
+                parens -= 1
+            elif text == "{" and parens > 0:
+                # 注解参数 @A({...}) 中的数组，语句继续
+                i = pairs.get(i, len(tokens) - 1)
+            elif text == ";":
+                if enum_constants:
+                    enum_constants[-1] = False
+                stmt = i + 1
+            elif text == "}":
+                if types:
+                    types.pop()
+                    enum_constants.pop()
+                stmt = i + 1
+            elif text == "{":
+                close = pairs.get(i, len(tokens) - 1)
+                kind, name = self._classify(tokens, stmt, i)
+                if kind == "type":
+                    types.append(name)
+                    enum_constants.append(any(token.text == "enum" for token in tokens[stmt:i]))
+                    stmt = i + 1
+                else:
+                    class_name = types[-1] if types else None
+                    in_constants = bool(enum_constants) and enum_constants[-1]
+                    if kind == "method" and class_name and name != class_name and not in_constants:
+                        snippets.append(CodeSnippet(
+                            name=name,
+                            type="method",
+                            code=lines.slice(lines.line_of(tokens[stmt].start), lines.line_of(tokens[close].start) + 1),
+                            language="java",
+                            class_name=class_name,
+                            file_path=file_path
+                        ))
+                    # 方法体、静态初始化块、字段初始化等整体跳过
+                    i = close
+                    stmt = close + 1
+            i += 1
+
+        logger.info(f"Lexer extraction found {len(snippets)} Java methods")
+        return snippets
 
-        # 使用基类的方法提取函数体
-        return self.extract_function_body(code_str, start_line)
+    @staticmethod
+    def _classify(tokens: List[_Token], stmt: int, brace: int):
+        """
+        判断左括号开启的代码块
+
+        Returns:
+            ("type", 类型名) / ("method", 方法名) / ("block", None)
+        """
+        depth = 0
+        k = stmt
+        while k < brace:
+            token = tokens[k]
+            if token.text == "@":
+                # 注解（含 @interface 声明）：跳过名称和参数
+                if k + 1 < brace and tokens[k + 1].text == "interface":
+                    return "type", tokens[k + 2].text if k + 2 < brace else None
+                k += 2
+                while k + 1 < brace and tokens[k].text == ".":
+                    k += 2
+                if k < brace and tokens[k].text == "(":
+                    depth = 0
+                    while k < brace:
+                        if tokens[k].text == "(":
+                            depth += 1
+                        elif tokens[k].text == ")":
+                            depth -= 1
+                            if depth == 0:
+                                break
+                        k += 1
+                    k += 1
+                continue
+            if token.text in _TYPE_KEYWORDS or (token.text == "record" and k + 1 < brace
+                                                and tokens[k + 1].kind == "ident"):
+                return "type", tokens[k + 1].text if k + 1 < brace else None
+            if token.text in ("=", "new"):
+                return "block", None
+            if token.text == "(":
+                prev = tokens[k - 1] if k > stmt else None
+                if prev is not None and prev.kind == "ident" and prev.text not in _NON_METHOD_NAMES:
+                    return "method", prev.text
+                return "block", None
+            k += 1
+        return "block", None
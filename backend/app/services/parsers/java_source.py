@@ -0,0 +1,161 @@
+"""
+Java源文件解析结果缓存
+javalang 是纯Python实现，解析较慢；同一份代码的记号流和编译单元按内容哈希缓存，
+JavaParser 提取方法和 JavaCodeAnalyzer 分析代码特征共用一次解析
+"""
+
+import hashlib
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import javalang
+
+from app.config import settings
+from app.services.parsers.base_parser import LineIndex
+from app.utils.logger import logger
+
+
+class JavaSource:
+    """
+    一份Java代码的解析结果
+
+    Attributes:
+        code: 代码字符串
+        lines: 行偏移索引
+        tokens: javalang 记号列表，词法分析失败或文件过大时为None
+        tree: 编译单元，解析失败或文件过大时为None
+        error: 未使用javalang结果的原因
+    """
+
+    def __init__(self, code: str):
+        self.code = code
+        self.lines = LineIndex(code)
+        self.tokens: Optional[List] = None
+        self.tree = None
+        self.error: Optional[str] = None
+        self._positions: List[Tuple[int, int]] = []
+        self._pairs: Dict[int, int] = {}
+
+        if len(code) > settings.JAVA_PARSE_MAX_CHARS:
+            self.error = f"file too large for javalang ({len(code)} > {settings.JAVA_PARSE_MAX_CHARS} chars)"
+            return
+        try:
+            self.tokens = list(javalang.tokenizer.tokenize(code))
+            self.tree = javalang.parser.Parser(self.tokens).parse()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            return
+
+        # 记号位置（用于按节点位置定位记号）和大括号配对（字符串、注释不会产生分隔符记号）
+        stack = []
+        for i, token in enumerate(self.tokens):
+            self._positions.append((token.position.line, token.position.column))
+            if isinstance(token, javalang.tokenizer.Separator):
+                if token.value == "{":
+                    stack.append(i)
+                elif token.value == "}" and stack:
+                    self._pairs[stack.pop()] = i
+
+    @property
+    def parsed(self) -> bool:
+        return self.tree is not None
+
+    def _token_index(self, node) -> Optional[int]:
+        """节点位置对应的记号下标（方法节点的位置是方法名）"""
+        position = getattr(node, "position", None)
+        if not self.parsed or position is None:
+            return None
+        i = bisect_left(self._positions, (position.line, position.column))
+        return i if i < len(self.tokens) else None
+
+    def declaration_start_line(self, node) -> Optional[int]:
+        """
+        声明的起始行：从节点位置向前找到上一个不在圆括号内的 ; { }，其后的第一个记号即为声明开头
+        （包括注解和修饰符，注解参数中的 {...} 不计）
+
+        Args:
+            node: 带 position 的javalang声明节点
+
+        Returns:
+            起始行号（0-indexed），无法定位时返回None
+        """
+        i = self._token_index(node)
+        if i is None:
+            return None
+        depth = 0
+        start = i
+        for k in range(i - 1, -1, -1):
+            token = self.tokens[k]
+            if isinstance(token, javalang.tokenizer.Separator):
+                if token.value == ")":
+                    depth += 1
+                elif token.value == "(":
+                    depth -= 1
+                elif depth == 0 and token.value in (";", "{", "}"):
+                    break
+            start = k
+        return self.tokens[start].position.line - 1
+
+    def body_end_line(self, node) -> Optional[int]:
+        """
+        声明的结束行：从节点位置向后找到第一个不在圆括号内的左大括号，返回对应右大括号所在行
+
+        Args:
+            node: 带 position 的javalang声明节点
+
+        Returns:
+            结束行号（0-indexed）；没有方法体（抽象方法、接口方法）或无法定位时返回None
+        """
+        start = self._token_index(node)
+        if start is None:
+            return None
+        depth = 0
+        for i in range(start, len(self.tokens)):
+            value = self.tokens[i].value
+            if not isinstance(self.tokens[i], javalang.tokenizer.Separator):
+                continue
+            if value == "(":
+                depth += 1
+            elif value == ")":
+                depth -= 1
+            elif depth == 0 and value == ";":
+                return None
+            elif depth == 0 and value == "{":
+                close = self._pairs.get(i)
+                return self.tokens[close].position.line - 1 if close is not None else None
+        return None
+
+
+# 解析结果缓存：内容哈希 -> JavaSource
+_sources: "OrderedDict[str, JavaSource]" = OrderedDict()
+_sources_lock = threading.Lock()
+
+def get_java_source(code: str) -> JavaSource:
+    """
+    获取代码的解析结果，相同内容只解析一次
+
+    Args:
+        code: Java代码字符串
+
+    Returns:
+        解析结果（javalang失败时 parsed 为False，调用方使用词法提取）
+    """
+    key = hashlib.sha256(code.encode("utf-8", errors="surrogatepass")).hexdigest()
+    with _sources_lock:
+        source = _sources.get(key)
+        if source is not None:
+            _sources.move_to_end(key)
+            return source
+
+    source = JavaSource(code)
+    if source.error:
+        logger.info(f"javalang not used, falling back to lexer extraction: {source.error}")
+
+    with _sources_lock:
+        _sources[key] = source
+        _sources.move_to_end(key)
+        while len(_sources) > settings.JAVA_PARSE_CACHE_SIZE:
+            _sources.popitem(last=False)
+    return source
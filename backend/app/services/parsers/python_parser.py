@@ -1,15 +1,15 @@
 import ast
-import inspect
-from typing import List, Dict, Any, Optional
+import re
+from typing import List, Optional, Union
 
 # 根据运行位置动态调整导入路径
 try:
     from app.models.schemas import CodeSnippet
-    from app.services.parsers.base_parser import BaseParser
+    from app.services.parsers.base_parser import BaseParser, LineIndex
     from app.utils.logger import logger
 except ModuleNotFoundError:
     from models.schemas import CodeSnippet
-    from services.parsers.base_parser import BaseParser
+    from services.parsers.base_parser import BaseParser, LineIndex
     from utils.logger import logger
 
 class PythonParser(BaseParser):
@@ -49,56 +49,9 @@ class PythonParser(BaseParser):
                 else:
                     raise
 
-            snippets = []
-            function_count = 0
-
-            # 首先，直接查找顶级函数定义
-            for node in ast.iter_child_nodes(tree):
-                if isinstance(node, ast.FunctionDef):
-                    function_count += 1
-                    logger.info(f"找到顶级函数: {node.name}, 行号: {node.lineno}")
-
-                    # 提取函数源代码
-                    func_lines = code.splitlines()[node.lineno-1:node.end_lineno]
-                    func_code = "\n".join(func_lines)
-
-                    # 创建代码片段
-                    snippet = CodeSnippet(
-                        name=node.name,
-                        type="function",
-                        code=func_code,
-                        language="python",
-                        class_name=None,
-                        file_path=file_path
-                    )
-
-                    snippets.append(snippet)
-
-            # 然后，查找类和类方法
-            for node in ast.iter_child_nodes(tree):
-                if isinstance(node, ast.ClassDef):
-                    logger.info(f"找到类: {node.name}, 行号: {node.lineno}")
-
-                    for class_node in ast.iter_child_nodes(node):
-                        if isinstance(class_node, ast.FunctionDef):
-                            function_count += 1
-                            logger.info(f"找到类方法: {class_node.name}, 类: {node.name}, 行号: {class_node.lineno}")
-
-                            # 提取方法源代码
-                            method_lines = code.splitlines()[class_node.lineno-1:class_node.end_lineno]
-                            method_code = "\n".join(method_lines)
-
-                            # 创建代码片段
-                            snippet = CodeSnippet(
-                                name=class_node.name,
-                                type="method",
-                                code=method_code,
-                                language="python",
-                                class_name=node.name,
-                                file_path=file_path
-                            )
-
-                            snippets.append(snippet)
+            index = LineIndex(code)
+            snippets = self._collect_snippets(tree, index, file_path)
+            function_count = len(snippets)
 
             logger.info(f"解析完成，找到 {function_count} 个函数/方法，提取了 {len(snippets)} 个代码片段")
 
@@ -122,6 +75,47 @@ class PythonParser(BaseParser):
                 logger.error(f"正则表达式解析也失败: {str(regex_error)}")
                 return []
 
+    def _collect_snippets(self, tree: ast.Module, index: LineIndex, file_path: str = None) -> List[CodeSnippet]:
+        """
+        单次遍历AST，按源码顺序提取顶级函数和（含嵌套类的）类方法
+
+        同步和异步函数同样处理，装饰器包含在片段中；函数内部定义的函数和类不单独提取。
+
+        Args:
+            tree: 模块AST
+            index: 源代码的行偏移索引
+            file_path: 代码文件路径
+
+        Returns:
+            代码片段列表
+        """
+        snippets = []
+        # (节点, 所在类的限定名)；栈后进先出，子节点逆序压栈以保持源码顺序
+        stack = [(node, None) for node in reversed(tree.body)]
+        while stack:
+            node, class_name = stack.pop()
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                logger.debug(f"找到{'类方法' if class_name else '顶级函数'}: {node.name}, 行号: {node.lineno}")
+                snippets.append(CodeSnippet(
+                    name=node.name,
+                    type="method" if class_name else "function",
+                    code=self._node_source(node, index),
+                    language="python",
+                    class_name=class_name,
+                    file_path=file_path
+                ))
+            elif isinstance(node, ast.ClassDef):
+                qualified_name = f"{class_name}.{node.name}" if class_name else node.name
+                logger.debug(f"找到类: {qualified_name}, 行号: {node.lineno}")
+                stack.extend((child, qualified_name) for child in reversed(node.body))
+        return snippets
+
+    @staticmethod
+    def _node_source(node: Union[ast.FunctionDef, ast.AsyncFunctionDef], index: LineIndex) -> str:
+        """从行索引中切出函数源代码（从第一个装饰器开始）"""
+        start_line = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+        return index.slice(start_line - 1, node.end_lineno)
+
     def _try_fix_syntax(self, code: str) -> str:
         """尝试修复常见的语法问题"""
         # 这里可以添加一些常见语法问题的修复逻辑
@@ -129,44 +123,36 @@ class PythonParser(BaseParser):
 
     def _parse_with_regex(self, code: str, file_path: str = None) -> List[CodeSnippet]:
         """使用正则表达式解析Python代码"""
-        import re
         snippets = []
+        index = LineIndex(code)
+        lines = index.lines
 
         # 匹配函数定义
-        func_pattern = r'def\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\(([^)]*)\)(?:\s*->.*?)?:'
-        matches = re.finditer(func_pattern, code)
+        func_pattern = r'(?:async\s+)?def\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\(([^)]*)\)(?:\s*->.*?)?:'
 
-        for match in matches:
+        for match in re.finditer(func_pattern, code):
             func_name = match.group(1)
-            func_start = match.start()
+            start_line = index.line_of(match.start())
 
-            # 查找函数体结束位置
-            lines = code.splitlines()
-            line_no = code[:func_start].count('\n')
-            indent = None
+            # 查找函数体结束位置：跳过定义行，以函数体第一行的缩进为准
+            line_no = start_line + 1
             func_end_line = line_no
-
-            # 跳过函数定义行
-            line_no += 1
+            indent = None
             if line_no < len(lines):
-                # 获取函数体的缩进级别
                 first_line = lines[line_no]
                 indent_match = re.match(r'^(\s+)', first_line)
                 if indent_match:
                     indent = len(indent_match.group(1))
 
-                # 查找函数体结束位置
                 while line_no < len(lines):
-                    if lines[line_no].strip() == '' or lines[line_no].strip().startswith('#'):
+                    stripped = lines[line_no].strip()
+                    if stripped == '' or stripped.startswith('#'):
                         # 空行或注释行，继续
                         line_no += 1
                         func_end_line = line_no
                         continue
 
-                    # 检查缩进级别
-                    current_indent_match = re.match(r'^(\s+)', lines[line_no])
-                    current_indent = len(current_indent_match.group(1)) if current_indent_match else 0
-
+                    current_indent = len(lines[line_no]) - len(lines[line_no].lstrip())
                     if indent is None or current_indent > indent:
                         # 仍在函数体内
                         line_no += 1
@@ -175,15 +161,10 @@ class PythonParser(BaseParser):
                         # 函数体结束
                         break
 
-            # 提取函数代码
-            func_lines = lines[code[:func_start].count('\n'):func_end_line]
-            func_code = '\n'.join(func_lines)
-
-            # 创建代码片段
             snippet = CodeSnippet(
                 name=func_name,
                 type="function",
-                code=func_code,
+                code=index.slice(start_line, func_end_line),
                 language="python",
                 class_name=None,
                 file_path=file_path
@@ -209,9 +190,8 @@ class PythonParser(BaseParser):
             tree = ast.parse(code)
 
             for node in ast.walk(tree):
-                if isinstance(node, ast.FunctionDef) and node.name == func_name:
-                    func_lines = code.splitlines()[node.lineno-1:node.end_lineno]
-                    return "\n".join(func_lines)
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == func_name:
+                    return self._node_source(node, LineIndex(code))
 
             return None
 
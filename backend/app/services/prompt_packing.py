@@ -0,0 +1,227 @@
+"""
+提示打包
+把同一个类（或同一个小文件）中的多个代码片段合并为一个提示，
+一次调用生成一个测试模块，再把结果拆分回各个片段
+"""
+
+import ast
+from typing import List, Dict, Optional
+
+from app.models.schemas import CodeSnippet
+from app.config import PROMPT_TEMPLATES
+from app.services.ai_metrics import estimate_tokens
+from app.utils.logger import logger
+
+# 支持的打包模式
+PACK_MODES = ("class", "file")
+
+# Python测试中被测模块的固定路径，与逐片段生成保持一致
+_PYTHON_MODULE_PATH = "broadcast"
+
+
+def pack_snippets(snippets: List[CodeSnippet], mode: str, token_budget: int) -> List[List[int]]:
+    """
+    按打包模式把片段分组，每组代码的估算token数不超过预算
+
+    Args:
+        snippets: 代码片段列表
+        mode: 打包模式，"class" 按类分组，"file" 整个文件为一组
+        token_budget: 每组代码的token预算
+
+    Returns:
+        分组列表，每组为片段原始序号的列表（保持原始顺序）
+
+    Raises:
+        ValueError: 如果打包模式不支持
+    """
+    if mode not in PACK_MODES:
+        raise ValueError(f"Unsupported pack mode: {mode}")
+
+    # 先按类（或整个文件）归组，未归属类的函数各自成组
+    groups: Dict[str, List[int]] = {}
+    for i, snippet in enumerate(snippets):
+        if mode == "file":
+            key = "__file__"
+        elif snippet.class_name:
+            key = f"class:{snippet.class_name}"
+        else:
+            key = f"snippet:{i}"
+        groups.setdefault(key, []).append(i)
+
+    # 再按token预算切分
+    packs = []
+    for indices in groups.values():
+        current: List[int] = []
+        current_tokens = 0
+        for i in indices:
+            tokens = estimate_tokens(len(snippets[i].code))
+            if current and current_tokens + tokens > token_budget:
+                packs.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            packs.append(current)
+
+    packs.sort(key=lambda pack: pack[0])
+    return packs
+
+
+def pack_file_stem(snippets: List[CodeSnippet]) -> str:
+    """
+    获取打包测试模块的文件名主干
+
+    Args:
+        snippets: 同一组的代码片段
+
+    Returns:
+        文件名主干（不含 test_ 前缀和扩展名）
+    """
+    class_names = {snippet.class_name for snippet in snippets}
+    if len(class_names) == 1 and snippets[0].class_name:
+        return snippets[0].class_name.lower()
+    return snippets[0].name.lower()
+
+
+def build_packed_prompt(snippets: List[CodeSnippet], enhanced_prompt: str = None) -> str:
+    """
+    构建一组片段共用的提示
+
+    Args:
+        snippets: 同一组的代码片段
+        enhanced_prompt: 增强的提示（可选），提供时替代默认模板
+
+    Returns:
+        提示文本
+
+    Raises:
+        ValueError: 如果不支持片段的语言
+    """
+    first = snippets[0]
+    names = [snippet.name for snippet in snippets]
+
+    if enhanced_prompt:
+        prompt = enhanced_prompt
+    else:
+        if first.language not in PROMPT_TEMPLATES:
+            raise ValueError(f"Unsupported language for test generation: {first.language}")
+
+        class_names = {snippet.class_name for snippet in snippets}
+        if len(class_names) == 1 and first.class_name:
+            code_type = f"类 {first.class_name} 的以下方法"
+        else:
+            code_type = "模块中的以下函数和方法"
+
+        prompt = PROMPT_TEMPLATES[first.language].format(
+            code_type=code_type,
+            code="\n\n".join(snippet.code for snippet in snippets),
+            import_statement="",
+            class_name=first.class_name or "",
+            function_name=first.name
+        )
+
+    prompt += f"""
+
+本次需要测试的单元共 {len(names)} 个：{", ".join(names)}。
+请只返回一个完整的测试模块（一个代码块），为每个单元编写独立的测试函数，
+测试函数名中必须包含对应单元的名称（例如 test_{names[0]}_xxx）。
+"""
+
+    if first.language == "python":
+        imported = sorted({snippet.class_name or snippet.name for snippet in snippets})
+        prompt += f"""必须使用 "from {_PYTHON_MODULE_PATH} import {", ".join(imported)}" 导入被测对象，并包含 "import pytest"。
+"""
+
+    return prompt
+
+
+def _match_snippet(test_name: str, names: List[str]) -> Optional[str]:
+    """按测试名称匹配被测单元，优先匹配最长的名称"""
+    lowered = test_name.lower()
+    matches = [name for name in names if name.lower() in lowered]
+    if not matches:
+        return None
+    return max(matches, key=len)
+
+
+def _node_start(lines: List[str], node: ast.AST) -> int:
+    """获取节点起始行下标（从0开始），包含装饰器和紧邻的前置注释"""
+    start = node.lineno
+    decorators = getattr(node, "decorator_list", None)
+    if decorators:
+        start = min(start, min(decorator.lineno for decorator in decorators))
+    start -= 1
+    while start > 0 and lines[start - 1].lstrip().startswith("#"):
+        start -= 1
+    return start
+
+
+def _node_source(lines: List[str], node: ast.AST) -> str:
+    """获取节点源码"""
+    return "\n".join(lines[_node_start(lines, node):node.end_lineno])
+
+
+def _is_test_function(node: ast.AST) -> bool:
+    """是否为测试函数或测试方法"""
+    return isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith("test")
+
+
+def split_python_tests(test_code: str, names: List[str]) -> Optional[Dict[str, str]]:
+    """
+    把Python测试模块按被测单元拆分
+
+    导入、夹具和辅助函数等非测试代码作为公共部分保留在每个拆分结果中；
+    测试类按方法拆分，类中的非测试成员（setup_method等）同样保留。
+    无法匹配到任何单元的测试归属于第一个单元。
+
+    Args:
+        test_code: 测试模块代码
+        names: 被测单元名称列表
+
+    Returns:
+        单元名称到测试代码的映射；无法解析时返回None，
+        没有匹配到独立测试的单元不出现在结果中
+    """
+    try:
+        tree = ast.parse(test_code)
+    except SyntaxError as e:
+        logger.warning(f"Packed test module is not valid Python, skip splitting: {e}")
+        return None
+
+    lines = test_code.splitlines()
+    prelude = ""
+    previous_is_import = False
+    parts: Dict[str, List[str]] = {}
+
+    for node in tree.body:
+        if _is_test_function(node):
+            owner = _match_snippet(node.name, names) or names[0]
+            parts.setdefault(owner, []).append(_node_source(lines, node))
+            continue
+
+        if isinstance(node, ast.ClassDef) and any(_is_test_function(item) for item in node.body):
+            header = lines[_node_start(lines, node):_node_start(lines, node.body[0])]
+            members = [_node_source(lines, item) for item in node.body if not _is_test_function(item)]
+            methods: Dict[str, List[str]] = {}
+            for item in node.body:
+                if _is_test_function(item):
+                    owner = _match_snippet(item.name, names) or names[0]
+                    methods.setdefault(owner, []).append(_node_source(lines, item))
+            for owner, owner_methods in methods.items():
+                parts.setdefault(owner, []).append("\n".join(header + members + [""] + owner_methods))
+            continue
+
+        # 连续的导入语句紧挨着放，其余公共代码之间空两行
+        source = _node_source(lines, node)
+        if not prelude:
+            prelude = source
+        elif isinstance(node, (ast.Import, ast.ImportFrom)) and previous_is_import:
+            prelude += "\n" + source
+        else:
+            prelude += "\n\n\n" + source
+        previous_is_import = isinstance(node, (ast.Import, ast.ImportFrom))
+
+    return {
+        owner: f"{prelude}\n\n\n" + "\n\n\n".join(blocks) + "\n"
+        for owner, blocks in parts.items()
+    }
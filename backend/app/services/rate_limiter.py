@@ -0,0 +1,323 @@
+"""
+AI提供商限流
+按 (提供商, API密钥) 维度组合令牌桶（每分钟请求数/token数）与AIMD自适应并发：
+成功时并发上限加性增长，遇到429/5xx/超时时乘性下降，等待的调用按到达顺序排队
+"""
+
+import asyncio
+import hashlib
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, Deque, Tuple
+
+from app.config import settings
+from app.utils.logger import logger
+
+# 调用结果分类
+OUTCOME_SUCCESS = "success"
+OUTCOME_OVERLOAD = "overload"
+OUTCOME_ERROR = "error"
+OUTCOME_CANCELLED = "cancelled"
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    对调用异常分类
+
+    429、5xx和超时说明提供商过载，需要降低并发；其他错误（如401、参数错误）不影响并发上限。
+
+    Args:
+        error: 调用异常
+
+    Returns:
+        OUTCOME_OVERLOAD 或 OUTCOME_ERROR
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None and (status_code == 429 or status_code >= 500):
+        return OUTCOME_OVERLOAD
+    if isinstance(error, asyncio.TimeoutError) or "timeout" in str(error).lower():
+        return OUTCOME_OVERLOAD
+    return OUTCOME_ERROR
+
+
+def overload_backoff(retry: int, error: BaseException) -> Optional[float]:
+    """
+    过载重试前的等待秒数
+
+    提供商给出 Retry-After 时按其等待；否则按指数退避，在 [上限/2, 上限] 之间随机抖动，
+    避免同时被拒绝的调用同时重试。
+
+    Args:
+        retry: 第几次重试（从1开始）
+        error: 调用异常
+
+    Returns:
+        等待秒数；提供商要求的等待超过 AI_RATE_LIMIT_BACKOFF_MAX 时返回None（不再重试）
+    """
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return retry_after if retry_after <= settings.AI_RATE_LIMIT_BACKOFF_MAX else None
+    cap = min(settings.AI_RATE_LIMIT_BACKOFF_MAX, settings.AI_RATE_LIMIT_BACKOFF_BASE * 2 ** (retry - 1))
+    return random.uniform(cap / 2, cap)
+
+
+class TokenBucket:
+    """按分钟速率补充的令牌桶，容量为一分钟的配额"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.tokens = per_minute
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.per_minute <= 0
+
+    def set_rate(self, per_minute: float) -> None:
+        """更新速率，已有令牌不超过新容量"""
+        self._refill()
+        self.per_minute = per_minute
+        self.tokens = min(self.tokens, per_minute)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if not self.unlimited:
+            self.tokens = min(self.per_minute, self.tokens + (now - self._updated) * self.per_minute / 60.0)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        获取令牌足够前需要等待的秒数
+
+        Args:
+            amount: 需要的令牌数（超过容量时按容量计算）
+
+        Returns:
+            等待秒数，0表示可以立即获取
+        """
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.per_minute)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.per_minute
+
+    def consume(self, amount: float) -> None:
+        """消耗令牌，允许为负（实际用量超过预估时记为欠账）"""
+        if not self.unlimited:
+            self._refill()
+            self.tokens -= amount
+
+
+class ProviderLimiter:
+    """单个 (提供商, API密钥) 的限流器"""
+
+    def __init__(self, key: str, provider: str, rpm: float, tpm: float, max_concurrency: int):
+        self.key = key
+        self.provider = provider
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.min_concurrency = settings.AI_CONCURRENCY_MIN
+        self.max_concurrency = max(max_concurrency, self.min_concurrency)
+        self.limit = float(min(settings.AI_CONCURRENCY_INITIAL, self.max_concurrency))
+        self.in_flight = 0
+        self._waiters: Deque[Tuple[asyncio.Future, float]] = deque()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._last_decrease = 0.0
+        self.stats = {"admitted": 0, "successes": 0, "overloads": 0, "errors": 0, "cancelled": 0, "decreases": 0}
+
+    def configure(self, rpm: float, tpm: float, max_concurrency: int) -> None:
+        """按最新模型配置更新限额"""
+        if rpm != self.requests.per_minute:
+            self.requests.set_rate(rpm)
+        if tpm != self.tokens.per_minute:
+            self.tokens.set_rate(tpm)
+        self.max_concurrency = max(max_concurrency, self.min_concurrency)
+        self.limit = min(self.limit, self.max_concurrency)
+
+    async def acquire(self, estimated_tokens: float) -> None:
+        """
+        排队等待一个调用名额
+
+        Args:
+            estimated_tokens: 本次调用预估的token数
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((future, estimated_tokens))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 名额已分配但调用方被取消，归还名额
+                self.release(OUTCOME_CANCELLED)
+            raise
+
+    def release(self, outcome: str, extra_tokens: float = 0) -> None:
+        """
+        归还名额并按调用结果调整并发上限
+
+        Args:
+            outcome: 调用结果分类
+            extra_tokens: 实际用量超出预估的token数
+        """
+        self.in_flight -= 1
+        if extra_tokens > 0:
+            self.tokens.consume(extra_tokens)
+
+        if outcome == OUTCOME_SUCCESS:
+            self.stats["successes"] += 1
+            # 加性增长：大约每个并发窗口加1
+            self.limit = min(self.max_concurrency, self.limit + settings.AI_CONCURRENCY_INCREASE / max(self.limit, 1.0))
+        elif outcome == OUTCOME_OVERLOAD:
+            self.stats["overloads"] += 1
+            now = time.monotonic()
+            # 同一波失败只下降一次，避免并发上限被瞬间打到最低
+            if now - self._last_decrease >= settings.AI_CONCURRENCY_DECREASE_INTERVAL:
+                self._last_decrease = now
+                self.limit = max(self.min_concurrency, self.limit * settings.AI_CONCURRENCY_DECREASE_FACTOR)
+                self.stats["decreases"] += 1
+                logger.warning(f"Provider {self.key} overloaded, concurrency limit reduced to {self.limit:.2f}")
+        elif outcome == OUTCOME_CANCELLED:
+            self.stats["cancelled"] += 1
+        else:
+            self.stats["errors"] += 1
+
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """按到达顺序为等待者分配名额"""
+        while self._waiters and self.in_flight < int(self.limit):
+            future, estimated_tokens = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+            if wait > 0:
+                # 队首等待令牌时后面的调用也不插队
+                self._schedule_wakeup(wait)
+                return
+
+            self._waiters.popleft()
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            future.set_result(None)
+
+    def _schedule_wakeup(self, delay: float) -> None:
+        if self._wakeup is not None and not self._wakeup.cancelled():
+            return
+
+        def _wake():
+            self._wakeup = None
+            self._dispatch()
+
+        self._wakeup = asyncio.get_running_loop().call_later(delay, _wake)
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取限流器状态"""
+        return {
+            "key": self.key,
+            "provider": self.provider,
+            "concurrency_limit": round(self.limit, 2),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": sum(1 for future, _ in self._waiters if not future.done()),
+            "rpm": self.requests.per_minute,
+            "tpm": self.tokens.per_minute,
+            "requests_available": None if self.requests.unlimited else round(max(self.requests.tokens, 0), 1),
+            "tokens_available": None if self.tokens.unlimited else round(self.tokens.tokens, 1),
+            "stats": dict(self.stats)
+        }
+
+
+class RateLimiterRegistry:
+    """按 (提供商, API密钥) 管理限流器"""
+
+    def __init__(self):
+        self._limiters: Dict[str, ProviderLimiter] = {}
+
+    @staticmethod
+    def limiter_key(model_config: Dict[str, Any]) -> str:
+        """计算限流器键，API密钥只保留哈希前缀"""
+        provider = model_config.get("provider", "unknown")
+        key_hash = hashlib.sha256(str(model_config.get("api_key", "")).encode()).hexdigest()[:8]
+        return f"{provider}:{key_hash}"
+
+    def get_limiter(self, model_config: Dict[str, Any]) -> ProviderLimiter:
+        """
+        获取模型配置对应的限流器
+
+        模型配置可通过 rpm、tpm、max_concurrency 覆盖全局默认值；
+        共用同一个密钥的模型共享限流器，限额以最近一次调用的模型配置为准。
+
+        Args:
+            model_config: 模型配置
+
+        Returns:
+            限流器
+        """
+        key = self.limiter_key(model_config)
+        rpm = float(model_config.get("rpm", settings.AI_RATE_LIMIT_DEFAULT_RPM))
+        tpm = float(model_config.get("tpm", settings.AI_RATE_LIMIT_DEFAULT_TPM))
+        max_concurrency = int(model_config.get("max_concurrency", settings.AI_CONCURRENCY_MAX))
+
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = ProviderLimiter(key, model_config.get("provider", "unknown"), rpm, tpm, max_concurrency)
+            self._limiters[key] = limiter
+        else:
+            limiter.configure(rpm, tpm, max_concurrency)
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, model_config: Dict[str, Any], estimated_tokens: float):
+        """
+        在限流下执行一次提供商调用
+
+        用法：
+            async with registry.slot(config, tokens) as usage:
+                ...
+                usage["tokens"] = actual_tokens
+
+        Args:
+            model_config: 模型配置
+            estimated_tokens: 预估的token数
+
+        Yields:
+            用量字典，调用方可写入 "tokens" 记录实际用量
+        """
+        if not settings.AI_RATE_LIMIT_ENABLED:
+            yield {}
+            return
+
+        limiter = self.get_limiter(model_config)
+        await limiter.acquire(estimated_tokens)
+        usage: Dict[str, float] = {}
+        try:
+            yield usage
+        except BaseException as e:
+            # 被取消（如对冲失败方）不计为错误
+            outcome = classify_error(e) if isinstance(e, Exception) else OUTCOME_CANCELLED
+            limiter.release(outcome, usage.get("tokens", estimated_tokens) - estimated_tokens)
+            raise
+        limiter.release(OUTCOME_SUCCESS, usage.get("tokens", estimated_tokens) - estimated_tokens)
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取所有限流器状态"""
+        return {key: limiter.get_status() for key, limiter in self._limiters.items()}
+
+# 全局限流器注册表
+_rate_limiter_registry: Optional[RateLimiterRegistry] = None
+
+def get_rate_limiter_registry() -> RateLimiterRegistry:
+    """获取全局限流器注册表"""
+    global _rate_limiter_registry
+    if _rate_limiter_registry is None:
+        _rate_limiter_registry = RateLimiterRegistry()
+    return _rate_limiter_registry
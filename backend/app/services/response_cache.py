@@ -0,0 +1,385 @@
+"""
+AI响应分层缓存
+内存LRU层（按字节数限制）+ SQLite磁盘层（WAL模式，多worker进程共享，重启后保留）
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from app.config import settings, ai_config_manager
+from app.services.executors import run_blocking, EXECUTOR_AI
+from app.utils.logger import logger
+
+# 计算模型配置指纹时忽略的字段（密钥不参与缓存键，也不应落盘）
+_FINGERPRINT_EXCLUDED_KEYS = {"api_key", "is_system"}
+
+
+class MemoryLRUTier:
+    """按字节数限制的内存LRU缓存层"""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，命中时移动到LRU尾部"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, size, expires_at, _ = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, model_name: str, ttl: Optional[float] = None) -> None:
+        """写入缓存，超出字节上限时淘汰最久未使用的条目"""
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, size, expires_at, model_name)
+            self._size += size
+
+            while self._size > self.max_bytes and self._entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate_model(self, model_name: str) -> int:
+        """删除指定模型的所有条目"""
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry[3] == model_name]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key: str) -> None:
+        """删除条目（调用方需持有锁）"""
+        _, size, _, _ = self._entries.pop(key)
+        self._size -= size
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+class SQLiteTier:
+    """SQLite磁盘缓存层，WAL模式下可被多个worker进程并发读写"""
+
+    def __init__(self, db_path: str, ttl: float, max_entries: int):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes_since_prune = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    model_name TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_model ON response_cache(model_name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_access ON response_cache(last_access)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            value, expires_at = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM response_cache WHERE cache_key = ?", (key,))
+                self.expirations += 1
+                return None
+
+            conn.execute("UPDATE response_cache SET last_access = ? WHERE cache_key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str, model_name: str, ttl: Optional[float] = None) -> None:
+        """写入缓存"""
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.ttl)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache "
+                "(cache_key, model_name, value, size, created_at, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model_name, value, len(value.encode("utf-8")), now, expires_at, now)
+            )
+
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= 100:
+            self._writes_since_prune = 0
+            self.prune()
+
+    def prune(self) -> None:
+        """删除过期条目，并按最近访问时间淘汰超出上限的条目"""
+        now = time.time()
+        with self._connect() as conn:
+            expired = conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,)).rowcount
+            self.expirations += max(expired, 0)
+
+            count = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                evicted = conn.execute(
+                    "DELETE FROM response_cache WHERE cache_key IN "
+                    "(SELECT cache_key FROM response_cache ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                ).rowcount
+                self.evictions += max(evicted, 0)
+
+    def invalidate_model(self, model_name: str) -> int:
+        """删除指定模型的所有条目"""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM response_cache WHERE model_name = ?", (model_name,)).rowcount
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM response_cache")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._connect() as conn:
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache"
+            ).fetchone()
+        return {
+            "path": self.db_path,
+            "entries": entries,
+            "size_bytes": size,
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+class TieredResponseCache:
+    """内容寻址的AI响应分层缓存"""
+
+    def __init__(self, memory_tier: MemoryLRUTier, disk_tier: Optional[SQLiteTier] = None):
+        self.memory_tier = memory_tier
+        self.disk_tier = disk_tier
+        self._stats_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def fingerprint_model_config(model_config: Dict[str, Any]) -> str:
+        """
+        计算模型配置指纹
+
+        Args:
+            model_config: 模型配置
+
+        Returns:
+            配置指纹（不包含API密钥）
+        """
+        relevant = {k: v for k, v in model_config.items() if k not in _FINGERPRINT_EXCLUDED_KEYS}
+        encoded = json.dumps(relevant, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
+
+    def make_key(self, model_name: str, model_config: Dict[str, Any], prompt: str) -> str:
+        """
+        生成缓存键：(模型名称, 模型配置指纹, 最终提示哈希)
+
+        Args:
+            model_name: 模型名称
+            model_config: 模型配置
+            prompt: 最终发送给模型的提示
+
+        Returns:
+            缓存键
+        """
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        raw_key = f"{model_name}\0{self.fingerprint_model_config(model_config)}\0{prompt_hash}"
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def _count(self, field: str) -> None:
+        with self._stats_lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    async def get(self, key: str, model_name: str) -> Optional[str]:
+        """
+        读取缓存，先查内存层再查磁盘层，磁盘命中后回填内存层
+
+        Args:
+            key: 缓存键
+            model_name: 模型名称
+
+        Returns:
+            缓存的测试代码，未命中时返回None
+        """
+        value = self.memory_tier.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+
+        if self.disk_tier is not None:
+            try:
+                value = await run_blocking(EXECUTOR_AI, self.disk_tier.get, key)
+            except Exception as e:
+                logger.warning(f"Response cache disk read failed: {e}")
+                value = None
+
+            if value is not None:
+                self._count("disk_hits")
+                self.memory_tier.set(key, value, model_name)
+                return value
+
+        self._count("misses")
+        return None
+
+    async def set(self, key: str, value: str, model_name: str) -> None:
+        """
+        写入两层缓存
+
+        Args:
+            key: 缓存键
+            value: 测试代码
+            model_name: 模型名称
+        """
+        self.memory_tier.set(key, value, model_name)
+        if self.disk_tier is not None:
+            try:
+                await run_blocking(EXECUTOR_AI, self.disk_tier.set, key, value, model_name)
+            except Exception as e:
+                logger.warning(f"Response cache disk write failed: {e}")
+        self._count("writes")
+
+    def invalidate_model(self, model_name: str) -> None:
+        """
+        使指定模型的缓存失效（模型配置变更时调用）
+
+        同步访问磁盘层，需要在线程池中调用（配置管理接口通过 run_blocking 修改配置）
+
+        Args:
+            model_name: 模型名称
+        """
+        removed = self.memory_tier.invalidate_model(model_name)
+        if self.disk_tier is not None:
+            try:
+                removed += self.disk_tier.invalidate_model(model_name)
+            except Exception as e:
+                logger.warning(f"Response cache disk invalidation failed: {e}")
+        self._count("invalidations")
+        logger.info(f"Invalidated {removed} cached responses for model {model_name}")
+
+    def clear(self) -> None:
+        """清空所有缓存（同步访问磁盘层，需要在线程池中调用）"""
+        self.memory_tier.clear()
+        if self.disk_tier is not None:
+            self.disk_tier.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._stats_lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            stats = {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0,
+                "writes": self.writes,
+                "invalidations": self.invalidations,
+                "memory": self.memory_tier.get_stats()
+            }
+
+        if self.disk_tier is not None:
+            try:
+                stats["disk"] = self.disk_tier.get_stats()
+            except Exception as e:
+                stats["disk"] = {"error": str(e)}
+        return stats
+
+# 全局缓存实例
+_response_cache: Optional[TieredResponseCache] = None
+
+def get_response_cache() -> Optional[TieredResponseCache]:
+    """获取全局响应缓存实例，未启用缓存时返回None"""
+    global _response_cache
+    if not settings.AI_CACHE_ENABLED:
+        return None
+
+    if _response_cache is None:
+        memory_tier = MemoryLRUTier(settings.AI_CACHE_MEMORY_MAX_BYTES, settings.AI_CACHE_TTL_SECONDS)
+        disk_tier = None
+        if settings.AI_CACHE_DISK_ENABLED:
+            try:
+                disk_tier = SQLiteTier(
+                    settings.AI_CACHE_DB_PATH,
+                    settings.AI_CACHE_TTL_SECONDS,
+                    settings.AI_CACHE_DISK_MAX_ENTRIES
+                )
+            except Exception as e:
+                logger.error(f"Failed to open response cache database, using memory tier only: {e}")
+
+        _response_cache = TieredResponseCache(memory_tier, disk_tier)
+        # 模型配置变更时自动失效
+        ai_config_manager.add_change_listener(_response_cache.invalidate_model)
+    return _response_cache
@@ -1,107 +1,182 @@
 """
 简化的并发控制系统
-解决多用户并发访问问题
+解决多用户并发访问问题，调度由 app/services/task_scheduler.py 中的公平调度器完成
 """
 
-import asyncio
-import time
-import uuid
-import os
-from typing import Dict, Optional
-import logging
-
-logger = logging.getLogger(__name__)
-
-class SimpleTaskQueue:
-    """简化的任务队列，用于控制并发"""
-    
-    def __init__(self, max_concurrent: int = None):
-        # 从环境变量获取最大并发数，默认为3
-        if max_concurrent is None:
-            max_concurrent = int(os.getenv('MAX_CONCURRENT_TASKS', '3'))
-
-        self.max_concurrent = max_concurrent
-        self.running_tasks: Dict[str, dict] = {}
-        self.semaphore = asyncio.Semaphore(max_concurrent)
-        self.lock = asyncio.Lock()
-        self.instance_id = os.getenv('INSTANCE_ID', 'default')
-    
-    async def execute_task(self, task_func, *args, **kwargs):
-        """执行任务，控制并发数量"""
-        task_id = str(uuid.uuid4())
-        
-        # 获取信号量
-        async with self.semaphore:
-            async with self.lock:
-                self.running_tasks[task_id] = {
-                    "id": task_id,
-                    "status": "running",
-                    "start_time": time.time(),
-                    "user_id": kwargs.get("user_id", "anonymous")
-                }
-            
-            try:
-                logger.info(f"[{self.instance_id}] Starting task {task_id}, concurrent tasks: {len(self.running_tasks)}")
-                
-                # 执行任务
-                result = await task_func(*args, **kwargs)
-                
-                async with self.lock:
-                    if task_id in self.running_tasks:
-                        self.running_tasks[task_id]["status"] = "completed"
-                        self.running_tasks[task_id]["end_time"] = time.time()
-                
-                logger.info(f"Task {task_id} completed successfully")
-                return result
-                
-            except Exception as e:
-                async with self.lock:
-                    if task_id in self.running_tasks:
-                        self.running_tasks[task_id]["status"] = "failed"
-                        self.running_tasks[task_id]["error"] = str(e)
-                        self.running_tasks[task_id]["end_time"] = time.time()
-                
-                logger.error(f"Task {task_id} failed: {e}")
-                raise
-                
-            finally:
-                # 清理完成的任务
-                await asyncio.sleep(1)  # 短暂延迟，让状态查询有时间看到完成状态
-                async with self.lock:
-                    if task_id in self.running_tasks:
-                        del self.running_tasks[task_id]
-    
-    def get_status(self):
-        """获取队列状态"""
-        return {
-            "running_tasks": len(self.running_tasks),
-            "max_concurrent": self.max_concurrent,
-            "available_slots": self.max_concurrent - len(self.running_tasks),
-            "tasks": list(self.running_tasks.values())
-        }
-    
-    def get_task_status(self, task_id: str):
-        """获取特定任务状态"""
-        return self.running_tasks.get(task_id)
-
-# 全局队列实例
-_simple_queue = None
-
-def get_simple_queue() -> SimpleTaskQueue:
+import json
+from typing import Dict, Any, Optional, Callable, AsyncIterator, Awaitable
+
+from app.config import settings
+from app.services.task_scheduler import (
+    FairShareScheduler, ScheduledTask, LANE_INTERACTIVE, get_scheduler, check_wait_slo
+)
+from app.services.distributed_queue import JobHandler, get_distributed_queue
+from app.services.deadline import Deadline
+
+
+def get_simple_queue() -> FairShareScheduler:
     """获取全局队列实例"""
-    global _simple_queue
-    if _simple_queue is None:
-        # 从环境变量获取最大并发数
-        max_concurrent = int(os.getenv('MAX_CONCURRENT_TASKS', '3'))
-        _simple_queue = SimpleTaskQueue(max_concurrent=max_concurrent)
-    return _simple_queue
-
-async def execute_with_queue(task_func, *args, **kwargs):
+    return get_scheduler()
+
+
+async def execute_with_queue(task_func: Callable[[], Awaitable[Any]], user_id: str = "anonymous",
+                             lane: str = LANE_INTERACTIVE, cost: int = 0) -> Any:
     """使用队列执行任务"""
-    queue = get_simple_queue()
-    return await queue.execute_task(task_func, *args, **kwargs)
+    return await get_scheduler().execute(task_func, user_id=user_id, lane=lane, cost=cost)
+
+
+async def estimate_queue_wait() -> float:
+    """估算新请求的排队等待秒数（分布式模式下为集群队列）"""
+    if settings.QUEUE_MODE == "distributed":
+        return await get_distributed_queue().estimate_wait()
+    return get_scheduler().estimate_new_wait()
+
+
+async def check_queue_load(deadline: Optional[Deadline] = None) -> None:
+    """
+    新请求入队前按预计等待时间做负载卸载
+
+    Args:
+        deadline: 请求截止时间（可选），预计等待时间不能超过剩余预算
+
+    Raises:
+        QueueOverloadedError: 如果预计等待时间超过 QUEUE_WAIT_SLO_SECONDS 或剩余预算
+    """
+    check_wait_slo(await estimate_queue_wait(), deadline.remaining() if deadline is not None else None)
+
+
+def _cluster_queued_line(queue_status: Dict[str, Any]) -> str:
+    return json.dumps({
+        "status": "queued",
+        "message": f"排队中，集群队列中前面还有 {queue_status['position'] - 1} 个任务",
+        "task_id": queue_status["task_id"],
+        "position": queue_status["position"],
+        "pending_tasks": queue_status["pending_tasks"],
+        "estimated_wait": queue_status["estimated_wait"],
+        "progress": 0
+    }) + "\n"
+
+
+def _cluster_requeued_line(job_id: str) -> str:
+    return json.dumps({
+        "status": "requeued",
+        "message": "执行任务的实例已停止，任务重新排队，将由其他实例从头执行",
+        "task_id": job_id,
+        "progress": 0
+    }) + "\n"
+
+
+def _cluster_cancelled_line(job_id: str) -> str:
+    return json.dumps({
+        "status": "cancelled",
+        "message": "任务已取消",
+        "task_id": job_id,
+        "progress": 100
+    }) + "\n"
+
+
+def _queued_line(queue_status: Dict[str, Any]) -> str:
+    return json.dumps({
+        "status": "queued",
+        "message": f"排队中，前面还有 {queue_status['position'] - 1} 个任务",
+        "task_id": queue_status["task_id"],
+        "position": queue_status["position"],
+        "estimated_wait": queue_status["estimated_wait"],
+        "progress": 0
+    }) + "\n"
+
+
+def _cancelled_line(task: ScheduledTask) -> str:
+    return json.dumps({
+        "status": "cancelled",
+        "message": "任务已取消",
+        "task_id": task.task_id,
+        "progress": 100
+    }) + "\n"
 
-def get_queue_status():
+
+def _rejected_line(error: Exception) -> str:
+    return json.dumps({"error": str(error), "status": "error"}) + "\n"
+
+
+def stream_with_queue(stream_factory: Callable[[ScheduledTask], AsyncIterator], user_id: str = "anonymous",
+                      lane: str = LANE_INTERACTIVE, cost: int = 0,
+                      is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> AsyncIterator:
+    """
+    使用队列执行NDJSON流式任务，整个流式输出期间占用名额
+
+    排队期间输出 status 为 queued 的行（含 task_id、位置和预计等待时间），
+    通过取消接口取消时输出 status 为 cancelled 的行，超出用户配额时输出错误行。
+
+    Args:
+        stream_factory: 以调度任务为参数创建异步生成器的函数
+        user_id: 用户ID
+        lane: 调度通道
+        cost: 预估token成本
+        is_disconnected: 检查客户端是否已断开的函数（可选），断开后取消生成并释放名额
+
+    Returns:
+        异步生成器
+    """
+    return get_scheduler().stream(stream_factory, user_id=user_id, lane=lane, cost=cost,
+                                  queued_event=_queued_line, cancelled_event=_cancelled_line,
+                                  rejected_event=_rejected_line, is_disconnected=is_disconnected)
+
+
+def get_queue_status() -> Dict[str, Any]:
     """获取队列状态"""
-    queue = get_simple_queue()
-    return queue.get_status()
+    return get_scheduler().get_status()
+
+
+def register_job_handler(job_type: str, handler: JobHandler) -> None:
+    """注册分布式队列的任务处理函数"""
+    get_distributed_queue().register_handler(job_type, handler)
+
+
+def stream_with_cluster_queue(job_type: str, payload: Dict[str, Any], user_id: str = "anonymous",
+                              lane: str = LANE_INTERACTIVE, cost: int = 0,
+                              is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> AsyncIterator:
+    """
+    通过分布式队列执行NDJSON流式任务，由集群中任意实例执行，本实例转发事件
+
+    排队、重新排队、取消和超出用户配额时输出的行与本地队列一致（status 分别为 queued、requeued、cancelled 和错误行）。
+
+    Args:
+        job_type: 任务类型（需已注册处理函数）
+        payload: 任务参数（可JSON序列化）
+        user_id: 用户ID
+        lane: 调度通道
+        cost: 预估token成本
+        is_disconnected: 检查客户端是否已断开的函数（可选），断开后通知执行实例停止
+
+    Returns:
+        异步生成器
+    """
+    return get_distributed_queue().stream_job(job_type, payload, user_id=user_id, lane=lane, cost=cost,
+                                              queued_event=_cluster_queued_line,
+                                              requeued_event=_cluster_requeued_line,
+                                              cancelled_event=_cluster_cancelled_line,
+                                              rejected_event=_rejected_line,
+                                              is_disconnected=is_disconnected)
+
+
+async def run_with_cluster_queue(job_type: str, payload: Dict[str, Any], user_id: str = "anonymous",
+                                 lane: str = LANE_INTERACTIVE, cost: int = 0) -> Dict[str, Any]:
+    """
+    通过分布式队列执行非流式任务并等待结果，由集群中任意实例执行
+
+    Args:
+        job_type: 任务类型（需已注册处理函数，最后产出的一行JSON为结果）
+        payload: 任务参数（可JSON序列化）
+        user_id: 用户ID
+        lane: 调度通道
+        cost: 预估token成本
+
+    Returns:
+        结果字典
+
+    Raises:
+        QueueFullError: 如果超出用户配额
+        TaskCancelledError: 如果任务被取消
+    """
+    return await get_distributed_queue().run_job(job_type, payload, user_id=user_id, lane=lane, cost=cost)
@@ -0,0 +1,137 @@
+"""
+单飞（single-flight）去重
+相同键的并发调用共享同一次执行：第一个调用方执行，其余调用方等待同一个结果。
+结果保存在 concurrent.futures.Future 中，等待方通过 asyncio.wrap_future 等待
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import threading
+from typing import Dict, Any, Optional, Callable, Awaitable, TypeVar
+
+from app.utils.logger import logger
+
+T = TypeVar("T")
+
+
+def single_flight_key(*parts: str) -> str:
+    """
+    计算单飞键
+
+    Args:
+        *parts: 键的组成部分（如模型名称、提示文本）
+
+    Returns:
+        键的哈希
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _Flight:
+    """一次进行中的执行"""
+
+    def __init__(self):
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class SingleFlight:
+    """按键合并进行中的调用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self.stats = {"leaders": 0, "hits": 0, "abandoned": 0}
+
+    def _join(self, key: str):
+        """加入或创建执行，返回 (执行, 是否为执行方)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.stats["leaders"] += 1
+            else:
+                self.stats["hits"] += 1
+            flight.waiters += 1
+            return flight, leader
+
+    def _finish(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _leave(self, flight: _Flight) -> None:
+        """等待方离开；最后一个等待方离开时取消执行"""
+        with self._lock:
+            flight.waiters -= 1
+            abandoned = flight.waiters == 0 and not flight.future.done()
+            if abandoned:
+                self.stats["abandoned"] += 1
+        if abandoned and flight.task is not None:
+            logger.info("All waiters left a single-flight execution, cancelling it")
+            flight.loop.call_soon_threadsafe(flight.task.cancel)
+
+    async def _run(self, key: str, flight: _Flight, func: Callable[[], Awaitable[T]]) -> None:
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            flight.future.cancel()
+            raise
+        except BaseException as e:
+            flight.future.set_exception(e)
+        else:
+            flight.future.set_result(result)
+        finally:
+            self._finish(key, flight)
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]],
+                 on_hit: Optional[Callable[[], None]] = None) -> T:
+        """
+        异步执行；相同键已有进行中的执行时等待其结果
+
+        执行在独立任务中进行，单个等待方被取消不会影响其他等待方，
+        所有等待方都离开后执行才会被取消。
+
+        Args:
+            key: 单飞键
+            func: 执行函数
+            on_hit: 命中进行中执行时的回调（可选）
+
+        Returns:
+            执行结果
+        """
+        flight, leader = self._join(key)
+        if leader:
+            flight.loop = asyncio.get_running_loop()
+            flight.task = asyncio.create_task(self._run(key, flight, func))
+        elif on_hit is not None:
+            on_hit()
+
+        try:
+            return await asyncio.shield(asyncio.wrap_future(flight.future))
+        finally:
+            self._leave(flight)
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取去重统计"""
+        with self._lock:
+            return {"in_flight": len(self._flights), **self.stats}
+
+# 全局单飞实例
+_single_flight: Optional[SingleFlight] = None
+
+def get_single_flight() -> SingleFlight:
+    """获取全局单飞实例"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,605 @@
+"""
+公平调度器
+按用户做加权公平排队（WFQ），区分交互和批量两条通道，按预估token成本准入，
+提供等待队列位置、预计等待时间和真正的任务取消
+"""
+
+import asyncio
+import math
+import time
+import uuid
+from collections import deque
+from contextlib import aclosing
+from typing import Dict, Any, Optional, Callable, Awaitable, AsyncIterator, List, Deque
+
+from app.config import settings
+from app.services.ai_metrics import estimate_tokens
+from app.services.latency_histogram import LatencyHistogram
+from app.services.wait_estimator import WaitTimeEstimator
+from app.utils.logger import logger
+
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+STATUS_DISCONNECTED = "disconnected"
+
+
+class QueueFullError(Exception):
+    """用户等待中的任务数超过配额"""
+    pass
+
+
+class TaskCancelledError(Exception):
+    """任务在等待中被取消"""
+    pass
+
+
+class QueueOverloadedError(Exception):
+    """预计排队等待时间超过SLO，拒绝新请求"""
+
+    def __init__(self, estimated_wait: float, retry_after: int):
+        super().__init__(f"Queue overloaded, estimated wait {estimated_wait:.0f}s, retry after {retry_after}s")
+        self.estimated_wait = estimated_wait
+        self.retry_after = retry_after
+
+
+def check_wait_slo(estimated_wait: float, remaining: Optional[float] = None) -> None:
+    """
+    按 QUEUE_WAIT_SLO_SECONDS 检查预计等待时间（SLO为0时不限制），
+    并拒绝排队就会耗尽剩余截止时间的请求
+
+    Args:
+        estimated_wait: 预计等待秒数
+        remaining: 请求剩余的截止时间预算（秒，可选）
+
+    Raises:
+        QueueOverloadedError: 如果超过SLO或剩余预算，retry_after 为等待时间降回限制以内所需的秒数
+    """
+    limit = settings.QUEUE_WAIT_SLO_SECONDS if settings.QUEUE_WAIT_SLO_SECONDS > 0 else math.inf
+    if remaining is not None:
+        limit = min(limit, remaining)
+    if estimated_wait > limit:
+        raise QueueOverloadedError(estimated_wait, max(1, math.ceil(estimated_wait - limit)))
+
+
+def estimate_task_cost(code: str) -> int:
+    """
+    估算一次生成任务的token成本（被测代码token数加固定开销）
+
+    Args:
+        code: 被测代码
+
+    Returns:
+        预估token数
+    """
+    return estimate_tokens(len(code or "")) + settings.QUEUE_BASE_TASK_COST
+
+
+def _uncancel_current_task() -> None:
+    """撤销当前协程任务上的取消请求（Python 3.11+），使其可以继续执行收尾逻辑"""
+    current = asyncio.current_task()
+    if current is not None and hasattr(current, "uncancel"):
+        current.uncancel()
+
+
+class ScheduledTask:
+    """调度中的任务"""
+
+    def __init__(self, user_id: str, lane: str, cost: int, finish_tag: float):
+        self.task_id = str(uuid.uuid4())
+        self.user_id = user_id
+        self.lane = lane
+        self.cost = cost
+        self.finish_tag = finish_tag
+        self.status = STATUS_PENDING
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.progress: Dict[str, Any] = {}
+        self.admitted: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.runner: Optional[asyncio.Task] = None
+        self.cancel_requested = False
+        self.disconnected = False
+
+    def update_progress(self, **progress: Any) -> None:
+        """更新任务进度（completed、total、current等）"""
+        self.progress.update(progress)
+
+    @property
+    def wait_time(self) -> float:
+        """排队等待秒数（未准入时为截至当前的等待时间）"""
+        if self.started_at is not None:
+            return self.started_at - self.created_at
+        if self.finished_at is not None:
+            return self.finished_at - self.created_at
+        return time.time() - self.created_at
+
+    @property
+    def run_time(self) -> Optional[float]:
+        """执行秒数，未准入时为None"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        run_time = self.run_time
+        data = {
+            "task_id": self.task_id,
+            "id": self.task_id,
+            "user_id": self.user_id,
+            "lane": self.lane,
+            "cost": self.cost,
+            "status": self.status,
+            "created_at": self.created_at,
+            "start_time": self.started_at,
+            "end_time": self.finished_at,
+            "wait_time": round(self.wait_time, 3),
+            "run_time": None if run_time is None else round(run_time, 3)
+        }
+        if self.error:
+            data["error"] = self.error
+        data.update(self.progress)
+        return data
+
+
+class FairShareScheduler:
+    """
+    加权公平调度器
+
+    每个用户是一个流，任务的虚拟完成时间为
+    max(系统虚拟时间, 该用户上一个任务的虚拟完成时间) + 成本 / 通道权重，
+    总是优先准入虚拟完成时间最小的任务，因此一次提交大量代码的用户不会饿死其他用户。
+    """
+
+    def __init__(self, max_running: int, max_running_cost: int, max_running_per_user: int,
+                 max_pending_per_user: int, lane_weights: Dict[str, float]):
+        self.max_running = max_running
+        self.max_running_cost = max_running_cost
+        self.max_running_per_user = max_running_per_user
+        self.max_pending_per_user = max_pending_per_user
+        self.lane_weights = lane_weights
+        self._pending: List[ScheduledTask] = []
+        self._running: Dict[str, ScheduledTask] = {}
+        self._virtual_time = 0.0
+        self._user_finish: Dict[str, float] = {}
+        # 按最近任务的执行耗时和队列深度估算等待时间
+        self.wait_estimator = WaitTimeEstimator(settings.QUEUE_ESTIMATOR_WINDOW, settings.QUEUE_INITIAL_RUN_SECONDS)
+        # 已结束任务的有界历史（按结束时间排列，超过TTL的记录在读取时淘汰）
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=settings.QUEUE_HISTORY_SIZE)
+        self.stats = {STATUS_COMPLETED: 0, STATUS_FAILED: 0, STATUS_CANCELLED: 0, STATUS_DISCONNECTED: 0}
+        # 客户端断开时尚未生成的片段数
+        self.abandoned_snippets = 0
+        self.wait_histogram = LatencyHistogram()
+        self.run_histogram = LatencyHistogram()
+        self.snippet_histogram = LatencyHistogram()
+
+    # ---- 提交与准入 ----
+
+    def submit(self, user_id: str, lane: str = LANE_INTERACTIVE, cost: int = 0) -> ScheduledTask:
+        """
+        提交任务
+
+        Args:
+            user_id: 用户ID
+            lane: 通道（interactive / batch）
+            cost: 预估token成本
+
+        Returns:
+            调度任务
+
+        Raises:
+            ValueError: 如果通道不存在
+            QueueFullError: 如果用户等待中的任务超过配额
+        """
+        if lane not in self.lane_weights:
+            raise ValueError(f"Unknown queue lane: {lane}")
+
+        pending_for_user = sum(1 for task in self._pending if task.user_id == user_id)
+        if pending_for_user >= self.max_pending_per_user:
+            raise QueueFullError(f"用户 {user_id} 等待中的任务已达上限 {self.max_pending_per_user}")
+
+        cost = max(1, cost)
+        start_tag = max(self._virtual_time, self._user_finish.get(user_id, 0.0))
+        finish_tag = start_tag + cost / self.lane_weights[lane]
+        self._user_finish[user_id] = finish_tag
+
+        task = ScheduledTask(user_id, lane, cost, finish_tag)
+        self._pending.append(task)
+        self._pending.sort(key=lambda pending: pending.finish_tag)
+        logger.info(f"Queued task {task.task_id} (user={user_id}, lane={lane}, cost={cost})")
+        self._dispatch()
+        return task
+
+    def _running_for_user(self, user_id: str) -> int:
+        return sum(1 for task in self._running.values() if task.user_id == user_id)
+
+    def _running_cost(self) -> int:
+        return sum(task.cost for task in self._running.values())
+
+    def _dispatch(self) -> None:
+        """按虚拟完成时间准入等待中的任务"""
+        index = 0
+        while index < len(self._pending) and len(self._running) < self.max_running:
+            task = self._pending[index]
+            if self._running_for_user(task.user_id) >= self.max_running_per_user:
+                index += 1
+                continue
+            # 成本超出剩余预算时停止准入，避免大任务被小任务持续插队；没有运行任务时总是准入
+            if self._running and self._running_cost() + task.cost > self.max_running_cost:
+                break
+
+            self._pending.pop(index)
+            task.status = STATUS_RUNNING
+            task.started_at = time.time()
+            self._running[task.task_id] = task
+            self._virtual_time = max(self._virtual_time, task.finish_tag - task.cost / self.lane_weights[task.lane])
+            if not task.admitted.done():
+                task.admitted.set_result(None)
+
+    async def wait_admitted(self, task: ScheduledTask, timeout: Optional[float] = None) -> bool:
+        """
+        等待任务被准入
+
+        Args:
+            task: 调度任务
+            timeout: 最长等待秒数，为None时一直等待
+
+        Returns:
+            是否已准入（超时返回False）
+
+        Raises:
+            TaskCancelledError: 如果任务在等待中被取消
+        """
+        try:
+            await asyncio.wait_for(asyncio.shield(task.admitted), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def finish(self, task: ScheduledTask, status: str, error: Optional[str] = None) -> None:
+        """
+        结束任务并释放名额
+
+        Args:
+            task: 调度任务
+            status: 结束状态
+            error: 错误信息（可选）
+        """
+        if task.status == STATUS_PENDING and task in self._pending:
+            self._pending.remove(task)
+        self._running.pop(task.task_id, None)
+
+        task.status = status
+        task.error = error
+        task.finished_at = time.time()
+        task.runner = None
+        self.stats[status] = self.stats.get(status, 0) + 1
+        if status == STATUS_DISCONNECTED and task.progress.get("total"):
+            skipped = max(0, task.progress["total"] - task.progress.get("completed", 0))
+            self.abandoned_snippets += skipped
+            logger.info(f"Task {task.task_id} abandoned by client, {skipped} snippets skipped")
+        if task.started_at is not None:
+            self.wait_histogram.record(task.wait_time)
+            if status == STATUS_COMPLETED:
+                run_seconds = task.run_time
+                self.run_histogram.record(run_seconds)
+                self.wait_estimator.record(run_seconds)
+        self._history.append(task.to_dict())
+        logger.info(f"Task {task.task_id} finished with status {status}")
+        # 立即释放名额，结束状态通过历史记录查询
+        self._dispatch()
+
+    def record_snippet_time(self, seconds: float) -> None:
+        """记录单个代码片段的生成耗时（秒）"""
+        self.snippet_histogram.record(seconds)
+
+    def _prune_history(self) -> None:
+        """淘汰超过TTL的历史记录"""
+        expire_before = time.time() - settings.QUEUE_HISTORY_TTL
+        while self._history and self._history[0]["end_time"] < expire_before:
+            self._history.popleft()
+
+    # ---- 执行 ----
+
+    async def execute(self, task_func: Callable[[], Awaitable[Any]], user_id: str = "anonymous",
+                      lane: str = LANE_INTERACTIVE, cost: int = 0) -> Any:
+        """
+        在调度下执行协程任务
+
+        Args:
+            task_func: 创建协程的函数
+            user_id: 用户ID
+            lane: 通道
+            cost: 预估token成本
+
+        Returns:
+            任务结果
+        """
+        task = self.submit(user_id, lane, cost)
+        status = STATUS_FAILED
+        error = None
+        try:
+            await self.wait_admitted(task)
+            task.runner = asyncio.current_task()
+            result = await task_func()
+            status = STATUS_COMPLETED
+            return result
+        except asyncio.CancelledError:
+            status = STATUS_CANCELLED
+            if not task.cancel_requested:
+                raise
+            # 通过取消接口取消：转换为 TaskCancelledError，让调用方正常返回响应
+            _uncancel_current_task()
+            raise TaskCancelledError(f"Task {task.task_id} cancelled")
+        except TaskCancelledError:
+            status = STATUS_CANCELLED
+            raise
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self.finish(task, status, error)
+
+    async def stream(self, stream_factory: Callable[[ScheduledTask], AsyncIterator],
+                     user_id: str = "anonymous", lane: str = LANE_INTERACTIVE, cost: int = 0,
+                     queued_event: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                     cancelled_event: Optional[Callable[[ScheduledTask], Any]] = None,
+                     rejected_event: Optional[Callable[[Exception], Any]] = None,
+                     is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> AsyncIterator:
+        """
+        在调度下执行流式任务，整个流式输出期间占用名额
+
+        等待期间按 QUEUE_STATUS_UPDATE_INTERVAL 产出排队状态（位置、预计等待时间）；
+        任务被取消时产出取消事件后结束；超出用户配额或通道不存在时产出拒绝事件（未提供时抛出异常）。
+        提供 is_disconnected 时按 STREAM_DISCONNECT_POLL_INTERVAL 检查客户端是否断开，
+        断开后等待中的任务直接出队，执行中的任务被取消（进而中止进行中的提供商调用）并释放名额。
+
+        Args:
+            stream_factory: 以调度任务为参数创建异步生成器的函数
+            user_id: 用户ID
+            lane: 通道
+            cost: 预估token成本
+            queued_event: 把排队状态转换为输出内容的函数（可选）
+            cancelled_event: 生成取消事件输出内容的函数（可选）
+            rejected_event: 生成拒绝事件输出内容的函数（可选）
+            is_disconnected: 检查客户端是否已断开的函数（可选）
+
+        Yields:
+            流式任务产出的内容
+
+        Raises:
+            ValueError: 如果通道不存在且未提供 rejected_event
+            QueueFullError: 如果超出用户配额且未提供 rejected_event
+        """
+        try:
+            task = self.submit(user_id, lane, cost)
+        except (ValueError, QueueFullError) as e:
+            if rejected_event is None:
+                raise
+            yield rejected_event(e)
+            return
+
+        status = STATUS_FAILED
+        error = None
+        watcher: Optional[asyncio.Task] = None
+        poll_interval = settings.QUEUE_STATUS_UPDATE_INTERVAL
+        if is_disconnected is not None:
+            poll_interval = min(poll_interval, settings.STREAM_DISCONNECT_POLL_INTERVAL)
+        try:
+            last_queued_event = 0.0
+            while True:
+                if queued_event is not None and time.monotonic() - last_queued_event >= settings.QUEUE_STATUS_UPDATE_INTERVAL:
+                    queue_status = self.get_task_status(task.task_id)
+                    if queue_status and queue_status["status"] == STATUS_PENDING:
+                        last_queued_event = time.monotonic()
+                        yield queued_event(queue_status)
+                if await self.wait_admitted(task, poll_interval):
+                    break
+                if is_disconnected is not None and await is_disconnected():
+                    task.disconnected = True
+                    status = STATUS_DISCONNECTED
+                    return
+
+            task.runner = asyncio.current_task()
+            if is_disconnected is not None:
+                watcher = asyncio.create_task(self._watch_disconnect(task, is_disconnected))
+            async with aclosing(stream_factory(task)) as stream:
+                async for chunk in stream:
+                    yield chunk
+            status = STATUS_COMPLETED
+        except GeneratorExit:
+            status = STATUS_CANCELLED if task.cancel_requested else STATUS_DISCONNECTED
+            raise
+        except asyncio.CancelledError:
+            if task.disconnected:
+                # 检测到客户端断开：没有人读取输出，吞掉取消信号后直接结束
+                _uncancel_current_task()
+                status = STATUS_DISCONNECTED
+                return
+            status = STATUS_CANCELLED if task.cancel_requested else STATUS_DISCONNECTED
+            if not task.cancel_requested:
+                raise
+            # 通过取消接口取消：吞掉取消信号，产出取消事件后正常结束响应
+            _uncancel_current_task()
+            if cancelled_event is not None:
+                yield cancelled_event(task)
+        except TaskCancelledError:
+            status = STATUS_CANCELLED
+            if cancelled_event is not None:
+                yield cancelled_event(task)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            self.finish(task, status, error)
+
+    async def _watch_disconnect(self, task: ScheduledTask, is_disconnected: Callable[[], Awaitable[bool]]) -> None:
+        """执行期间定期检查客户端是否断开，断开时取消执行协程"""
+        while task.runner is not None and not task.runner.done():
+            await asyncio.sleep(settings.STREAM_DISCONNECT_POLL_INTERVAL)
+            try:
+                disconnected = await is_disconnected()
+            except Exception as e:
+                logger.warning(f"Disconnect check failed for task {task.task_id}: {e}")
+                return
+            if disconnected:
+                logger.info(f"Client of task {task.task_id} disconnected, cancelling generation")
+                task.disconnected = True
+                task.runner.cancel()
+                return
+
+    # ---- 取消 ----
+
+    def cancel(self, task_id: str, user_id: Optional[str] = None) -> bool:
+        """
+        取消任务：等待中的任务直接出队，运行中的任务取消其执行协程（进而中止进行中的提供商调用）
+
+        Args:
+            task_id: 任务ID
+            user_id: 用户ID，提供时只能取消自己的任务
+
+        Returns:
+            是否找到并取消了任务
+
+        Raises:
+            PermissionError: 如果任务不属于该用户
+        """
+        task = self._running.get(task_id) or next((t for t in self._pending if t.task_id == task_id), None)
+        if task is None:
+            return False
+        if user_id is not None and task.user_id != user_id:
+            raise PermissionError("Access denied")
+
+        task.cancel_requested = True
+        if task.status == STATUS_PENDING:
+            self._pending.remove(task)
+            if not task.admitted.done():
+                task.admitted.set_exception(TaskCancelledError(f"Task {task_id} cancelled"))
+            self._dispatch()
+        elif task.runner is not None and not task.runner.done():
+            task.runner.cancel()
+        logger.info(f"Task {task_id} cancellation requested")
+        return True
+
+    # ---- 状态 ----
+
+    def estimate_wait(self, position: int) -> float:
+        """
+        按队列位置估算等待秒数
+
+        运行中的任务按已完成片段比例推算剩余时间，排在前面的任务按最近的平均执行耗时计算
+
+        Args:
+            position: 排在前面的任务数（新请求为当前等待中的任务数）
+
+        Returns:
+            预计等待秒数
+        """
+        running = []
+        for task in self._running.values():
+            total = task.progress.get("total") or 0
+            done = task.progress.get("completed", 0) / total if total else 0.0
+            running.append((task.run_time or 0.0, done))
+        return round(self.wait_estimator.estimate(running, position, self.max_running), 1)
+
+    def estimate_new_wait(self) -> float:
+        """估算现在提交的新任务的等待秒数"""
+        return self.estimate_wait(len(self._pending))
+
+    def get_task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态，等待中的任务附带队列位置和预计等待时间"""
+        task = self._running.get(task_id)
+        if task is not None:
+            return task.to_dict()
+        for position, pending in enumerate(self._pending):
+            if pending.task_id == task_id:
+                data = pending.to_dict()
+                data["position"] = position + 1
+                data["estimated_wait"] = self.estimate_wait(position)
+                return data
+        self._prune_history()
+        for finished in reversed(self._history):
+            if finished["task_id"] == task_id:
+                return dict(finished)
+        return None
+
+    def get_latency(self) -> Dict[str, Any]:
+        """获取排队等待、执行和单片段生成耗时的分位数统计（秒）"""
+        return {
+            "wait": self.wait_histogram.snapshot(),
+            "run": self.run_histogram.snapshot(),
+            "snippet": self.snippet_histogram.snapshot()
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取累计统计"""
+        finished = sum(self.stats.values())
+        return {
+            "total_tasks": finished + len(self._pending) + len(self._running),
+            "completed_tasks": self.stats[STATUS_COMPLETED],
+            "failed_tasks": self.stats[STATUS_FAILED],
+            "cancelled_tasks": self.stats[STATUS_CANCELLED],
+            "disconnected_tasks": self.stats[STATUS_DISCONNECTED],
+            "abandoned_snippets": self.abandoned_snippets,
+            "avg_wait_time": round(self.wait_histogram.mean, 3),
+            "avg_execution_time": round(self.run_histogram.mean, 3)
+        }
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取调度器状态"""
+        self._prune_history()
+        pending = []
+        for position, task in enumerate(self._pending):
+            data = task.to_dict()
+            data["position"] = position + 1
+            data["estimated_wait"] = self.estimate_wait(position)
+            pending.append(data)
+
+        lanes = {
+            lane: {
+                "pending": sum(1 for task in self._pending if task.lane == lane),
+                "running": sum(1 for task in self._running.values() if task.lane == lane),
+                "weight": weight
+            }
+            for lane, weight in self.lane_weights.items()
+        }
+        return {
+            "pending_tasks": len(self._pending),
+            "running_tasks": len(self._running),
+            "max_concurrent": self.max_running,
+            "available_slots": max(0, self.max_running - len(self._running)),
+            "running_cost": self._running_cost(),
+            "max_running_cost": self.max_running_cost,
+            "lanes": lanes,
+            "tasks": [task.to_dict() for task in self._running.values()],
+            "pending": pending,
+            "recent": list(self._history)[-settings.QUEUE_STATUS_RECENT_TASKS:],
+            "stats": self.get_stats(),
+            "latency": self.get_latency(),
+            "estimated_wait": self.estimate_new_wait(),
+            "service_time": round(self.wait_estimator.service_time, 3)
+        }
+
+# 全局调度器实例
+_scheduler: Optional[FairShareScheduler] = None
+
+def get_scheduler() -> FairShareScheduler:
+    """获取全局调度器实例"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FairShareScheduler(
+            max_running=settings.QUEUE_MAX_CONCURRENT_TASKS,
+            max_running_cost=settings.QUEUE_MAX_RUNNING_COST,
+            max_running_per_user=settings.QUEUE_MAX_RUNNING_PER_USER,
+            max_pending_per_user=settings.QUEUE_MAX_PENDING_PER_USER,
+            lane_weights=dict(settings.QUEUE_LANE_WEIGHTS)
+        )
+    return _scheduler
@@ -1,8 +1,16 @@
-from typing import List
+import asyncio
+import time
+from typing import Dict, List, Optional, AsyncIterator, Callable, Awaitable, Tuple, Any
 
 from app.models.schemas import CodeSnippet, TestResult
 from app.services.parser_factory import ParserFactory
-from app.services.ai_service import generate_test_with_ai
+from app.services.ai_service import generate_test_with_ai, generate_packed_tests_with_ai, DeltaCallback
+from app.services.prompt_packing import pack_snippets, pack_file_stem, split_python_tests
+from app.services.task_scheduler import get_scheduler
+from app.services.deadline import Deadline
+from app.services.executors import run_blocking, EXECUTOR_PARSE
+from app.services.parse_cache import get_parse_cache, get_shared_source_store, ParseHandleNotFoundError
+from app.config import settings, get_ai_models
 from app.utils.logger import logger
 
 def _get_test_file_extension(language: str) -> str:
@@ -35,7 +43,362 @@ def parse_code(code: str, language: str, file_path: str = None) -> List[CodeSnip
     parser = ParserFactory.get_parser(language)
     return parser.parse_code(code, file_path)
 
-def generate_tests(code: str, language: str, model: str, file_path: str = None) -> List[TestResult]:
+async def parse_code_async(code: str, language: str, file_path: str = None) -> List[CodeSnippet]:
+    """
+    在解析线程池中解析代码，避免大文件解析阻塞事件循环
+
+    解析结果按内容哈希缓存，同一份代码重新生成、切换模型或重试时不再重复解析。
+
+    Args:
+        code: 代码字符串
+        language: 编程语言
+        file_path: 代码文件路径，用于生成正确的导入语句
+
+    Returns:
+        代码片段列表
+
+    Raises:
+        ValueError: 如果不支持指定的语言
+        ExecutorSaturatedError: 如果解析线程池已满
+    """
+    cache = get_parse_cache()
+    snippets = cache.get_snippets(language, code)
+    if snippets is None:
+        snippets = await run_blocking(EXECUTOR_PARSE, parse_code, code, language)
+        cache.put(language, code, snippets)
+    # 缓存中的片段不带文件路径，按本次请求复制
+    return [snippet.model_copy(update={"file_path": file_path}) for snippet in snippets]
+
+async def prepare_source(code: str, language: Optional[str]) -> Optional[str]:
+    """
+    登记源代码并预先解析，返回解析句柄（上传文件和获取Git文件内容时调用）
+
+    解析失败或解析线程池已满时仍返回句柄，生成时再解析。
+    配置了共享登记（多实例部署）时源代码同时写入共享登记，写入失败时不返回句柄，
+    避免签发其他实例取不回的句柄。
+
+    Args:
+        code: 代码字符串
+        language: 编程语言
+
+    Returns:
+        解析句柄，语言不支持、代码太大无法登记或共享登记失败时返回None
+    """
+    if not code or language not in ParserFactory.get_supported_languages():
+        return None
+    handle = get_parse_cache().put(language, code)
+    if handle is None:
+        return None
+    shared = get_shared_source_store()
+    if shared is not None:
+        try:
+            await asyncio.to_thread(shared.put, handle, language, code)
+        except Exception as e:
+            logger.warning(f"登记共享解析句柄失败，不返回句柄: {e}")
+            return None
+    try:
+        await parse_code_async(code, language)
+    except Exception as e:
+        logger.warning(f"预先解析 {language} 代码失败，生成时重新解析: {e}")
+    return handle
+
+async def resolve_source(code: str, language: str, parse_handle: Optional[str]) -> str:
+    """
+    获取生成请求的源代码：提交了代码时使用代码，否则按解析句柄取回登记的代码
+    （本实例缓存中没有时从共享登记取回，句柄可能由其他实例签发）
+
+    Args:
+        code: 请求中的代码
+        language: 请求中的语言
+        parse_handle: 请求中的解析句柄
+
+    Returns:
+        源代码
+
+    Raises:
+        ParseHandleNotFoundError: 如果只提交了句柄且句柄不存在
+        ValueError: 如果句柄对应的语言与请求不一致
+    """
+    if (code and code.strip()) or not parse_handle:
+        return code
+    cache = get_parse_cache()
+    try:
+        handle_language, source = cache.get_source(parse_handle)
+    except ParseHandleNotFoundError:
+        shared = get_shared_source_store()
+        entry = await asyncio.to_thread(shared.get, parse_handle) if shared is not None else None
+        if entry is None:
+            raise
+        handle_language, source = entry
+        cache.put(handle_language, source)
+    if handle_language != language:
+        raise ValueError(f"Parse handle language {handle_language} does not match request language {language}")
+    return source
+
+def resolve_concurrency(model: str, requested: Optional[int] = None) -> int:
+    """
+    计算单个请求内的片段并发生成数
+
+    请求级别的并发数不能超过模型配置的 fanout_concurrency，
+    二者都受全局上限 AI_FANOUT_MAX_CONCURRENCY 约束。
+
+    Args:
+        model: AI模型名称
+        requested: 请求指定的并发数（可选）
+
+    Returns:
+        实际使用的并发数（至少为1）
+    """
+    model_config = get_ai_models().get(model, {})
+    model_limit = int(model_config.get("fanout_concurrency", settings.AI_FANOUT_DEFAULT_CONCURRENCY))
+    limit = min(requested or model_limit, model_limit, settings.AI_FANOUT_MAX_CONCURRENCY)
+    return max(1, limit)
+
+# 片段文本增量回调：(片段序号, 增量文本, 第几次尝试)
+SnippetDeltaCallback = Callable[[int, str, int], Awaitable[None]]
+
+async def generate_test_result(index: int, snippet: CodeSnippet, model: str, enhanced_prompt: str = None,
+                               use_cache: bool = True, on_delta: Optional[DeltaCallback] = None,
+                               deadline: Optional[Deadline] = None) -> TestResult:
+    """
+    为单个代码片段生成测试结果，失败时返回带错误信息的结果
+
+    Args:
+        index: 片段在解析结果中的原始序号
+        snippet: 代码片段
+        model: AI模型名称
+        enhanced_prompt: 增强的提示（可选）
+        use_cache: 是否读取响应缓存
+        on_delta: 文本增量回调（可选）
+        deadline: 请求截止时间（可选），超时的片段返回失败结果
+
+    Returns:
+        测试结果
+    """
+    try:
+        # 使用AI服务生成测试
+        logger.info(f"Generating test for {snippet.name}")
+        test_code = await generate_test_with_ai(snippet, enhanced_prompt, model, use_cache, on_delta, deadline)
+
+        # 生成测试文件名
+        test_file_name = f"test_{snippet.name.lower()}.{_get_test_file_extension(snippet.language)}"
+        logger.info(f"Generated test file name: {test_file_name}")
+
+        return TestResult(
+            name=snippet.name,
+            type=snippet.type,
+            test_code=test_code,
+            original_snippet=snippet,
+            file_name=test_file_name,
+            index=index
+        )
+    except Exception as e:
+        logger.error(f"Error generating test for {snippet.name}: {e}")
+        test_code = f"# Error generating test: {str(e)}\n\n# 请手动编写测试"
+        return TestResult(
+            name=snippet.name,
+            type=snippet.type,
+            test_code=test_code,
+            original_snippet=snippet,
+            file_name=None,
+            index=index
+        )
+
+def _split_pack_results(indices: List[int], pack: List[CodeSnippet], test_code: str) -> List[TestResult]:
+    """
+    把打包生成的测试模块拆分回各个片段的测试结果
+
+    Python按测试函数名拆分，每个片段得到公共部分加自己的测试；
+    其他语言（或拆分失败、片段没有匹配到测试时）整个模块归属于组内每个片段，
+    并使用同一个文件名。
+    """
+    language = pack[0].language
+    extension = _get_test_file_extension(language)
+    module_file_name = f"test_{pack_file_stem(pack)}.{extension}"
+
+    parts = None
+    if language == "python":
+        parts = split_python_tests(test_code, [snippet.name for snippet in pack])
+
+    results = []
+    for index, snippet in zip(indices, pack):
+        if parts and snippet.name in parts:
+            snippet_code = parts[snippet.name]
+            file_name = f"test_{snippet.name.lower()}.{extension}"
+        else:
+            snippet_code = test_code
+            file_name = module_file_name
+        results.append(TestResult(
+            name=snippet.name,
+            type=snippet.type,
+            test_code=snippet_code,
+            original_snippet=snippet,
+            file_name=file_name,
+            index=index
+        ))
+    return results
+
+async def generate_pack_results(indices: List[int], snippets: List[CodeSnippet], model: str, enhanced_prompt: str = None,
+                                use_cache: bool = True, on_delta: Optional[DeltaCallback] = None,
+                                deadline: Optional[Deadline] = None) -> Optional[List[TestResult]]:
+    """
+    为一组片段生成测试结果；组内只有一个片段时按单片段生成
+
+    打包生成失败时返回None，由调用方把组内片段逐个重新放回有界并发的扇出
+
+    Args:
+        indices: 组内片段的原始序号
+        snippets: 全部代码片段
+        model: AI模型名称
+        enhanced_prompt: 增强的提示（可选）
+        use_cache: 是否读取响应缓存
+        on_delta: 文本增量回调（可选）
+        deadline: 请求截止时间（可选）
+
+    Returns:
+        测试结果列表，打包生成失败时返回None
+    """
+    pack = [snippets[i] for i in indices]
+    if len(pack) == 1:
+        return [await generate_test_result(indices[0], pack[0], model, enhanced_prompt, use_cache, on_delta, deadline)]
+
+    names = ", ".join(snippet.name for snippet in pack)
+    try:
+        logger.info(f"Generating packed test for [{names}]")
+        test_code = await generate_packed_tests_with_ai(pack, enhanced_prompt, model, use_cache, on_delta, deadline)
+    except Exception as e:
+        logger.warning(f"Packed generation failed for [{names}], falling back to per-snippet generation: {e}")
+        return None
+
+    return _split_pack_results(indices, pack, test_code)
+
+async def generate_tests_concurrently(snippets: List[CodeSnippet], model: str, concurrency: int = 1,
+                                      enhanced_prompt: str = None, use_cache: bool = True,
+                                      on_delta: Optional[SnippetDeltaCallback] = None,
+                                      pack_mode: Optional[str] = None,
+                                      deadline: Optional[Deadline] = None) -> AsyncIterator[TestResult]:
+    """
+    并发生成多个代码片段的测试，按完成顺序产出结果
+
+    Args:
+        snippets: 代码片段列表
+        model: AI模型名称
+        concurrency: 最大并发数
+        enhanced_prompt: 所有片段共用的增强提示（可选）
+        use_cache: 是否读取响应缓存
+        on_delta: 片段文本增量回调（可选），打包生成时增量归属于组内第一个片段
+        pack_mode: 提示打包模式（可选），"class" 按类打包，"file" 整个文件打包
+        deadline: 请求截止时间（可选），传给每个片段的生成
+
+    Yields:
+        测试结果，index字段为片段的原始序号
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    if pack_mode:
+        packs = pack_snippets(snippets, pack_mode, settings.AI_PACK_TOKEN_BUDGET)
+        logger.info(f"Packed {len(snippets)} snippets into {len(packs)} prompts (mode: {pack_mode})")
+    else:
+        packs = [[i] for i in range(len(snippets))]
+
+    async def _run(indices: List[int]) -> Optional[List[TestResult]]:
+        pack_on_delta = None
+        if on_delta is not None:
+            async def pack_on_delta(delta: str, attempt: int):
+                await on_delta(indices[0], delta, attempt)
+
+        async with semaphore:
+            started = time.monotonic()
+            results = await generate_pack_results(indices, snippets, model, enhanced_prompt, use_cache, pack_on_delta,
+                                                  deadline)
+            if results is None:
+                return None
+            # 打包生成时耗时平摊到组内每个片段
+            per_snippet = (time.monotonic() - started) / max(len(results), 1)
+            scheduler = get_scheduler()
+            for _ in results:
+                scheduler.record_snippet_time(per_snippet)
+            return results
+
+    # 任务 -> 组内片段的原始序号
+    tasks: Dict[asyncio.Task, List[int]] = {asyncio.create_task(_run(indices)): indices for indices in packs}
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                indices = tasks.pop(task)
+                results = task.result()
+                if results is None:
+                    # 打包生成失败：组内片段逐个重新排队，同样受并发上限约束
+                    for index in indices:
+                        tasks[asyncio.create_task(_run([index]))] = [index]
+                    continue
+                for result in results:
+                    yield result
+    finally:
+        # 消费方提前退出时取消尚未完成的生成，并等待取消完成（提供商请求中止、限流名额归还）
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+async def generate_test_events(snippets: List[CodeSnippet], model: str, concurrency: int = 1,
+                               enhanced_prompt: str = None, use_cache: bool = True,
+                               stream_deltas: bool = False, pack_mode: Optional[str] = None,
+                               deadline: Optional[Deadline] = None) -> AsyncIterator[Tuple[Any, ...]]:
+    """
+    并发生成测试，并把文本增量与最终结果合并为一个事件流
+
+    Args:
+        snippets: 代码片段列表
+        model: AI模型名称
+        concurrency: 最大并发数
+        enhanced_prompt: 所有片段共用的增强提示（可选）
+        use_cache: 是否读取响应缓存
+        stream_deltas: 是否转发模型输出的文本增量
+        pack_mode: 提示打包模式（可选）
+        deadline: 请求截止时间（可选）
+
+    Yields:
+        ("delta", 片段序号, 增量文本, 第几次尝试) 或 ("result", TestResult)
+    """
+    # 有界缓冲：消费方读得慢时，生成端在 put 处等待，进而暂停读取提供商的流式响应
+    events: asyncio.Queue = asyncio.Queue(maxsize=settings.STREAM_EVENT_BUFFER_SIZE)
+    finished = object()
+
+    async def _on_delta(index: int, delta: str, attempt: int):
+        await events.put(("delta", index, delta, attempt))
+
+    async def _produce():
+        try:
+            async for result in generate_tests_concurrently(snippets, model, concurrency, enhanced_prompt, use_cache,
+                                                            _on_delta if stream_deltas else None, pack_mode,
+                                                            deadline):
+                await events.put(("result", result))
+        except Exception as e:
+            await events.put((finished, e))
+        else:
+            await events.put((finished, None))
+
+    producer = asyncio.create_task(_produce())
+    try:
+        while True:
+            event = await events.get()
+            if event[0] is finished:
+                # 传播生成过程中的异常
+                if event[1] is not None:
+                    raise event[1]
+                break
+            yield event
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+async def generate_tests(code: str, language: str, model: str, file_path: str = None,
+                         max_concurrency: Optional[int] = None, use_cache: bool = True,
+                         pack_mode: Optional[str] = None, deadline: Optional[Deadline] = None) -> List[TestResult]:
     """
     生成测试代码
 
@@ -44,50 +407,34 @@ def generate_tests(code: str, language: str, model: str, file_path: str = None)
         language: 编程语言
         model: AI模型名称
         file_path: 代码文件路径，用于生成正确的导入语句
+        max_concurrency: 请求指定的最大并发数（可选）
+        use_cache: 是否读取响应缓存
+        pack_mode: 提示打包模式（可选）
+        deadline: 请求截止时间（可选），超时的片段返回失败结果
 
     Returns:
-        测试结果列表
+        测试结果列表（按片段原始顺序）
 
     Raises:
         ValueError: 如果不支持指定的语言或模型
     """
     # 解析代码
-    snippets = parse_code(code, language, file_path)
+    parse = parse_code_async(code, language, file_path)
+    snippets = await (deadline.run(parse, "parse") if deadline is not None else parse)
 
-    # 生成测试
-    results = []
-    for snippet in snippets:
-        try:
-            # 使用AI服务生成测试
-            logger.info(f"Generating test for {snippet.name}")
-            test_code = generate_test_with_ai(snippet, None, model)
-
-            # 生成测试文件名
-            test_file_name = f"test_{snippet.name.lower()}.{_get_test_file_extension(language)}"
-            logger.info(f"Generated test file name: {test_file_name}")
-
-            # 添加测试结果
-            results.append(TestResult(
-                name=snippet.name,
-                type=snippet.type,
-                test_code=test_code,
-                original_snippet=snippet,
-                file_name=test_file_name
-            ))
-        except Exception as e:
-            logger.error(f"Error generating test for {snippet.name}: {e}")
-            test_code = f"# Error generating test: {str(e)}\n\n# 请手动编写测试"
-            results.append(TestResult(
-                name=snippet.name,
-                type=snippet.type,
-                test_code=test_code,
-                original_snippet=snippet,
-                file_name=None
-            ))
+    # 并发生成测试
+    concurrency = resolve_concurrency(model, max_concurrency)
+    results = [
+        result async for result in generate_tests_concurrently(snippets, model, concurrency, use_cache=use_cache,
+                                                               pack_mode=pack_mode, deadline=deadline)
+    ]
+    results.sort(key=lambda result: result.index)
 
     return results
 
-async def generate_tests_stream(code: str, language: str, model: str, file_path: str = None):
+async def generate_tests_stream(code: str, language: str, model: str, file_path: str = None,
+                                max_concurrency: Optional[int] = None, use_cache: bool = True,
+                                pack_mode: Optional[str] = None, deadline: Optional[Deadline] = None):
     """
     流式生成测试代码
 
@@ -96,42 +443,23 @@ async def generate_tests_stream(code: str, language: str, model: str, file_path:
         language: 编程语言
         model: AI模型名称
         file_path: 代码文件路径，用于生成正确的导入语句
+        max_concurrency: 请求指定的最大并发数（可选）
+        use_cache: 是否读取响应缓存
+        pack_mode: 提示打包模式（可选）
+        deadline: 请求截止时间（可选）
 
     Yields:
-        测试结果，一次生成一个
+        测试结果，按完成顺序产出，index字段为片段的原始序号
 
     Raises:
         ValueError: 如果不支持指定的语言或模型
     """
     # 解析代码
-    snippets = parse_code(code, language, file_path)
+    parse = parse_code_async(code, language, file_path)
+    snippets = await (deadline.run(parse, "parse") if deadline is not None else parse)
 
-    # 生成测试
-    for snippet in snippets:
-        try:
-            # 使用AI服务生成测试
-            logger.info(f"Generating test for {snippet.name}")
-            test_code = generate_test_with_ai(snippet, None, model)
-
-            # 生成测试文件名
-            test_file_name = f"test_{snippet.name.lower()}.{_get_test_file_extension(language)}"
-            logger.info(f"Generated test file name: {test_file_name}")
-
-            # 添加测试结果
-            yield TestResult(
-                name=snippet.name,
-                type=snippet.type,
-                test_code=test_code,
-                original_snippet=snippet,
-                file_name=test_file_name
-            )
-        except Exception as e:
-            logger.error(f"Error generating test for {snippet.name}: {e}")
-            test_code = f"# Error generating test: {str(e)}\n\n# 请手动编写测试"
-            yield TestResult(
-                name=snippet.name,
-                type=snippet.type,
-                test_code=test_code,
-                original_snippet=snippet,
-                file_name=None
-            )
+    # 并发生成测试
+    concurrency = resolve_concurrency(model, max_concurrency)
+    async for result in generate_tests_concurrently(snippets, model, concurrency, use_cache=use_cache,
+                                                    pack_mode=pack_mode, deadline=deadline):
+        yield result
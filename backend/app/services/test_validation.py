@@ -0,0 +1,259 @@
+"""
+生成测试的校验与本地修复
+按语言注册校验器：结构检查（无法解析、缺少测试函数等）不通过时才需要回到模型重新生成；
+规则校验（导入、patch目标等）发现的问题用预编译的改写规则在本地修复，修复不了的只作为警告
+"""
+
+import ast
+import re
+from typing import List, Dict, Callable
+
+from app.models.schemas import CodeSnippet
+
+# Python测试中被测模块的固定路径
+PYTHON_MODULE_PATH = "broadcast"
+
+# 模型常用的占位模块名
+_PLACEHOLDER_MODULES = r"(?:your_module|your_module_name|my_module|mymodule|module_name)"
+
+
+class ValidationResult:
+    """
+    校验结果
+
+    Attributes:
+        code: 测试代码（修复后）
+        errors: 结构性错误，需要回到模型重新生成
+        warnings: 本地修复后仍不满足的规则，不影响校验结果
+        repaired: 是否应用过本地修复
+    """
+
+    def __init__(self, code: str, errors: List[str], repaired: bool = False, warnings: List[str] = None):
+        self.code = code
+        self.errors = errors
+        self.repaired = repaired
+        self.warnings = warnings or []
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+
+class RewriteRule:
+    """
+    预编译的改写规则
+
+    Args:
+        name: 规则名称（用于日志）
+        pattern: 匹配需要改写的代码的正则
+        replacement: 替换内容，可以是字符串或接收 (代码, 片段) 并返回新代码的函数
+    """
+
+    def __init__(self, name: str, pattern: str, replacement):
+        self.name = name
+        self.pattern = re.compile(pattern, re.MULTILINE)
+        self.replacement = replacement
+
+    def apply(self, code: str, snippet: CodeSnippet) -> str:
+        """应用规则，不匹配时原样返回"""
+        if not self.pattern.search(code):
+            return code
+        if callable(self.replacement):
+            return self.replacement(code, snippet)
+        return self.pattern.sub(self.replacement, code)
+
+
+class LanguageValidator:
+    """语言校验器基类，默认不做任何检查"""
+
+    language: str = ""
+    rules: List[RewriteRule] = []
+
+    def syntax_errors(self, code: str) -> List[str]:
+        """语法检查，返回结构性错误"""
+        return []
+
+    def structure_errors(self, code: str, snippet: CodeSnippet) -> List[str]:
+        """结构检查（语法正确的前提下），返回结构性错误"""
+        return []
+
+    def rule_errors(self, code: str, snippet: CodeSnippet) -> List[str]:
+        """规则校验，返回可以在本地修复（或可以接受）的问题"""
+        return []
+
+    def validate(self, code: str, snippet: CodeSnippet) -> ValidationResult:
+        """
+        只校验不修复
+
+        Args:
+            code: 测试代码
+            snippet: 被测代码片段
+
+        Returns:
+            校验结果
+        """
+        if not code or not code.strip():
+            return ValidationResult(code, ["生成的测试代码为空"])
+        errors = self.syntax_errors(code)
+        if not errors:
+            errors = self.structure_errors(code, snippet)
+        return ValidationResult(code, errors, warnings=self.rule_errors(code, snippet))
+
+    def validate_and_repair(self, code: str, snippet: CodeSnippet) -> ValidationResult:
+        """
+        校验，规则校验有问题时依次应用改写规则后再次校验
+
+        Args:
+            code: 测试代码
+            snippet: 被测代码片段
+
+        Returns:
+            校验结果，code为修复后的代码；只有 errors 非空时才需要重新提示模型
+        """
+        result = self.validate(code, snippet)
+        if not result.warnings or not code or not code.strip():
+            return result
+
+        repaired = code
+        for rule in self.rules:
+            repaired = rule.apply(repaired, snippet)
+        if repaired == code:
+            return result
+
+        repaired_result = self.validate(repaired, snippet)
+        repaired_result.repaired = True
+        return repaired_result
+
+
+def _prepend_line(line_for: Callable[[CodeSnippet], str]):
+    """生成在代码开头插入一行的改写函数"""
+    def _apply(code: str, snippet: CodeSnippet) -> str:
+        return line_for(snippet) + "\n" + code
+    return _apply
+
+
+class PythonValidator(LanguageValidator):
+    """Python（pytest）测试校验器"""
+
+    language = "python"
+    rules = [
+        RewriteRule("placeholder-import", rf"\bfrom\s+{_PLACEHOLDER_MODULES}\s+import\b",
+                    f"from {PYTHON_MODULE_PATH} import"),
+        RewriteRule("placeholder-patch-target", rf"(patch\(\s*['\"]){_PLACEHOLDER_MODULES}\.",
+                    rf"\g<1>{PYTHON_MODULE_PATH}."),
+        RewriteRule("missing-pytest-import", r"\A(?![\s\S]*^import pytest)",
+                    _prepend_line(lambda snippet: "import pytest")),
+        RewriteRule("missing-target-import", r"\A", lambda code, snippet: PythonValidator._add_target_import(code, snippet)),
+    ]
+
+    @staticmethod
+    def _target(snippet: CodeSnippet) -> str:
+        return snippet.class_name or snippet.name
+
+    @staticmethod
+    def _add_target_import(code: str, snippet: CodeSnippet) -> str:
+        target = PythonValidator._target(snippet)
+        pattern = re.compile(rf"from\s+{re.escape(PYTHON_MODULE_PATH)}\s+import\s+[^\n]*\b{re.escape(target)}\b")
+        if pattern.search(code):
+            return code
+        return f"from {PYTHON_MODULE_PATH} import {target}\n{code}"
+
+    def syntax_errors(self, code: str) -> List[str]:
+        try:
+            ast.parse(code)
+        except SyntaxError as e:
+            return [f"语法错误（第{e.lineno}行）：{e.msg}"]
+        return []
+
+    def structure_errors(self, code: str, snippet: CodeSnippet) -> List[str]:
+        if not re.search(rf"def\s+test_\w*{re.escape(snippet.name)}", code):
+            return [f"缺少测试函数：函数名应为 test_{snippet.name}_xxx"]
+        return []
+
+    def rule_errors(self, code: str, snippet: CodeSnippet) -> List[str]:
+        errors = []
+        target = self._target(snippet)
+        if not re.search(rf"from\s+{re.escape(PYTHON_MODULE_PATH)}\s+import\s+[^\n]*\b{re.escape(target)}\b", code):
+            errors.append(f"缺少导入语句：from {PYTHON_MODULE_PATH} import {target}")
+        if not re.search(r"^import pytest", code, re.MULTILINE):
+            errors.append("缺少 import pytest")
+        if re.search(rf"\bfrom\s+{_PLACEHOLDER_MODULES}\s+import\b", code):
+            errors.append(f"使用了占位模块名，应为 {PYTHON_MODULE_PATH}")
+        if "mock.patch" in code and f"mock.patch('{PYTHON_MODULE_PATH}." not in code \
+                and f"mock.patch(\"{PYTHON_MODULE_PATH}." not in code:
+            errors.append(f"mock.patch 的目标应以 '{PYTHON_MODULE_PATH}.' 开头")
+        return errors
+
+
+class BraceLanguageValidator(LanguageValidator):
+    """花括号语言（Java/Go/C++/C#）校验器，只检查括号是否配对，用于发现被截断的输出"""
+
+    _strings_and_comments = re.compile(
+        r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`[^`]*`|//[^\n]*|/\*[\s\S]*?\*/'
+    )
+
+    def __init__(self, language: str):
+        self.language = language
+
+    def syntax_errors(self, code: str) -> List[str]:
+        stripped = self._strings_and_comments.sub("", code)
+        depth = 0
+        for char in stripped:
+            if char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+                if depth < 0:
+                    return ["花括号不匹配：多余的 }"]
+        if depth:
+            return [f"花括号不匹配：缺少 {depth} 个 }}（代码可能被截断）"]
+        return []
+
+
+_validators: Dict[str, LanguageValidator] = {}
+_default_validator = LanguageValidator()
+
+
+def register_validator(validator: LanguageValidator) -> None:
+    """注册语言校验器"""
+    _validators[validator.language] = validator
+
+
+def get_validator(language: str) -> LanguageValidator:
+    """获取语言校验器，未注册的语言不做检查"""
+    return _validators.get(language, _default_validator)
+
+
+def build_repair_prompt(code: str, errors: List[str], snippet: CodeSnippet) -> str:
+    """
+    构建精简的修复提示，只包含当前代码和具体错误
+
+    Args:
+        code: 需要修复的测试代码
+        errors: 校验错误
+        snippet: 被测代码片段
+
+    Returns:
+        修复提示
+    """
+    error_lines = "\n".join(f"- {error}" for error in errors)
+    return f"""以下是为 {snippet.name} 生成的{snippet.language}测试代码，存在这些问题：
+{error_lines}
+
+请修复上述问题，只返回修复后的完整测试代码（一个代码块），不要包含解释。
+
+被测代码：
+```{snippet.language}
+{snippet.code}
+```
+
+测试代码：
+```{snippet.language}
+{code}
+```
+"""
+
+
+register_validator(PythonValidator())
+for _language in ("java", "go", "cpp", "csharp"):
+    register_validator(BraceLanguageValidator(_language))
@@ -0,0 +1,71 @@
+"""
+排队等待时间估算
+按最近任务的执行耗时和当前队列深度估算新请求的等待时间：
+运行中的任务按进度推算剩余时间，等待中的任务按平均执行耗时依次占用最早空出的名额
+"""
+
+import heapq
+from collections import deque
+from typing import List, Tuple
+
+
+class WaitTimeEstimator:
+    """
+    基于最近执行耗时的等待时间估算器
+
+    Args:
+        window: 参与计算的最近任务数
+        initial_service_time: 没有历史数据时使用的任务耗时（秒）
+    """
+
+    def __init__(self, window: int, initial_service_time: float):
+        self._samples: deque = deque(maxlen=max(1, window))
+        self._initial_service_time = initial_service_time
+
+    def record(self, seconds: float) -> None:
+        """记录一个已完成任务的执行耗时（秒）"""
+        self._samples.append(max(0.0, seconds))
+
+    @property
+    def service_time(self) -> float:
+        """最近任务的平均执行耗时（秒）"""
+        if not self._samples:
+            return self._initial_service_time
+        return sum(self._samples) / len(self._samples)
+
+    def remaining(self, elapsed: float, fraction_done: float) -> float:
+        """
+        估算运行中任务的剩余时间
+
+        Args:
+            elapsed: 已运行秒数
+            fraction_done: 已完成比例（0-1），没有进度信息时为0
+
+        Returns:
+            剩余秒数
+        """
+        if 0 < fraction_done < 1:
+            return elapsed * (1 - fraction_done) / fraction_done
+        return max(0.0, self.service_time - elapsed)
+
+    def estimate(self, running: List[Tuple[float, float]], queued: int, servers: int) -> float:
+        """
+        估算排在 queued 个任务之后的新任务的等待时间
+
+        Args:
+            running: 运行中任务的 (已运行秒数, 已完成比例)
+            queued: 排在前面的任务数
+            servers: 并发名额数
+
+        Returns:
+            预计等待秒数
+        """
+        servers = max(1, servers)
+        # 每个名额最早空出的时刻；空闲名额为0
+        free_at = sorted(self.remaining(elapsed, done) for elapsed, done in running)[:servers]
+        free_at += [0.0] * (servers - len(free_at))
+        heapq.heapify(free_at)
+        service_time = self.service_time
+        for _ in range(queued):
+            heapq.heappush(free_at, heapq.heappop(free_at) + service_time)
+        return free_at[0]
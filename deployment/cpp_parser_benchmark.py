@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+C++解析器性能测试脚本
+生成不同规模的模板密集型头文件（或读取指定文件），测量 CppParser 的解析耗时，
+检查耗时是否随文件大小线性增长
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import List, Dict
+
+# 添加backend目录到Python路径
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.config import settings
+from app.services.parsers.cpp_parser import CppParser
+
+
+def generate_header(classes: int) -> str:
+    """生成包含命名空间、模板类、类外定义和字符串/注释中大括号的头文件"""
+    parts = ["#pragma once", "#include <map>", "#include <vector>", "", "namespace bench {", ""]
+    for i in range(classes):
+        parts.append(f"""
+/* class Fake{i} {{ not a class }} */
+template <typename K, typename V = std::map<K, std::vector<std::pair<K, V>>>, int N = (sizeof(K) > 4)>
+class Container{i} : public Base<Container{i}<K, V, N>> {{
+public:
+    Container{i}() : items_{{}}, size_(0) {{ }}
+    template <typename F>
+    auto transform(F&& f) const -> std::vector<decltype(f(std::declval<V>()))> {{
+        std::vector<decltype(f(std::declval<V>()))> out;
+        for (const auto& item : items_) {{ out.push_back(f(item.second)); }}
+        return out;
+    }}
+    bool operator==(const Container{i}& other) const {{ return size_ == other.size_; }}
+    const char* name() const {{ return "Container{i} {{"; }}
+    std::size_t size() const noexcept;
+private:
+    std::map<K, V> items_;
+    std::size_t size_;
+}};
+
+template <typename K, typename V, int N>
+std::size_t Container{i}<K, V, N>::size() const noexcept {{
+    // }} closing brace in a comment
+    return size_;
+}}
+
+inline int helper{i}(int x) {{ return x > 0 ? x : -x; }}
+""")
+    parts.append("}  // namespace bench")
+    return "\n".join(parts)
+
+
+def run_benchmark(sources: List[Dict], repeat: int) -> List[Dict]:
+    """对每个源文件重复解析 repeat 次，取最快一次"""
+    parser = CppParser()
+    results = []
+    for source in sources:
+        code = source["code"]
+        timings = []
+        snippets = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            snippets = parser.parse_code(code)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        results.append({
+            "name": source["name"],
+            "lines": code.count("\n") + 1,
+            "size_kb": len(code) / 1024,
+            "snippets": len(snippets),
+            "seconds": best,
+            "mb_per_second": len(code) / (1024 * 1024) / best if best > 0 else float("inf")
+        })
+    return results
+
+
+def print_results(results: List[Dict]):
+    """打印结果表格，以及相对第一个文件的规模和耗时倍数"""
+    print(f"{'source':<24}{'lines':>10}{'size(KB)':>12}{'snippets':>10}{'time(s)':>10}{'MB/s':>8}{'size x':>8}{'time x':>8}")
+    base = results[0]
+    for result in results:
+        print(f"{result['name']:<24}{result['lines']:>10}{result['size_kb']:>12.1f}{result['snippets']:>10}"
+              f"{result['seconds']:>10.3f}{result['mb_per_second']:>8.2f}"
+              f"{result['size_kb'] / base['size_kb']:>8.1f}{result['seconds'] / base['seconds']:>8.1f}")
+    print(f"\n单文件时间预算 CPP_PARSE_TIME_BUDGET = {settings.CPP_PARSE_TIME_BUDGET}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="C++解析器性能测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 200, 400, 800],
+                        help="生成的头文件中的类数量")
+    parser.add_argument("--file", action="append", default=[], help="测试指定的C++文件（可多次指定）")
+    parser.add_argument("--repeat", type=int, default=3, help="每个文件的解析次数")
+    args = parser.parse_args()
+
+    if args.file:
+        sources = []
+        for path in args.file:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                sources.append({"name": os.path.basename(path), "code": f.read()})
+    else:
+        sources = [{"name": f"generated x{size}", "code": generate_header(size)} for size in args.sizes]
+
+    print_results(run_benchmark(sources, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ CREATE TABLE IF NOT EXISTS task_status (
     end_time TIMESTAMP WITH TIME ZONE,
     error_message TEXT,
     result_data JSONB,
+    lease_until TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
@@ -88,7 +88,9 @@ const QueueStatus = ({ visible = true, refreshInterval = 2000 }) => {
     max_ai_tasks = 2,
     active_streams = 0,
     stats = {},
-    stream_details = []
+    stream_details = [],
+    estimated_wait = 0,
+    overloaded = false
   } = queueStatus;
 
   // 计算使用率
@@ -235,6 +237,13 @@ const QueueStatus = ({ visible = true, refreshInterval = 2000 }) => {
             </Space>
           </div>
 
+          {/* 预计等待时间超过SLO时新请求会被拒绝 */}
+          {estimated_wait > 0 && (
+            <Text type={overloaded ? 'danger' : 'secondary'} style={{ fontSize: '12px' }}>
+              {overloaded ? '服务繁忙，新请求将被拒绝' : '新请求'}预计等待: {estimated_wait.toFixed(0)}s
+            </Text>
+          )}
+
           <Divider style={{ margin: '8px 0' }} />
 
           {/* 资源使用率 */}
@@ -151,6 +151,9 @@ export const generateTestsStream = async (code, language, model, onProgress, onT
       let processedLines = new Set();
 
       xhr.onprogress = function() {
+        // 非200响应（如队列过载返回的503）不是NDJSON流，在onload中处理
+        if (xhr.status !== 200) return;
+
         // 获取新的响应文本
         const responseText = xhr.responseText;
         const newText = responseText.substring(processedLength);
@@ -190,6 +193,10 @@ export const generateTestsStream = async (code, language, model, onProgress, onT
       xhr.onload = function() {
         if (xhr.status === 200) {
           resolve({ status: 'completed' });
+        } else if (xhr.status === 503) {
+          // 队列过载：按 Retry-After 提示用户稍后重试
+          const retryAfter = xhr.getResponseHeader('Retry-After');
+          reject(new Error(retryAfter ? `服务繁忙，请在 ${retryAfter} 秒后重试` : '服务繁忙，请稍后重试'));
         } else {
           console.error('XHR failed with status:', xhr.status);
           reject(new Error(`HTTP error! status: ${xhr.status}`));